@@ -2,12 +2,12 @@ import re
 import sys
 import os
 import cobra
-from tqdm import tqdm
+import telemetry as tm
 import pandas as pd
 import memote
 import helper_functions as hf
-from bioservices.kegg import KEGG
-import gffpandas.gffpandas as gffpd
+import kegg_flatfile as kf
+import gff_store as gs
 
 '''
 Usage: add_genes_from_kegg.py <path_input_sbml-file> <path_output_sbml-file> 
@@ -37,19 +37,14 @@ def main(args):
 
     # Read in files
     model = cobra.io.sbml.read_sbml_model(infile)
-    df = gffpd.read_gff3(gff_file)
-    df_attr = df.attributes_to_columns()
-    kegg = KEGG()
+    gff = gs.load_gff(gff_file)
 
     # find organism
-    req = kegg.lookfor_organism(name_organism)[0].split(' ')
-    entry = req[0]  # 'T00661'
-    org_id = req[1]  # 'fma'
+    entry, org_id = hf.kegg_organism(name_organism)  # 'T00661', 'fma'
     sbo_nr = "SBO:0000243"
 
     # Kegg genes extraction
-    genes = kegg.list(org_id).split("\n")[:-1]
-    genome_dict = {g.split("\t")[0].replace("fma:", ""): g.split("\t")[1] for g in genes}
+    genome_dict = hf.kegg_genome(org_id)
 
     # Data collection
     genes_current = pd.DataFrame(columns=["id", "locus_tag", "new_locus_tag", "keyword_search", "EC", "new/old"])
@@ -57,11 +52,14 @@ def main(args):
     genes_missing_refseq = pd.DataFrame(
         columns=["id", "locus_tag", "new_locus_tag", "keyword_search", "EC", "annotations"])
 
+    # Get info on all genes from KEGG
+    gene_records = hf.kegg_get_many([org_id + ":" + locus_tag for locus_tag in genome_dict.keys()])
+
     # -- Cobra model annotation
-    for locus_tag, name in tqdm(list(genome_dict.items())):
+    for (locus_tag, name), gene_record in tm.progress(list(zip(genome_dict.items(), gene_records))):
 
         # Get info on gene from KEGG
-        gene_dict = kegg.parse(kegg.get(org_id + ":" + locus_tag))
+        gene_dict = kf.parse(gene_record)
 
         # checking for keywords and EC numbers
         ec_matches = []
@@ -84,21 +82,21 @@ def main(args):
             annotations = {"kegg.genes": f"{org_id}:{locus_tag}", "sbo": sbo_nr}
 
         # Get info on gene from GFF File
-        locus_match = df_attr.loc[df_attr["old_locus_tag"] == locus_tag]
-        if locus_match.empty:
+        locus_match = gff.find("old_locus_tag", locus_tag)
+        if not locus_match:
             genes_missing_refseq.loc[len(genes_current.index)] = ["", locus_tag, "",
                                                                   keywords_matches, ec_matches, annotations]
             continue
 
-        index = locus_match.index[0]
+        gene_gff = locus_match[0]
         # barrier for non-protein coding genes
-        if df_attr.loc[index, "type"] != "gene" or df_attr.loc[index + 1, "type"] != "CDS":
+        if gene_gff["type"] != "gene" or gene_gff["cds"] is None:
             continue
 
-        name = df_attr.loc[index + 1, "Name"]
-        note = df_attr.loc[index + 1, "Note"]
+        name = gene_gff["cds"]["name"]
+        note = gene_gff["cds"]["note"]
         id_sbml = name[:-2] + "_" + name[-1]
-        new_locus_tag = df_attr.loc[index, "locus_tag"]
+        new_locus_tag = gene_gff["locus_tag"]
 
         annotations = hf.dict_add_overlap_to_list(annotations, {"refseq": id_sbml[:-2] + "." + id_sbml[-1]})
 
@@ -2,11 +2,11 @@ import sys
 import os
 import cobra
 import pandas as pd
-from tqdm import tqdm
+import telemetry as tm
 import memote
 import libsbml
 import helper_functions as hf
-from bioservices.kegg import KEGG
+import kegg_flatfile as kf
 
 '''
 Usage: add_genes_from_kegg.py <path_input_sbml-file> <path_output_sbml-file>
@@ -33,15 +33,13 @@ def main(args):
     # create Readers and Writers
     reader = libsbml.SBMLReader()
     writer = libsbml.SBMLWriter()
-    kegg = KEGG()
 
     # Read SBML File
     doc = reader.readSBML(infile)
     model = doc.getModel()
 
     # find organism
-    req = kegg.lookfor_organism(name_organism)[0].split(' ')
-    org_id = req[1]  # 'fma'
+    entry, org_id = hf.kegg_organism(name_organism)  # 'T00661', 'fma'
 
     model_cobra = cobra.io.read_sbml_model(infile)
 
@@ -55,14 +53,29 @@ def main(args):
 
     # -- Pathway annotation via KEGG
     reac_num = model.getNumReactions()
-    for i in tqdm(range(start, reac_num)):
+
+    # Get info on all reactions and genes from KEGG
+    kegg_ids_all = []
+    for i in range(start, reac_num):
+        if "kegg.reaction" in model_cobra.reactions[i].annotation:
+            reac_ids = model_cobra.reactions[i].annotation["kegg.reaction"]
+            kegg_ids_all += reac_ids if isinstance(reac_ids, list) else [reac_ids]
+        for gene in model_cobra.reactions[i].genes:
+            if "kegg.genes" in gene.annotation:
+                locus_tags = gene.annotation["kegg.genes"]
+                locus_tags = locus_tags if isinstance(locus_tags, list) else [locus_tags]
+                kegg_ids_all += [f"{org_id}:{locus_tag.split(':')[1]}" for locus_tag in locus_tags]
+    kegg_ids_all = list(dict.fromkeys(kegg_ids_all))
+    kegg_records = dict(zip(kegg_ids_all, hf.kegg_get_many(kegg_ids_all)))
+
+    for i in tm.progress(range(start, reac_num)):
         pathways = dict()
         if "kegg.reaction" in model_cobra.reactions[i].annotation:
             reac_ids = model_cobra.reactions[i].annotation["kegg.reaction"]
             if not isinstance(reac_ids, list):
                 reac_ids = [reac_ids]
             for reac_id in reac_ids:
-                reaction = kegg.parse(kegg.get(reac_id))
+                reaction = kf.parse(kegg_records[reac_id])
                 if "PATHWAY" in reaction:
                     pathway = reaction["PATHWAY"]
                     pathways.update(pathway)
@@ -75,7 +88,7 @@ def main(args):
                     locus_tags = [locus_tags]
                 for locus_tag in locus_tags:
                     locus_tag = locus_tag.split(":")[1]
-                    pathway = kegg.get_pathway_by_gene(locus_tag, org_id)
+                    pathway = kf.parse(kegg_records[f"{org_id}:{locus_tag}"]).get("PATHWAY")
                     if pathway is not None:
                         pathways.update(pathway)
 
@@ -87,17 +100,19 @@ def main(args):
 
         if i % 100 == 99:
             # Export model
-            doc.setModel(model)
-            writer.writeSBML(doc, outfile)
+            with tm.telemetry.timer("sbml_write"):
+                doc.setModel(model)
+                writer.writeSBML(doc, outfile)
 
             # Export progress
-            if os.path.exists(outfile_tsv):
-                changes_pathways_old = pd.read_csv(outfile_tsv, sep="\t", index_col=0)
-                changes_pathways = pd.concat([changes_pathways_old, changes_pathways])
-                changes_pathways.reset_index(drop=True, inplace=True)
-                changes_pathways_old = None
-            changes_pathways.to_csv(outfile_tsv, sep="\t")
-            changes_pathways = pd.DataFrame(columns=["pos", "gene_id", "pathway"])
+            with tm.telemetry.timer("pandas_export"):
+                if os.path.exists(outfile_tsv):
+                    changes_pathways_old = pd.read_csv(outfile_tsv, sep="\t", index_col=0)
+                    changes_pathways = pd.concat([changes_pathways_old, changes_pathways])
+                    changes_pathways.reset_index(drop=True, inplace=True)
+                    changes_pathways_old = None
+                changes_pathways.to_csv(outfile_tsv, sep="\t")
+                changes_pathways = pd.DataFrame(columns=["pos", "gene_id", "pathway"])
 
     # Export model
     doc.setModel(model)
@@ -115,7 +130,8 @@ def main(args):
     model = cobra.io.read_sbml_model(outfile)
 
     # Make memote report
-    result = memote.test_model(model, results=True)
+    with tm.telemetry.timer("memote"):
+        result = memote.test_model(model, results=True)
     report = memote.snapshot_report(result[1], config=None, html=True)
     with open(memote_report, "w") as handle:
         handle.write(report)
@@ -1,21 +1,27 @@
 import sys
 import os
 import cobra
-from tqdm import tqdm
+import telemetry as tm
 import pandas as pd
 import re
 import helper_functions as hf
+import kegg_flatfile as kf
+import bigg_offline as bo
+import knowledge_base as knb
 import memote
-from bioservices.kegg import KEGG
 
 '''
 Usage: add_reactions_metabolites_from_genes.py <path_input_sbml-file> <path_output_sbml-file>
 <path_output_tsv-file_mismatches_bigg> <path_output_tsv-file_mismatches_locus-tags>
-<path_memote-report>
+<path_memote-report> <--offline> : optional, use local BiGG dumps and only request BiGG on a miss
 '''
 
 
 def main(args):
+    # local BiGG dumps instead of BiGG API
+    offline = "--offline" in args
+    args = [arg for arg in args if arg != "--offline"]
+
     # console access
     if len(args) != 6:
         print(main.__doc__)
@@ -31,20 +37,39 @@ def main(args):
         print("[Error] %s : No such file." % infile)
         sys.exit(1)
 
+    if offline:
+        hf.set_bigg_resolver(bo.BiggResolver())
+
     # read model
     model = cobra.io.read_sbml_model(infile)
-    kegg = KEGG()
 
-    # read in Bigg Reactions DB
-    bigg_db = pd.read_csv("Databases/BiGG/bigg_models_reactions.tsv", sep='\t').fillna("")
+    # BiGG reactions by EC number and KEGG reaction, compiled once by knowledge_base.py
+    kb = knb.get_knowledge_base()
 
     # Saves all reactions with no correspondence in BiGG
     mismatches_bigg_reacs = pd.DataFrame(
         columns=["bigg_id", "kegg_id", "coresponding_enzyme", "corresponding_locus_tag"])
     mismatches_locus_tags = pd.DataFrame(columns=["gene_id", "gene_name"])
 
+    # Get info on all genes and their enzymes from KEGG
+    locus_tags_all = []
+    for gene in model.genes:
+        if "kegg.genes" in gene.annotation:
+            locus_tag = gene.annotation["kegg.genes"]
+            locus_tags_all += locus_tag if isinstance(locus_tag, list) else [locus_tag]
+    locus_tags_all = list(dict.fromkeys(locus_tags_all))
+    gene_dicts = {lt: kf.parse(record) for lt, record in zip(locus_tags_all, hf.kegg_get_many(locus_tags_all))}
+
+    ec_nrs_all = []
+    for gene_dict in gene_dicts.values():
+        if "ORTHOLOGY" in gene_dict:
+            for go in gene_dict["ORTHOLOGY"].values():
+                ec_nrs_all += [ec_nr.split(":")[1] for ec_nr in re.findall(r"(EC:{1}(?:\d+\.){3}(?:\d+){1})", go)]
+    ec_nrs_all = list(dict.fromkeys(ec_nrs_all))
+    enzyme_dicts = {ec: kf.parse(record) for ec, record in zip(ec_nrs_all, hf.kegg_get_many(ec_nrs_all))}
+
     # -- Iterates through all genes
-    for i in tqdm(range(len(model.genes))):
+    for i in tm.progress(range(len(model.genes))):
 
         # Checks for locus tag
         if "kegg.genes" in model.genes[i].annotation:
@@ -57,7 +82,7 @@ def main(args):
         if not isinstance(locus_tag, list):
             locus_tag = [locus_tag]
         for lt in locus_tag:
-            gene_dict = kegg.parse(kegg.get(lt))
+            gene_dict = gene_dicts[lt]
 
             # Extracts all EC numbers for enzymes out of orthology
             ec_matches = []
@@ -70,64 +95,60 @@ def main(args):
             enzyme_dict = dict()
             bigg_queries = dict()
             for ec_nr in ec_matches:
-                enzyme_dict = kegg.parse(kegg.get(ec_nr.split(":")[1]))     # nr (exclusively) lead to enzyme
-                bigg_queries[ec_nr] = bigg_db["database_links"].str\
-                    .contains(f"EC Number: http://identifiers.org/ec-code/{ec_nr};", regex=False)
+                enzyme_dict = enzyme_dicts[ec_nr.split(":")[1]]     # nr (exclusively) lead to enzyme
+                bigg_queries[ec_nr] = kb.reactions_by_alias("bigg", "ec", ec_nr.split(":")[1])
 
                 if "ALL_REAC" in enzyme_dict:
                     for reac_nr in enzyme_dict["ALL_REAC"]:
-                        bigg_queries[reac_nr] = bigg_db["database_links"].str\
-                            .contains(f"KEGG Reaction: http://identifiers.org/kegg.reaction/{reac_nr};",
-                                      regex=False)
+                        bigg_queries[reac_nr] = kb.reactions_by_alias("bigg", "kegg", reac_nr)
                 else:
                     continue
 
+            # Fetch all metabolites of matched reactions, that are missing in the model, at once
+            missing_metabolites = set()
+            for bigg_query in bigg_queries.values():
+                for row in bigg_query:
+                    if model.reactions.has_id(row["id"]):
+                        continue
+                    reac_metab = hf.parse_bigg_reaction_string(row["equation"])
+                    missing_metabolites |= {k[:-2] for k in reac_metab.keys() if k not in model.metabolites}
+            missing_metabolites = list(missing_metabolites)
+            metabolite_infos = dict(zip(missing_metabolites, hf.bigg_request_many(missing_metabolites)))
+
             # Iterate through all possible match queries
             has_bigg_entry = False
             for kegg_id, bigg_query in bigg_queries.items():
-                if bigg_query.any():
+                if bigg_query:
                     has_bigg_entry = True
-                    bigg_entries = bigg_db.loc[bigg_query]
 
                     # Examine reactions from BiGG
-                    for j, row in bigg_entries.iterrows():
+                    for row in bigg_query:
 
-                        if not model.reactions.has_id(row["bigg_id"]):
-                            reaction = cobra.Reaction(row["bigg_id"],
+                        if not model.reactions.has_id(row["id"]):
+                            reaction = cobra.Reaction(row["id"],
                                                       name=row["name"],
                                                       subsystem="")
                             reaction.gene_reaction_rule = model.genes[i].id
 
-                            compounds = re.split(" <-> | -> | <- ", row["reaction_string"])
-                            reactants = re.split(" [+] ", compounds[0])
-                            products = re.split(" [+] ", compounds[1])
-
-                            reac_metab = dict()
-                            for reactant in reactants:
-                                reactant = re.split(r"(\d+\.\d+) +", reactant)
-                                if len(reactant) == 3:                                  # re.split keeps groups and ""
-                                    reac_metab[reactant[2]] = -float(reactant[1])
-                                else:
-                                    reac_metab[reactant[0]] = -1.0
-                            for product in products:
-                                product = re.split(r"(\d+\.\d+) +", product)
-                                if len(product) == 3:
-                                    reac_metab[product[2]] = float(product[1])
-                                else:
-                                    reac_metab[product[0]] = 1.0
-
-                            # add missing metabolites
-                            wrong_compartment = False
+                            reac_metab = hf.parse_bigg_reaction_string(row["equation"])
+
+                            # add missing metabolites, reactions with metabolites, that BiGG did not return or that
+                            # are in other compartments, are skipped
+                            skip_reaction = False
                             for k in reac_metab.keys():
                                 if k in model.metabolites:
                                     continue
-                                m = hf.bigg_request(k[:-2])
+                                m = metabolite_infos.get(k[:-2])
+                                if m is None:
+                                    hf.report_missing(hf.bigg_request, k[:-2], "metabolites")
+                                    skip_reaction = True
+                                    break
                                 if not m['charges']:
                                     m['charges'] = [0]
 
                                 # check viable compartments (_c, _e, _p)
                                 if re.search(r"_[cep]", k[-2:]) is None:
-                                    wrong_compartment = True
+                                    skip_reaction = True
                                     break
 
                                 metabolite = cobra.Metabolite(k,
@@ -137,18 +158,18 @@ def main(args):
                                                               compartment="C" + k[-2:])
                                 model.add_metabolites(metabolite)
 
-                            if wrong_compartment:
+                            if skip_reaction:
                                 continue
                             model.add_reactions([reaction])
-                            model.reactions.get_by_id(row["bigg_id"]).add_metabolites(reac_metab)
+                            model.reactions.get_by_id(row["id"]).add_metabolites(reac_metab)
 
                         if re.search(r"((?:\d+\.){3}(?:\d+){1})", kegg_id) is None:
-                            model.reactions.get_by_id(row["bigg_id"]).annotation = hf\
-                                .dict_add_overlap_to_list(model.reactions.get_by_id(row["bigg_id"]).annotation,
+                            model.reactions.get_by_id(row["id"]).annotation = hf\
+                                .dict_add_overlap_to_list(model.reactions.get_by_id(row["id"]).annotation,
                                                           {"kegg.reaction": kegg_id})
                         else:
-                            model.reactions.get_by_id(row["bigg_id"]).annotation = hf \
-                                .dict_add_overlap_to_list(model.reactions.get_by_id(row["bigg_id"]).annotation,
+                            model.reactions.get_by_id(row["id"]).annotation = hf \
+                                .dict_add_overlap_to_list(model.reactions.get_by_id(row["id"]).annotation,
                                                           {"ec-code": kegg_id})
                 else:
                     continue
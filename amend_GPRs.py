@@ -1,11 +1,12 @@
 import sys
 import os
 import cobra
-from tqdm import tqdm
-import gffpandas.gffpandas as gffpd
+import telemetry as tm
+import gff_store as gs
 import re
 import memote
-from bioservices.kegg import KEGG
+import helper_functions as hf
+import kegg_flatfile as kf
 
 '''
 Usage: amend_GPRs.py <path_input_sbml-file> <path_output_sbml-file> <path GFF file> <path_output-memote>
@@ -30,14 +31,26 @@ def main(args):
 
     # read model
     model = cobra.io.read_sbml_model(infile)
-    kegg = KEGG()
 
     # read GFF file
-    df = gffpd.read_gff3(gff_file)
-    df_attr = df.attributes_to_columns()
+    gff = gs.load_gff(gff_file)
     org_id = "FMA"
 
-    for i in tqdm(range(len(model.reactions))):
+    # Get info on all enzymes and their genes from KEGG
+    ec_codes_all = []
+    for reaction in model.reactions:
+        if "ec-code" in reaction.annotation:
+            ec_codes = reaction.annotation["ec-code"]
+            ec_codes_all += ec_codes if isinstance(ec_codes, list) else [ec_codes]
+    ec_codes_all = list(dict.fromkeys(ec_codes_all))
+    kegg_enzymes = {ec: kf.parse(record) for ec, record in zip(ec_codes_all, hf.kegg_get_many(ec_codes_all))}
+
+    locus_tags_all = list(dict.fromkeys(kegg_enzyme["GENES"][org_id] for kegg_enzyme in kegg_enzymes.values()
+                                        if "GENES" in kegg_enzyme and org_id in kegg_enzyme["GENES"]))
+    gene_records = hf.kegg_get_many([org_id.lower() + ":" + locus_tag for locus_tag in locus_tags_all])
+    kegg_genes = dict(zip(locus_tags_all, gene_records))
+
+    for i in tm.progress(range(len(model.reactions))):
 
         # Extract all genes(locus-tag) into list
         if "ec-code" in model.reactions[i].annotation:
@@ -46,7 +59,7 @@ def main(args):
                 ec_codes = [ec_codes]
             locus_tags = []
             for ec in ec_codes:
-                kegg_enzyme = kegg.parse(kegg.get(ec))
+                kegg_enzyme = kegg_enzymes[ec]
                 if "GENES" in kegg_enzyme and org_id in kegg_enzyme["GENES"]:
                     locus_tags.append(kegg_enzyme["GENES"][org_id])
             if not locus_tags:
@@ -55,14 +68,13 @@ def main(args):
             # extract all subunits into dict with key being the enzyme
             enzyme_subunit = dict()
             for locus_tag in locus_tags:
-                kegg_gene = kegg.parse(kegg.get(org_id.lower() + ":" + locus_tag))
+                kegg_gene = kf.parse(kegg_genes[locus_tag])
 
                 # Get sbml_name of gene from GFF File
-                locus_match = df_attr.loc[df_attr["old_locus_tag"] == locus_tag]
-                if locus_match.empty:
+                locus_match = gff.find("old_locus_tag", locus_tag)
+                if not locus_match or locus_match[0]["cds"] is None:
                     continue
-                index = locus_match.index[0]
-                name = df_attr.loc[index + 1, "Name"]
+                name = locus_match[0]["cds"]["name"]
                 id_sbml = name[:-2] + "_" + name[-1]
 
                 if "NAME" in kegg_gene:
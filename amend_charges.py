@@ -1,19 +1,24 @@
 import sys
 import os
 import libsbml
-from tqdm import tqdm
+import telemetry as tm
 import pandas as pd
 import helper_functions as hf
+import bigg_offline as bo
 
 '''
 Usage: amend_charges.py <path_input_sbml-file> <path_output_sbml-file>
-<path_out_tsv-file_mismatches>
+<path_out_tsv-file_mismatches> <--offline> : optional, use local BiGG dumps and only request BiGG on a miss
 Transfers charges from Notes to the fbc-Plugin Annotation. If none is found, BiGG-DB is used for a search. If BiGG 
 contains multiple or no charges, the metabolite is returned as a csv-formatted file.
 '''
 
 
 def main(args):
+    # local BiGG dumps instead of BiGG API
+    offline = "--offline" in args
+    args = [arg for arg in args if arg != "--offline"]
+
     # console access
     if len(args) < 6:
         print(main.__doc__)
@@ -31,6 +36,9 @@ def main(args):
         print("[Error] %s : No such file." % infile)
         sys.exit(1)
 
+    if offline:
+        hf.set_bigg_resolver(bo.BiggResolver())
+
     reader = libsbml.SBMLReader()
     writer = libsbml.SBMLWriter()
 
@@ -45,23 +53,27 @@ def main(args):
     # Use BiGG Database for charge annotation, if none is given
     mismatches = pd.DataFrame(columns=["model_index", "id", "name", "charge_bigg", "charge_model", "formula_model"])
     num_spec = model.getNumSpecies()
-    for i in tqdm(range(num_spec)):
 
-        # check fbc plugin for formula
-        if model.getSpecies(i).getPlugin('fbc').isSetCharge():
-            continue
+    # request BiGG for all species without charge at once, failed requests are retried at the end
+    missing = [i for i in range(num_spec) if not model.getSpecies(i).getPlugin('fbc').isSetCharge()]
+    pruned_ids = [str(model.getSpecies(i).getMetaId())[2:-2] for i in missing]
+    metabolite_infos = dict(zip(pruned_ids, hf.bigg_request_many(pruned_ids, "metabolites")))
+
+    for i in tm.progress(missing):
 
         meta_id = str(model.getSpecies(i).getMetaId())
         pruned_id = meta_id[2:-2]
-        metabolite_info = hf.bigg_request(pruned_id, "metabolites")
-        charges_bigg = metabolite_info["charges"]
+        metabolite_info = metabolite_infos[pruned_id]
+        if metabolite_info is None:
+            hf.report_missing(hf.bigg_request, pruned_id, "metabolites")
+        charges_bigg = metabolite_info["charges"] if metabolite_info is not None else []
 
         if len(charges_bigg) == 1:
             model.getSpecies(i).getPlugin('fbc').setCharge(charges_bigg[0])
             note_str = f"Changed charge from '' to {charges_bigg[0]}. Source: BiGG"
             model = hf.add_note_species(model, note_str, meta_id)
             lnk = f"https://identifiers.org/bigg.reaction:{pruned_id}"
-            model = hf.add_link_annotation_species(model, lnk, meta_id)
+            model = hf.add_link_annotation_species(model, lnk, libsbml.BQB_IS, meta_id)
 
         else:
             mismatches.loc[len(mismatches.index)] = [i, meta_id, model.getSpecies(i).getName(),
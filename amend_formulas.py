@@ -1,20 +1,26 @@
 import sys
 import os
 import libsbml
-from tqdm import tqdm
+import telemetry as tm
 import pandas as pd
 import helper_functions as hf
+import bigg_offline as bo
 
 '''
 Usage: amend_formulas.py <path_input_sbml-file> <path_output_sbml-file>
 <outfile-tsv_mismatches> 
 <tolerate_charge_hydrogen_balancing> : -chBal, if +1 charge should correspond to +1 H-atom
+<--offline> : optional, use local BiGG dumps and only request BiGG on a miss
 Takes formulas from the notes field and fbc-plugin, if none are found, BiGG-DB is searched for a formula. 
 If multiple or no possibilities are given in BiGG, a csv-formatted table with these metabolites is returned.
 '''
 
 
 def main(args):
+    # local BiGG dumps instead of BiGG API
+    offline = "--offline" in args
+    args = [arg for arg in args if arg != "--offline"]
+
     # console access
     if len(args) < 6:
         print(main.__doc__)
@@ -28,6 +34,9 @@ def main(args):
         print("[Error] %s : No such file." % infile)
         sys.exit(1)
 
+    if offline:
+        hf.set_bigg_resolver(bo.BiggResolver())
+
     # create Readers and Writers
     reader = libsbml.SBMLReader()
     writer = libsbml.SBMLWriter()
@@ -54,22 +63,26 @@ def main(args):
     # Use BiGG Database for formulae check, if none is given
     mismatches = pd.DataFrame(columns=["model_index", "id", "name", "formula_bigg", "formula_model"])
     num_spec = model.getNumSpecies()
-    for i in tqdm(range(num_spec)):
 
-        # check fbc plugin for formula
-        if model.getSpecies(i).getPlugin('fbc').isSetChemicalFormula():
-            continue
+    # request BiGG for all species without formula at once, failed requests are retried at the end
+    missing = [i for i in range(num_spec) if not model.getSpecies(i).getPlugin('fbc').isSetChemicalFormula()]
+    pruned_ids = [str(model.getSpecies(i).getMetaId())[2:-2] for i in missing]
+    metabolite_infos = dict(zip(pruned_ids, hf.bigg_request_many(pruned_ids, "metabolites")))
+
+    for i in tm.progress(missing):
 
         meta_id = str(model.getSpecies(i).getMetaId())
         pruned_id = meta_id[2:-2]
-        metabolite_info = hf.bigg_request(pruned_id, "metabolites")
-        formulas_bigg = metabolite_info["formulae"]
+        metabolite_info = metabolite_infos[pruned_id]
+        if metabolite_info is None:
+            hf.report_missing(hf.bigg_request, pruned_id, "metabolites")
+        formulas_bigg = metabolite_info["formulae"] if metabolite_info is not None else []
         if len(formulas_bigg) == 1:
-            model.getSpecies(i).getPlugin('fbc').setChemicalFormula(formulas_bigg)
+            model.getSpecies(i).getPlugin('fbc').setChemicalFormula(formulas_bigg[0])
             note_str = f"Changed formula from '' to {formulas_bigg[0]}. Source: BiGG"
             model = hf.add_note_species(model, note_str, meta_id)
             lnk = f"https://identifiers.org/bigg.reaction:{pruned_id}"
-            model = hf.add_link_annotation_species(model, lnk, meta_id)
+            model = hf.add_link_annotation_species(model, lnk, libsbml.BQB_IS, meta_id)
         else:
             mismatches.loc[len(mismatches.index)] = [i, meta_id, model.getSpecies(i).getName(),
                                                      formulas_bigg, ""]
@@ -1,11 +1,10 @@
 import sys
 import os
 import cobra
-from tqdm import tqdm
+import telemetry as tm
 import memote
 import helper_functions as hf
-from bioservices.kegg import KEGG
-import gffpandas.gffpandas as gffpd
+import gff_store as gs
 
 '''
 Usage: annotate_genes.py <path_input_sbml-file> <path_output_sbml-file> <path-GFF File> <path_memote-report> <name_organism>
@@ -31,46 +30,37 @@ def main(args):
 
     # Read in files
     model = cobra.io.sbml.read_sbml_model(infile)
-    df = gffpd.read_gff3(gff_file)
-    df_attr = df.attributes_to_columns()
-    kegg = KEGG()
+    gff = gs.load_gff(gff_file)
 
     # find organism
-    req = kegg.lookfor_organism(organism_name)[0].split(' ')
-    entry = req[0]  # 'T00661'
-    org_id = req[1]  # 'fma'
+    entry, org_id = hf.kegg_organism(organism_name)  # 'T00661', 'fma'
     sbo_nr = "SBO:0000243"
 
     # Kegg genes extraction
-    genes = kegg.list(org_id).split("\n")[:-1]
-    genome_dict = {g.split("\t")[0].replace("fma:", ""): g.split("\t")[1] for g in genes}
+    genome_dict = hf.kegg_genome(org_id)
 
     # -- Cobra model annotation
-    for i in tqdm(range(len(model.genes))):
+    for i in tm.progress(range(len(model.genes))):
         annotations = {"sbo": sbo_nr}
         id_sbml = model.genes[i].id
         refseq = id_sbml[:-2] + "." + id_sbml[-1]
-        gff_query = df_attr["Name"] == refseq
-
-        if gff_query.any():
-            matches = df_attr[gff_query]
-            for j, row in matches.iterrows():
-                if df_attr.loc[j - 1, "type"] == "gene" and df_attr.loc[j, "type"] == "CDS":
-                    locus_tag = df_attr.loc[j - 1, "old_locus_tag"]
-                    new_locus_tag = df_attr.loc[j - 1, "locus_tag"]
-                    note = df_attr.loc[j, "Note"]
-                    name = df_attr.loc[j, "Name"]
-
-                    annotations = hf.dict_add_overlap_to_list(annotations, {"kegg.genes": f"{org_id}:{locus_tag}",
-                                                                            "refseq": refseq})
-
-                    model.genes[i].annotation = \
-                        hf.dict_add_overlap_to_list(model.genes[i].annotation, annotations)
-                    if note is None:
-                        model.genes[i].notes.update({"locus tag:": new_locus_tag})
-                    else:
-                        model.genes[i].notes.update({"locus tag:": new_locus_tag, "NCBI note:": note})
-                    model.genes[i].name = name
+        for gene_gff in gff.find("name", refseq):
+            if gene_gff["type"] == "gene":
+                locus_tag = gene_gff["old_locus_tag"]
+                new_locus_tag = gene_gff["locus_tag"]
+                note = gene_gff["cds"]["note"]
+                name = gene_gff["cds"]["name"]
+
+                annotations = hf.dict_add_overlap_to_list(annotations, {"kegg.genes": f"{org_id}:{locus_tag}",
+                                                                        "refseq": refseq})
+
+                model.genes[i].annotation = \
+                    hf.dict_add_overlap_to_list(model.genes[i].annotation, annotations)
+                if note is None:
+                    model.genes[i].notes.update({"locus tag:": new_locus_tag})
+                else:
+                    model.genes[i].notes.update({"locus tag:": new_locus_tag, "NCBI note:": note})
+                model.genes[i].name = name
 
     # Export model
     cobra.io.sbml.write_sbml_model(model, outfile)
@@ -2,12 +2,12 @@ import sys
 import os
 import cobra.io
 import libsbml
-from tqdm import tqdm
+import telemetry as tm
 import pandas as pd
 import re
 import memote
-from bioservices.kegg import KEGG
 import helper_functions as hf
+import knowledge_base as knb
 
 '''
 Usage: annotate_reactions.py <path_input_sbml-file> <path_output_sbml-file>
@@ -39,33 +39,27 @@ def main(args):
     doc = reader.readSBML(infile)
     model = doc.getModel()
 
-    # Knowledge base preparation
-    bigg_db = pd.read_csv("Databases/BiGG/bigg_models_reactions.tsv", sep='\t').fillna("")
+    # Knowledge base preparation: BiGG and SEED reactions, compiled once by knowledge_base.py
+    kb = knb.get_knowledge_base()
 
-    seed_db = pd.read_csv("Databases/SEED/reactions.tsv", header=0, sep="\t")
-    seed_db.fillna("", inplace=True)
-
-    kegg = KEGG()
-    req = kegg.lookfor_organism('finegoldia magna')[0].split(' ')
-    entry = req[0]  # "T00661"
-    org_code = req[1]  # 'fma'
+    entry, org_code = hf.kegg_organism('finegoldia magna')  # "T00661", 'fma'
 
     num_reac = model.getNumReactions()
 
     missing_bigg = pd.DataFrame(columns=["id", "name"])
 
     # BiGG
-    for i in tqdm(range(num_reac)):
+    for i in tm.progress(range(num_reac)):
         reac_id = str(model.getReaction(i).getId())
 
         bigg_id = re.sub("^R_", "", reac_id)
         try:
-            bigg_entry_idx = bigg_db.loc[bigg_db["bigg_id"] == bigg_id].index[0]
+            bigg_entry = kb.reactions("bigg", bigg_id)[0]
         except IndexError:
             missing_bigg.loc[len(missing_bigg.index)] = [bigg_id, model.getReaction(i).getName()]
             continue
 
-        bigg_dblnks = bigg_db.loc[bigg_entry_idx, "database_links"].split(";")
+        bigg_dblnks = bigg_entry["links"].split(";")
         for db_lnk in bigg_dblnks:
             if db_lnk != "":
                 lnk = db_lnk.split(": ")[1]
@@ -82,45 +76,35 @@ def main(args):
     model_cobra = cobra.io.read_sbml_model(outfile)
 
     # SEED
-    for i in tqdm(range(num_reac)):
+    for i in tm.progress(range(num_reac)):
         reac_id = str(model.getReaction(i).getId())
 
         if "seed.reaction" in model_cobra.reactions[i].annotation:
             seed_ids = model_cobra.reactions[i].annotation["seed.reaction"]
             if not isinstance(seed_ids, list):
                 seed_ids = [seed_ids]
-            for seed_id in seed_ids:
-                match = seed_db.loc[seed_db['id'] == seed_id]
-                lnk = f"https://identifiers.org/seed.reaction/{seed_id}"
-                model = hf.add_link_annotation_reaction(model, lnk, libsbml.BQB_IS, reac_id)
-                for idx, row in match.iterrows():
-                    for ec in row["ec_numbers"].split("|"):
-                        if ec not in [None, ""]:
-                            lnk = f"https://identifiers.org/ec-code/{ec}"
-                            model = hf.add_link_annotation_reaction(model, lnk, libsbml.BQB_IS, reac_id)
-                    for alias in row['aliases'].split("|"):
-                        if alias.startswith("KEGG: "):
-                            lnk = f"https://identifiers.org/kegg.reaction/{alias.split(': ')[1]}"
-                            model = hf.add_link_annotation_reaction(model, lnk, libsbml.BQB_IS, reac_id)
-
         else:
+            # SEED reactions, that share an identifier with the reaction, EC numbers are shared by many reactions
+            seed_ids = []
             for db, db_ids in model_cobra.reactions[i].annotation.items():
+                if knb.namespace(db) in knb.CLASS_NAMESPACES:
+                    continue
                 if not isinstance(db_ids, list):
                     db_ids = [db_ids]
                 for db_id in db_ids:
-                    matches = seed_db['aliases'].str.split("|") == db + ": " + db_id
-                    if matches.any():
-                        for idx, row in seed_db.loc[matches].iterrows():
-                            lnk = f"https://identifiers.org/seed.reaction/{row['id']}"
-                            model = hf.add_link_annotation_reaction(model, lnk, libsbml.BQB_IS, reac_id)
-                            for ec in row["ec_numbers"].split("|"):
-                                if ec not in [None, ""]:
-                                    lnk = f"https://identifiers.org/ec-code/{ec}"
-                                    model = hf.add_link_annotation_reaction(model, lnk, libsbml.BQB_IS, reac_id)
-                            for alias in row['aliases'].split("|"):
-                                if alias.startswith("KEGG: "):
-                                    lnk = f"https://identifiers.org/kegg.reaction/{alias.split(': ')[1]}"
-                                    model = hf.add_link_annotation_reaction(model, lnk, libsbml.BQB_IS, reac_id)
+                    seed_ids += [row["id"] for row in kb.reactions_by_alias("seed", db, db_id)]
+            seed_ids = list(dict.fromkeys(seed_ids))
+
+        for seed_id in seed_ids:
+            lnk = f"https://identifiers.org/seed.reaction/{seed_id}"
+            model = hf.add_link_annotation_reaction(model, lnk, libsbml.BQB_IS, reac_id)
+            seed_aliases = kb.reaction_aliases("seed", seed_id)
+            for ec in seed_aliases.get("ec", []):
+                lnk = f"https://identifiers.org/ec-code/{ec}"
+                model = hf.add_link_annotation_reaction(model, lnk, libsbml.BQB_IS, reac_id)
+            for kegg_id in seed_aliases.get("kegg", []):
+                lnk = f"https://identifiers.org/kegg.reaction/{kegg_id}"
+                model = hf.add_link_annotation_reaction(model, lnk, libsbml.BQB_IS, reac_id)
 
     # Export model
     doc.setModel(model)
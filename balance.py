@@ -0,0 +1,592 @@
+"""
+Mass and charge balance of all reactions of a model at once: the element composition of the metabolites (E, elements x
+metabolites) and their charges (q) are multiplied with the stoichiometric matrix (S, metabolites x reactions), so that
+column r of [E; q]·S is the imbalance of reaction r
+
+Usage: balance.py delta <path_input_sbml-file> <path_infile-csv_balancing_changes>
+Applies the changes of a table for balance_from_csv.py to the balance of the model in memory and lists the reactions,
+whose balance changed, without writing the model
+       balance.py suggest <path_input_sbml-file> <path_outfile-csv_balancing_changes> [small species ...]
+Suggests the smallest change for every unbalanced reaction: a formula or charge of the knowledge base for one of its
+metabolites, or adding or removing small species (default h and h2o), as table for balance_from_csv.py
+"""
+import sys
+import os
+import re
+import time
+import cobra
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import itertools
+import formulas as fm
+import knowledge_base as knb
+
+EXCLUDED = "EX_|sink_|Growth"   # reactions, that are not expected to be balanced
+TOLERANCE = 1e-7                # imbalances smaller than this are 0, as in cobra
+# rows of the imbalance matrix, elements in Hill order (C, H, then alphabetically) and the charge
+ROWS = ("C", "H") + tuple(sorted(element for element in fm.ELEMENTS if element not in ["C", "H"])) + ("charge",)
+ROW_INDEX = {row: index for index, row in enumerate(ROWS)}
+SMALL_SPECIES = ("h", "h2o")    # species without compartment, that may be added to or removed from reactions
+MAX_COEFFICIENT = 3             # maximal number of each small species added or removed
+SEARCH_SIZE = 1 << 22           # values of the search for small species held in memory at once
+CHANGE_COLUMNS = ["id", "change_type", "old", "new", "foundation", "db_id", "notes", "eco"]
+
+
+def composition(metabolites: list):
+    """
+    :param metabolites: list of cobra.Metabolite
+    :return: (E as scipy.sparse.csr_matrix elements x metabolites with the elements of ROWS, charges as numpy array,
+    list of ids of metabolites, whose formula cannot be parsed). Metabolites without formula or charge contribute
+    nothing.
+    """
+    rows, columns, counts = [], [], []
+    unparsable = []
+    for column, metabolite in enumerate(metabolites):
+        elements = fm.parse_formula(metabolite.formula) if metabolite.formula else ()
+        if elements is None:
+            unparsable.append(metabolite.id)
+            continue
+        for element, count in elements:
+            rows.append(ROW_INDEX[element])
+            columns.append(column)
+            counts.append(count)
+    composition_matrix = sparse.csr_matrix((counts, (rows, columns)), shape=(len(ROWS) - 1, len(metabolites)))
+    charges = np.array([metabolite.charge or 0 for metabolite in metabolites], dtype=float)
+    return composition_matrix, charges, unparsable
+
+
+def stoichiometry(model):
+    """
+    :param model: cobra.Model
+    :return: S as scipy.sparse.csc_matrix metabolites x reactions, in the order of model.metabolites and
+    model.reactions
+    """
+    index = {metabolite.id: row for row, metabolite in enumerate(model.metabolites)}
+    rows, columns, coefficients = [], [], []
+    for column, reaction in enumerate(model.reactions):
+        for metabolite, coefficient in reaction.metabolites.items():
+            rows.append(index[metabolite.id])
+            columns.append(column)
+            coefficients.append(coefficient)
+    return sparse.csc_matrix((coefficients, (rows, columns)), shape=(len(model.metabolites), len(model.reactions)))
+
+
+def excluded(reaction_ids: list):
+    """
+    :param reaction_ids: list of reaction ids
+    :return: boolean numpy array, True for exchange, sink and growth reactions (see EXCLUDED)
+    """
+    return pd.Series(reaction_ids, dtype=str).str.contains(EXCLUDED).to_numpy(dtype=bool)
+
+
+def imbalance_matrix(composition_matrix, charges, stoichiometric_matrix):
+    """
+    :param composition_matrix: E from composition
+    :param charges: q from composition
+    :param stoichiometric_matrix: S from stoichiometry
+    :return: scipy.sparse.csc_matrix ROWS x reactions, imbalance of every element and the charge per reaction,
+    values below TOLERANCE removed
+    """
+    imbalances = sparse.vstack([composition_matrix, sparse.csr_matrix(charges)]).tocsr() @ stoichiometric_matrix
+    imbalances = sparse.csc_matrix(imbalances)
+    imbalances.data[np.abs(imbalances.data) < TOLERANCE] = 0
+    imbalances.eliminate_zeros()
+    imbalances.sort_indices()
+    return imbalances
+
+
+def imbalance_dicts(imbalances, columns: list):
+    """
+    :param imbalances: matrix from imbalance_matrix
+    :param columns: list of indices of reactions
+    :return: list of dictionaries element or "charge" -> imbalance, as reaction.check_mass_balance(), in the
+    order of ROWS
+    """
+    values = imbalances.data.tolist()
+    indptr = imbalances.indptr.tolist()
+    rows = [ROWS[row] for row in imbalances.indices.tolist()]
+    return [dict(zip(rows[indptr[column]:indptr[column + 1]], values[indptr[column]:indptr[column + 1]]))
+            for column in columns]
+
+
+def check_model(model):
+    """
+    :param model: cobra.Model
+    :return: (dictionary index of reaction -> imbalances for all unbalanced reactions, that are not excluded,
+    list of ids of metabolites, whose formula cannot be parsed)
+    """
+    composition_matrix, charges, unparsable = composition(model.metabolites)
+    imbalances = imbalance_matrix(composition_matrix, charges, stoichiometry(model))
+    mask = excluded([reaction.id for reaction in model.reactions])
+    unbalanced = np.flatnonzero((np.diff(imbalances.indptr) > 0) & ~mask).tolist()
+    return dict(zip(unbalanced, imbalance_dicts(imbalances, unbalanced))), unparsable
+
+
+def signature(imbalances: dict):
+    """
+    :param imbalances: dictionary element or "charge" -> imbalance
+    :return: hashable tuple of (element, imbalance) in the order of ROWS, signs flipped so that the first imbalance is
+    positive, so that a reaction and its reverse have the same signature. Imbalances are rounded to 6 decimals.
+    """
+    items = sorted(imbalances.items(), key=lambda item: ROW_INDEX.get(item[0], len(ROWS)))
+    sign = -1 if items and items[0][1] < 0 else 1
+    return tuple((element, round(sign * value, 6) + 0.0) for element, value in items)
+
+
+def recurring_imbalances(reactions_per_metabolite: dict, imbalances: dict):
+    """
+    Groups the unbalanced reactions of every metabolite by their signature, in one pass
+    :param reactions_per_metabolite: dictionary metabolite id -> list of indices of unbalanced reactions with it
+    :param imbalances: dictionary index of reaction -> imbalances (see check_model)
+    :return: dictionary metabolite id -> dictionary signature -> list of indices of reactions, in the given order
+    """
+    signatures = {index: signature(reaction_imbalances) for index, reaction_imbalances in imbalances.items()}
+    groups = dict()
+    for metabolite_id, indices in reactions_per_metabolite.items():
+        metabolite_groups = groups.setdefault(metabolite_id, dict())
+        for index in indices:
+            metabolite_groups.setdefault(signatures[index], []).append(index)
+    return groups
+
+
+def rank_recurring(groups: dict, reaction_ids: list):
+    """
+    :param groups: from recurring_imbalances
+    :param reaction_ids: list of reaction ids of the model, by index
+    :return: pandas.DataFrame with the columns metabolite, reactions (number of unbalanced reactions sharing its most
+    frequent imbalance, that a correction of the metabolite could fix), imbalance, reaction_ids and unbalanced (number
+    of unbalanced reactions with the metabolite), metabolites with recurring imbalances only, best first
+    """
+    rows = []
+    for metabolite_id, metabolite_groups in groups.items():
+        imbalance, indices = max(metabolite_groups.items(), key=lambda item: len(item[1]))
+        if len(indices) > 1:
+            rows.append([metabolite_id, len(indices), ", ".join(f"{element}: {value}" for element, value in imbalance),
+                         [reaction_ids[index] for index in indices],
+                         sum(len(group) for group in metabolite_groups.values())])
+    ranking = pd.DataFrame(rows, columns=["metabolite", "reactions", "imbalance", "reaction_ids", "unbalanced"])
+    return ranking.sort_values(["reactions", "unbalanced", "metabolite"], ascending=[False, False, True],
+                               ignore_index=True)
+
+
+class BalanceSession:
+    """
+    Balance of a model kept in memory: the composition [E; q] (ROWS x metabolites), the stoichiometric matrix S and
+    the imbalances of all reactions. Changes of formulas, charges and coefficients recompute only the reactions of the
+    changed metabolites and return the difference.
+    Reactions and metabolites are addressed by their cobra ids e.g. "PFK", "atp_c".
+    """
+
+    def __init__(self, model):
+        """
+        :param model: cobra.Model
+        """
+        self.metabolite_ids = [metabolite.id for metabolite in model.metabolites]
+        self.metabolite_index = {metabolite_id: index for index, metabolite_id in enumerate(self.metabolite_ids)}
+        self.reaction_ids = [reaction.id for reaction in model.reactions]
+        self.reaction_index = {reaction_id: index for index, reaction_id in enumerate(self.reaction_ids)}
+        composition_matrix, charges, self.unparsable = composition(model.metabolites)
+        self.composition = sparse.vstack([composition_matrix, sparse.csr_matrix(charges)]).tocsc()
+        self.stoichiometry = stoichiometry(model)
+        self.excluded = excluded(self.reaction_ids)
+        adjacency = self.stoichiometry.tocsr()
+        self.reactions_of = [set(adjacency.indices[adjacency.indptr[row]:adjacency.indptr[row + 1]].tolist())
+                             for row in range(adjacency.shape[0])]
+        self.imbalances = dict()
+        self._update(range(len(self.reaction_ids)))
+
+    def _update(self, columns):
+        """
+        Recomputes the imbalances of the reactions <columns>
+        :return: dictionary index of reaction -> (imbalances before, imbalances after) for reactions, that changed
+        """
+        columns = sorted(column for column in columns if not self.excluded[column])
+        if not columns:
+            return dict()
+        imbalances = sparse.csc_matrix(self.composition @ self.stoichiometry[:, columns])
+        imbalances.data[np.abs(imbalances.data) < TOLERANCE] = 0
+        imbalances.eliminate_zeros()
+        imbalances.sort_indices()
+        changed = dict()
+        for column, balance in zip(columns, imbalance_dicts(imbalances, range(len(columns)))):
+            before = self.imbalances.get(column, dict())
+            if balance != before:
+                changed[column] = (before, balance)
+            if balance:
+                self.imbalances[column] = balance
+            else:
+                self.imbalances.pop(column, None)
+        return changed
+
+    def _add(self, matrix, row: int, column: int, value: float):
+        """
+        :return: matrix with <value> added to the entry (row, column), as scipy.sparse.csc_matrix
+        """
+        update = sparse.csc_matrix(([value], ([row], [column])), shape=matrix.shape)
+        matrix = (matrix + update).tocsc()
+        matrix.eliminate_zeros()
+        return matrix
+
+    def _set_formula(self, metabolite_id: str, formula: str):
+        elements = fm.parse_formula(formula) if formula else ()
+        if elements is None:
+            raise ValueError(f"{formula} : formula cannot be parsed.")
+        column = self.metabolite_index[metabolite_id]
+        new = np.zeros(len(ROWS))
+        for element, count in elements:
+            new[ROW_INDEX[element]] = count
+        current = self.composition[:, column].toarray().ravel()
+        difference = new - current
+        difference[-1] = 0      # the charge is kept
+        rows = np.flatnonzero(difference)
+        update = sparse.csc_matrix((difference[rows], (rows, np.full(len(rows), column))),
+                                   shape=self.composition.shape)
+        self.composition = (self.composition + update).tocsc()
+        self.composition.eliminate_zeros()
+        return self.reactions_of[column]
+
+    def _set_charge(self, metabolite_id: str, charge: int):
+        column = self.metabolite_index[metabolite_id]
+        self.composition = self._add(self.composition, len(ROWS) - 1, column,
+                                     charge - self.composition[len(ROWS) - 1, column])
+        return self.reactions_of[column]
+
+    def _set_coefficient(self, reaction_id: str, metabolite_id: str, coefficient: float):
+        row, column = self.metabolite_index[metabolite_id], self.reaction_index[reaction_id]
+        self.stoichiometry = self._add(self.stoichiometry, row, column, coefficient - self.stoichiometry[row, column])
+        if coefficient:
+            self.reactions_of[row].add(column)
+        else:
+            self.reactions_of[row].discard(column)
+        return {column}
+
+    def set_formula(self, metabolite_id: str, formula: str):
+        """
+        :param metabolite_id: str e.g. "atp_c"
+        :param formula: str e.g. "C10H12N5O13P3"
+        :return: difference, see delta
+        """
+        return self.delta(self._update(self._set_formula(metabolite_id, formula)))
+
+    def set_charge(self, metabolite_id: str, charge: int):
+        """
+        :param metabolite_id: str e.g. "atp_c"
+        :param charge: int
+        :return: difference, see delta
+        """
+        return self.delta(self._update(self._set_charge(metabolite_id, charge)))
+
+    def set_coefficient(self, reaction_id: str, metabolite_id: str, coefficient: float):
+        """
+        :param reaction_id: str e.g. "PFK"
+        :param metabolite_id: str e.g. "h_c"
+        :param coefficient: float, negative for reactants, 0 removes the metabolite from the reaction
+        :return: difference, see delta
+        """
+        return self.delta(self._update(self._set_coefficient(reaction_id, metabolite_id, coefficient)))
+
+    def apply(self, table):
+        """
+        Applies the changes of a table for balance_from_csv.py. As there, the first row is skipped, reaction ids start
+        with "R_", metabolite ids are given without "M_" and rows with other change types (e.g. only notes) are skipped.
+        :param table: pandas.DataFrame with the columns id, change_type and new
+        :return: difference of all changes, see delta
+        """
+        touched = set()
+        for i in range(1, len(table["id"])):
+            _id, change_type, new = table["id"][i], table["change_type"][i], str(table["new"][i])
+            if _id.startswith("R_") and change_type in ["product", "reactant"]:
+                coefficient, metabolite_id = new.split(" ")
+                sign = 1 if change_type == "product" else -1
+                touched |= self._set_coefficient(_id[2:], metabolite_id, sign * float(coefficient))
+            elif _id.startswith("R_"):
+                continue
+            elif change_type == "charge":
+                touched |= self._set_charge(_id, int(new))
+            elif change_type == "formula":
+                touched |= self._set_formula(_id, new)
+        return self.delta(self._update(touched))
+
+    def delta(self, changed: dict):
+        """
+        :param changed: dictionary index of reaction -> (imbalances before, imbalances after)
+        :return: pandas.DataFrame with the columns reaction, before, after and status ("balanced", "unbalanced" or
+        "changed")
+        """
+        rows = []
+        for column, (before, after) in sorted(changed.items()):
+            status = "balanced" if not after else "unbalanced" if not before else "changed"
+            rows.append([self.reaction_ids[column], before, after, status])
+        return pd.DataFrame(rows, columns=["reaction", "before", "after", "status"])
+
+    def unbalanced(self):
+        """
+        :return: dictionary reaction id -> imbalances of all unbalanced reactions, that are not excluded
+        """
+        return {self.reaction_ids[column]: balance for column, balance in sorted(self.imbalances.items())}
+
+
+def _column(formula: str, charge: float):
+    """
+    :return: numpy array of the counts of ROWS for a formula and charge, None if the formula cannot be parsed
+    """
+    elements = fm.parse_formula(formula) if formula else ()
+    if elements is None:
+        return None
+    column = np.zeros(len(ROWS))
+    for element, count in elements:
+        column[ROW_INDEX[element]] = count
+    column[-1] = charge
+    return column
+
+
+def _charge(charge):
+    """
+    :return: int of a charge of the knowledge base e.g. "-2", None if it is empty
+    """
+    return int(charge) if re.fullmatch(r"-?\d+", str(charge or "")) else None
+
+
+def _base_id(metabolite):
+    return re.sub(f"_{re.escape(metabolite.compartment or '')}$", "", metabolite.id)
+
+
+def _effect(session, row: int, difference):
+    """
+    :param session: BalanceSession
+    :param row: index of a metabolite
+    :param difference: numpy array of the change of its counts of ROWS
+    :return: (set of indices of reactions balanced by the change, set of indices of reactions unbalanced by it)
+    """
+    reactions = sorted(column for column in session.reactions_of[row] if not session.excluded[column])
+    if not reactions:
+        return set(), set()
+    imbalances = (session.composition @ session.stoichiometry[:, reactions]).toarray()
+    coefficients = session.stoichiometry[row, reactions].toarray().ravel()
+    after = imbalances + np.outer(difference, coefficients)
+    balanced_before = np.all(np.abs(imbalances) < TOLERANCE, axis=0)
+    balanced_after = np.all(np.abs(after) < TOLERANCE, axis=0)
+    return ({reactions[k] for k in np.flatnonzero(~balanced_before & balanced_after)},
+            {reactions[k] for k in np.flatnonzero(balanced_before & ~balanced_after)})
+
+
+def _reference_changes(model, session, kb):
+    """
+    :return: list of (metabolite, index of the metabolite, compound of the knowledge base, numpy array of the change
+    of the counts of ROWS) for the metabolites of unbalanced reactions
+    """
+    unbalanced = session.stoichiometry[:, sorted(session.imbalances)]
+    changes = []
+    for row in np.unique(unbalanced.nonzero()[0]):
+        metabolite = model.metabolites[row]
+        current = session.composition[:, row].toarray().ravel()
+        differences = []
+        for db in ["seed", "mnx"]:
+            for compound in kb.compounds_by_alias(db, "bigg", _base_id(metabolite)):
+                charge = _charge(compound["charge"])
+                column = _column(compound["formula"], current[-1] if charge is None else charge)
+                if column is None or compound["formula"] == "":
+                    continue
+                difference = column - current
+                if np.all(np.abs(difference) < TOLERANCE) or \
+                        any(np.all(np.abs(difference - known) < TOLERANCE) for known in differences):
+                    continue
+                differences.append(difference)
+                changes.append((metabolite, row, compound, difference))
+    return changes
+
+
+def metabolite_changes(model, session, kb):
+    """
+    Formulas and charges of the knowledge base (SEED and MetaNetX compounds with the BiGG id of the metabolite), that
+    differ from the model, with the reactions, that they balance or unbalance
+    :param model: cobra.Model
+    :param session: BalanceSession of the model
+    :param kb: knowledge_base.KnowledgeBase
+    :return: list of (metabolite, compound of the knowledge base, set of indices of reactions fixed, set of indices of
+    reactions broken)
+    """
+    changes = []
+    for metabolite, row, compound, difference in _reference_changes(model, session, kb):
+        fixed, broken = _effect(session, row, difference)
+        if fixed:
+            changes.append((metabolite, compound, fixed, broken))
+    return changes
+
+
+def small_species_fixes(model, session, columns: list, small_species: tuple = SMALL_SPECIES,
+                        max_coefficient: int = MAX_COEFFICIENT):
+    """
+    Searches the smallest combination of small species, that balances each reaction, for all reactions at once
+    :param model: cobra.Model
+    :param session: BalanceSession of the model
+    :param columns: list of indices of unbalanced reactions
+    :param small_species: ids of species without compartment e.g. ("h", "h2o")
+    :param max_coefficient: maximal number of each species added or removed
+    :return: dictionary index of reaction -> dictionary species id -> number added (negative: removed)
+    """
+    compositions = dict()
+    for metabolite in model.metabolites:
+        base = _base_id(metabolite)
+        if base in small_species and base not in compositions:
+            compositions[base] = _column(metabolite.formula, metabolite.charge or 0)
+    species = [base for base in small_species if compositions.get(base) is not None]
+    if not species or not columns:
+        return dict()
+
+    # all combinations of coefficients, that change something, smallest first
+    grid = np.array([combination for combination in
+                     itertools.product(range(-max_coefficient, max_coefficient + 1), repeat=len(species))
+                     if any(combination)])
+    grid = grid[np.argsort(np.abs(grid).sum(axis=1), kind="stable")]
+    compositions = np.array([compositions[base] for base in species])
+
+    # only the rows, that are nonzero in an imbalance or a species, can differ from 0, and the reactions are
+    # searched in blocks, so that block x grid x rows stays below SEARCH_SIZE
+    imbalances = (session.composition @ session.stoichiometry[:, columns]).T.tocsc()
+    rows = sorted(set(np.flatnonzero(np.diff(imbalances.indptr))) | set(np.flatnonzero(compositions.any(axis=0))))
+    effects = grid @ compositions[:, rows]
+    imbalances = imbalances[:, rows].toarray()
+    size = max(1, SEARCH_SIZE // (len(grid) * len(rows)))
+
+    fixes = dict()
+    for chunk in range(0, len(columns), size):
+        block = imbalances[chunk:chunk + size]
+        residuals = np.abs(block[:, None, :] + effects[None, :, :]).max(axis=2)
+        solved = residuals < TOLERANCE
+        for k in np.flatnonzero(solved.any(axis=1)):
+            combination = grid[np.argmax(solved[k])]
+            fixes[columns[chunk + k]] = {base: int(count) for base, count in zip(species, combination) if count}
+    return fixes
+
+
+def _species_changes(reaction, base: str, count: int):
+    """
+    :return: (metabolite id, old coefficient, new coefficient), that changes the coefficient of the species <base> in
+    <reaction> by <count>, in the compartment, where the reaction already has it, or the most frequent compartment of
+    the reaction, in which the model has the species. None if the model has it in none of them.
+    """
+    present = [metabolite for metabolite in reaction.metabolites if _base_id(metabolite) == base]
+    if present:
+        return present[0].id, reaction.metabolites[present[0]], reaction.metabolites[present[0]] + count
+    compartments = [metabolite.compartment for metabolite in reaction.metabolites]
+    for compartment in sorted(set(compartments), key=lambda c: (-compartments.count(c), c)):
+        if f"{base}_{compartment}" in reaction.model.metabolites:
+            return f"{base}_{compartment}", 0, count
+    return None
+
+
+def _coefficient_rows(metabolite_id: str, old: float, new: float):
+    """
+    :return: list of [change_type, old, new] for balance_from_csv.py, that change a coefficient from <old> to <new>,
+    the metabolite is removed first, if it changes sides
+    """
+    side = lambda coefficient: "product" if coefficient > 0 else "reactant"
+    rows = []
+    if old != 0 and (new == 0 or side(old) != side(new)):
+        rows.append([side(old), f"{abs(old):g} {metabolite_id}", f"0 {metabolite_id}"])
+        old = 0
+    if new != 0:
+        rows.append([side(new), f"{abs(old):g} {metabolite_id}", f"{abs(new):g} {metabolite_id}"])
+    return rows
+
+
+def suggest(model, kb=None, small_species: tuple = SMALL_SPECIES, max_coefficient: int = MAX_COEFFICIENT):
+    """
+    Suggests the smallest change for every unbalanced reaction, in this order: formulas and charges of the knowledge
+    base, that balance several reactions and unbalance none, adding or removing small species, then formulas and
+    charges, that balance one reaction and unbalance none. Each accepted change is applied to the balance in memory,
+    before the next ones are searched.
+    :param model: cobra.Model, is not changed
+    :param kb: knowledge_base.KnowledgeBase for formulas and charges, None to only suggest small species
+    :param small_species: ids of species without compartment e.g. ("h", "h2o")
+    :param max_coefficient: maximal number of each small species added or removed
+    :return: pandas.DataFrame with CHANGE_COLUMNS for balance_from_csv.py, that skips the first row
+    """
+    session = BalanceSession(model)
+    rows = [["id", "", "", "", "", "", "Suggested by balance.py, this row is skipped by balance_from_csv.py", ""]]
+    foundations = {"seed": "SEED", "mnx": "MetaNetX"}
+    changed = set()
+
+    def change_metabolites(min_fixed: int):
+        # the effects are evaluated again after each accepted change, as it changes the balance of the other candidates
+        if kb is None:
+            return
+        candidates = _reference_changes(model, session, kb)
+        while True:
+            best = None
+            for metabolite, row, compound, difference in candidates:
+                if metabolite.id in changed:
+                    continue
+                fixed, broken = _effect(session, row, difference)
+                if len(fixed) >= min_fixed and not broken and \
+                        (best is None or (-len(fixed), metabolite.id) < (-len(best[2]), best[0].id)):
+                    best = (metabolite, compound, fixed)
+            if best is None:
+                return
+            metabolite, compound, fixed = best
+            notes = "Balances " + ", ".join(model.reactions[column].id for column in sorted(fixed))
+            if fm.formula_key(compound["formula"]) != fm.formula_key(metabolite.formula or ""):
+                rows.append([metabolite.id, "formula", metabolite.formula or "", compound["formula"],
+                             foundations[compound["db"]], compound["id"], notes, ""])
+                session.set_formula(metabolite.id, compound["formula"])
+            if _charge(compound["charge"]) is not None and _charge(compound["charge"]) != (metabolite.charge or 0):
+                rows.append([metabolite.id, "charge", metabolite.charge, _charge(compound["charge"]),
+                             foundations[compound["db"]], compound["id"], notes, ""])
+                session.set_charge(metabolite.id, _charge(compound["charge"]))
+            changed.add(metabolite.id)
+
+    change_metabolites(2)
+
+    fixes = small_species_fixes(model, session, sorted(session.imbalances), small_species, max_coefficient)
+    for column, fix in sorted(fixes.items()):
+        reaction = model.reactions[column]
+        notes = "Imbalance " + ", ".join(f"{key}: {value:g}" for key, value in session.imbalances[column].items())
+        species_changes = [_species_changes(reaction, base, count) for base, count in fix.items()]
+        if None in species_changes:
+            continue
+        for metabolite_id, old, new in species_changes:
+            rows += [["R_" + reaction.id, change_type, old_value, new_value, "Mass balance", "", notes, ""]
+                     for change_type, old_value, new_value in _coefficient_rows(metabolite_id, old, new)]
+            session.set_coefficient(reaction.id, metabolite_id, new)
+
+    change_metabolites(1)
+    return pd.DataFrame(rows, columns=CHANGE_COLUMNS)
+
+
+def main(args):
+    # console access
+    if len(args) < 4 or args[1] not in ["delta", "suggest"] or (args[1] == "delta" and len(args) != 4):
+        print(__doc__)
+        sys.exit(1)
+
+    for path in args[2:3] if args[1] == "suggest" else args[2:4]:
+        if not os.path.exists(path):
+            print("[Error] %s : No such file." % path)
+            sys.exit(1)
+
+    if args[1] == "suggest":
+        model = cobra.io.read_sbml_model(args[2])
+        kb = knb.get_knowledge_base() if os.path.exists(knb.DEFAULT_PATH) or os.path.isdir(knb.DATABASES_PATH) \
+            else None
+        changes = suggest(model, kb, tuple(args[4:]) or SMALL_SPECIES)
+        changes.to_csv(args[3], index=False)
+        print(f"{len(changes) - 1} changes suggested, written to {args[3]}")
+        return
+
+    model = cobra.io.read_sbml_model(args[2])
+    start = time.perf_counter()
+    session = BalanceSession(model)
+    built = time.perf_counter()
+    delta = session.apply(pd.read_csv(args[3]))
+    applied = time.perf_counter()
+    for column in ["before", "after"]:
+        delta[column] = [", ".join(f"{key}: {value:g}" for key, value in balance.items()) for balance in delta[column]]
+    print(delta.to_string(index=False))
+    print(f"{len(session.unbalanced())} unbalanced reactions. Balance of the model in {built - start:.3f} s, "
+          f"changes in {applied - built:.3f} s")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
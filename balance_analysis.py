@@ -5,23 +5,27 @@ import re
 import pandas as pd
 from tqdm import tqdm
 import helper_functions as hf
+import balance as bl
 
 '''
-Usage: balance_analysis.py <path_input_sbml-file> <path_output_tsv-file_imbalances>
+Usage: balance_analysis.py <path_input_sbml-file> <path_output_tsv-file_imbalances> [path_output_tsv-file_ranking]
 The output is a .tsv-format table with the columns: "model_index", "reaction_name", "imbalances",
 "reaction_string", "formulas", "frequent_compound"
 The last row of the table contains a list of compounds that consistently produce the same problem.
+The optional ranking lists these compounds with the number of reactions, that share their most frequent imbalance,
+best first: "metabolite", "reactions", "imbalance", "reaction_ids", "unbalanced"
 '''
 
 
 def main(args):
     # console access
-    if len(args) != 3:
+    if len(args) not in [3, 4]:
         print(main.__doc__)
         sys.exit(1)
 
     infile = args[1]
     outfile = args[2]
+    outfile_ranking = args[3] if len(args) == 4 else None
 
     if not os.path.exists(infile):
         print("[Error] %s : No such file." % infile)
@@ -30,52 +34,45 @@ def main(args):
     # create Readers and Writers
     model = cobra.io.sbml.read_sbml_model(infile)
 
-    # check mass balance:
-    unbalanced_list = pd.DataFrame(columns=["model_index", "reaction_name", "imbalances", "reaction_string",
-                                            "formulas", "frequent_compound"])
+    # check mass balance of all reactions at once
+    imbalances_all, unparsable = bl.check_model(model)
+    for metabolite_id in unparsable:
+        print(f"[Warning] {metabolite_id} : formula cannot be parsed, it is left out of the balance.")
+
+    rows = []
     compound_counter = dict()
-    for i in tqdm(range(len(model.reactions))):
+    for i, imbalances in tqdm(imbalances_all.items()):
         reaction = model.reactions[i]
-        imbalances = reaction.check_mass_balance()
         formulas = ""
-        charges = ""
-
-        # Makes human readable and interpretable lists, when imbalances exist
-        if len(imbalances) > 0 and re.search("EX_|sink_|Growth", reaction.id) is None:
-            reactants, operator, products = re.split("(-->|<=>|<--)", reaction.build_reaction_string())
 
-            metabolites = list(reaction.metabolites.keys())
-            for m in metabolites:
-                if m.id in compound_counter.keys():
-                    compound_counter[m.id].append(i)
-                else:
-                    compound_counter[m.id] = [i]
+        # Makes human readable and interpretable lists
+        metabolites = list(reaction.metabolites.keys())
+        for m in metabolites:
+            if m.id in compound_counter.keys():
+                compound_counter[m.id].append(i)
+            else:
+                compound_counter[m.id] = [i]
 
-                formulas = formulas + m.formula + f"({m.charge}),\n"
+            formulas = formulas + m.formula + f"({m.charge}),\n"
 
-            formulas = formulas[:-2]
-            reactants, operator, products = re.split("(-->|<=>|<--)", reaction.build_reaction_string())
-            reac_str = reactants + operator + "\n" + products
-            unbalanced_list.loc[len(unbalanced_list.index)] = [i, reaction.id, imbalances, reac_str, formulas, ""]
+        formulas = formulas[:-2]
+        reactants, operator, products = re.split("(-->|<=>|<--)", reaction.build_reaction_string())
+        reac_str = reactants + operator + "\n" + products
+        rows.append([i, reaction.id, imbalances, reac_str, formulas, ""])
+    unbalanced_list = pd.DataFrame(rows, columns=["model_index", "reaction_name", "imbalances", "reaction_string",
+                                                  "formulas", "frequent_compound"])
 
     # Extract frequent compounds, that are present with the same imbalances in multiple cases
+    groups = bl.recurring_imbalances(compound_counter, imbalances_all)
     frequent_compounds = []
-    for cckey, ccvalues in compound_counter.items():
-
-        list_imbalances = []
-        for pos in ccvalues:
-
-            imbalances = list(unbalanced_list.loc[unbalanced_list.model_index == pos, "imbalances"])[0]
-            negative_imbalances = dict()
-            for k, v in imbalances.items():
-                negative_imbalances[k] = -v
-
-            if imbalances in list_imbalances or negative_imbalances in list_imbalances:
+    frequent_marks = dict()
+    for cckey, signatures in groups.items():
+        for positions in signatures.values():
+            if len(positions) > 1:
                 frequent_compounds.append(cckey)
-                unbalanced_list.loc[unbalanced_list.model_index == pos, "frequent_compound"] = \
-                    unbalanced_list.loc[unbalanced_list.model_index == pos, "frequent_compound"] + cckey + ", "
-
-            list_imbalances.append(imbalances)
+                for pos in positions[1:]:
+                    frequent_marks[pos] = frequent_marks.get(pos, "") + cckey + ", "
+    unbalanced_list["frequent_compound"] = [frequent_marks.get(pos, "") for pos in unbalanced_list.model_index]
 
     # Make table human-readable
     frequent_compounds = hf.delete_doubles(frequent_compounds)
@@ -98,6 +95,8 @@ def main(args):
 
     # export list
     unbalanced_list.to_csv(outfile, sep="\t")
+    if outfile_ranking is not None:
+        bl.rank_recurring(groups, [reaction.id for reaction in model.reactions]).to_csv(outfile_ranking, sep="\t")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,129 @@
+"""
+Offline resolver for BiGG metabolites and reactions, built from the local BiGG dumps
+Returns the same dictionaries as helper_functions.bigg_request.
+
+Expects (see README):
+- Databases/BiGG/bigg_models_metabolites.tsv
+- Databases/BiGG/bigg_models_reactions.tsv
+- Databases/BiGG/models/*.json      per-model JSON exports, which carry formulas and charges
+"""
+import os
+import re
+import glob
+import json
+import copy
+import helper_functions as hf
+import reference_tables as rt
+
+DEFAULT_PATH = os.path.join("Databases", "BiGG")
+
+
+def parse_database_links(links: str):
+    """
+    :param links: str from the database_links column e.g. "KEGG Compound: http://identifiers.org/kegg.compound/C00014"
+    :return: dictionary in the format of the BiGG API e.g. {"KEGG Compound": [{"link": "...", "id": "C00014"}]}
+    """
+    database_links = dict()
+    for link in links.split(";"):
+        link = link.strip()
+        if ": " not in link:
+            continue
+        db, url = link.split(": ", 1)
+        database_links.setdefault(db, []).append({"link": url, "id": re.split("[/:]", url)[-1]})
+    return database_links
+
+
+class BiggResolver:
+    """
+    Resolves BiGG ids from local files. get() returns None on a miss, so that callers can fall back to the API.
+    Metabolites count as a miss, if no model export contains a formula for them.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        """
+        :param path: directory with the BiGG dumps
+        """
+        self.path = path
+        self.metabolites = dict()
+        self.reactions = dict()
+
+        metabolites_file = os.path.join(path, "bigg_models_metabolites.tsv")
+        if os.path.exists(metabolites_file):
+            self._read_metabolites(metabolites_file)
+        for model_file in sorted(glob.glob(os.path.join(path, "models", "*.json"))):
+            self._read_model(model_file)
+
+        reactions_file = os.path.join(path, "bigg_models_reactions.tsv")
+        if os.path.exists(reactions_file):
+            self._read_reactions(reactions_file)
+
+    def _read_metabolites(self, metabolites_file: str):
+        bigg_db = rt.load_table("bigg_metabolites", ["bigg_id", "universal_bigg_id", "name", "model_list",
+                                                     "database_links", "old_bigg_ids"], path=metabolites_file)
+        for bigg_id, universal_id, name, model_list, links, old_ids in zip(
+                bigg_db["bigg_id"], bigg_db["universal_bigg_id"], bigg_db["name"], bigg_db["model_list"],
+                bigg_db["database_links"], bigg_db["old_bigg_ids"]):
+            if universal_id not in self.metabolites:
+                self.metabolites[universal_id] = {"bigg_id": universal_id, "name": name, "formulae": [],
+                                                  "charges": [], "database_links": parse_database_links(links),
+                                                  "compartments_in_models": [], "old_identifiers": []}
+            metabolite = self.metabolites[universal_id]
+            compartment = bigg_id[len(universal_id) + 1:]
+            for model_id in model_list.split("; "):
+                if model_id != "":
+                    metabolite["compartments_in_models"].append({"bigg_id": compartment, "model_bigg_id": model_id})
+            metabolite["old_identifiers"] += [old_id for old_id in old_ids.split("; ") if old_id != ""]
+
+    def _read_model(self, model_file: str):
+        with open(model_file) as handle:
+            model = json.load(handle)
+        for m in model.get("metabolites", []):
+            universal_id = m["id"].rsplit("_", 1)[0]
+            if universal_id not in self.metabolites:
+                self.metabolites[universal_id] = {"bigg_id": universal_id, "name": m.get("name", ""), "formulae": [],
+                                                  "charges": [], "database_links": {},
+                                                  "compartments_in_models": [], "old_identifiers": []}
+            metabolite = self.metabolites[universal_id]
+            if m.get("formula") and m["formula"] not in metabolite["formulae"]:
+                metabolite["formulae"].append(m["formula"])
+            if m.get("charge") is not None and m["charge"] not in metabolite["charges"]:
+                metabolite["charges"].append(m["charge"])
+
+    def _read_reactions(self, reactions_file: str):
+        bigg_db = rt.load_table("bigg_reactions", ["bigg_id", "name", "reaction_string", "model_list",
+                                                   "database_links", "old_bigg_ids"], path=reactions_file)
+        for bigg_id, name, reaction_string, model_list, links, old_ids in zip(
+                bigg_db["bigg_id"], bigg_db["name"], bigg_db["reaction_string"], bigg_db["model_list"],
+                bigg_db["database_links"], bigg_db["old_bigg_ids"]):
+            metabolites = []
+            if re.search(" <-> | -> | <- ", reaction_string) is None:
+                reaction_string_parsed = dict()
+            else:
+                reaction_string_parsed = hf.parse_bigg_reaction_string(reaction_string)
+            for m_id, stoichiometry in reaction_string_parsed.items():
+                universal_id, _, compartment = m_id.rpartition("_")
+                m_name = self.metabolites[universal_id]["name"] if universal_id in self.metabolites else ""
+                metabolites.append({"bigg_id": universal_id, "name": m_name, "compartment_bigg_id": compartment,
+                                    "stoichiometry": stoichiometry})
+            self.reactions[bigg_id] = {"bigg_id": bigg_id, "name": name, "reaction_string": reaction_string,
+                                       "pseudoreaction": re.match("EX_|DM_|SK_|BIOMASS", bigg_id) is not None,
+                                       "database_links": parse_database_links(links), "metabolites": metabolites,
+                                       "models_containing_reaction": [{"bigg_id": model_id}
+                                                                      for model_id in model_list.split("; ")
+                                                                      if model_id != ""],
+                                       "old_identifiers": [old_id for old_id in old_ids.split("; ") if old_id != ""]}
+
+    def get(self, _id: str, search_type: str = "metabolites"):
+        """
+        :param _id: str e.g. "nh3"
+        :param search_type: str, "metabolites" or "reactions"
+        :return: dictionary like helper_functions.bigg_request or None, if the entry is not known locally
+        """
+        if search_type == "metabolites":
+            metabolite = self.metabolites.get(_id)
+            if metabolite is None or not metabolite["formulae"]:
+                return None
+            return copy.deepcopy(metabolite)
+        if search_type == "reactions" and _id in self.reactions:
+            return copy.deepcopy(self.reactions[_id])
+        return None
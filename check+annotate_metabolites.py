@@ -1,23 +1,300 @@
 import sys
 import os
+import time
 import libsbml
-from tqdm import tqdm
+import telemetry as tm
 import pandas as pd
 from itertools import product
-from bioservices.kegg import KEGG
 from requests.exceptions import HTTPError, RequestException
 import helper_functions as hf
+import bigg_offline as bo
+import knowledge_base as knb
+import formulas as fm
 
 '''
 Usage: check+annotate_metabolites.py <path_input_sbml-file> <outfile-csv> <program_name> <program_version> 
 <tolerate_charge_hydrogen_balancing> : -chBal, if +1 charge should correspond to +1 H-atom
+<--offline> : optional, use local BiGG dumps and only request BiGG on a miss
+<--batch> : optional, resolve all species at once with joins on the knowledge base instead of one by one
 Takes formulas from the notes field and fbc-plugin, if none are found, BiGG-DB is searched for a formula. 
 If multiple or no possibilities are given in BiGG, a csv-formatted table with these metabolites is returned.
 Only searches info, but does not change the model.
 '''
 
+BIOCYC_ORG = "GCF_000010185"
+NAME_CANDIDATES = 3     # compounds with similar names, if no compound has the exact name
+MISSING_BIGG = {"formulae": [], "charges": [], "database_links": {}}   # BiGG entry of failed or unknown species
+MISMATCH_COLUMNS = ["model_index", "name", "spec_id", "ids_biocyc", "ids_metanetx", "ids_seed",
+                    "formula_bigg", "formula_biocyc", "formula_metanetx", "formula_seed", "formula_model",
+                    "charge_bigg", "charge_biocyc", "charge_metanetx", "charge_seed", "charge_model", "matching_db"]
+FORMULA_SEARCH_COLUMNS = ["model_index", "name", "spec_id", "formula_model", "ids_biocyc", "ids_mnx", "ids_seed",
+                          "ids_kegg"]
+
+
+def plan_lookups(model, start: int, num_spec: int):
+    """
+    Walks the model once and enumerates all keys, that are needed from remote databases
+    :param model: libsbml.model
+    :param start: index of first species
+    :param num_spec: number of species
+    :return: list of (pruned id, formula) for all species, formula is "" if none is set
+    """
+    species_keys = []
+    for i in range(start, num_spec):
+        pruned_id = str(model.getSpecies(i).getId())[2:-2]
+        formula = ""
+        if model.getSpecies(i).getPlugin('fbc').isSetChemicalFormula():
+            formula = str(model.getSpecies(i).getPlugin('fbc').getChemicalFormula())
+        species_keys.append((pruned_id, formula))
+    return species_keys
+
+
+def resolve_lookups(species_keys: list):
+    """
+    Requests all keys concurrently. BioCyc formula searches and BioCyc compounds depend on earlier results and are
+    requested in later rounds.
+    :param species_keys: list of (pruned id, formula) from plan_lookups
+    :return: dictionary of lookup tables: bigg, biocyc_foreignid, biocyc_formula, biocyc_compound, kegg_formula
+    """
+    pruned_ids = list(dict.fromkeys(pruned_id for pruned_id, formula in species_keys))
+    formulas = list(dict.fromkeys(formula for pruned_id, formula in species_keys if formula != ""))
+
+    lookups = dict()
+    lookups["bigg"] = dict(zip(pruned_ids, hf.bigg_request_many(pruned_ids, "metabolites")))
+    lookups["biocyc_foreignid"] = dict(zip(pruned_ids, hf.biocyc_request_many(BIOCYC_ORG, "BIGG", pruned_ids)))
+    lookups["kegg_formula"] = dict(zip(formulas, hf.map_requests(
+        hf.kegg_rest, [("find", "compound", formula, "formula") for formula in formulas], default="")))
+
+    # BioCyc formula search for species, that are not found via their BiGG id
+    formulas_biocyc = list(dict.fromkeys(
+        formula for pruned_id, formula in species_keys
+        if formula != "" and lookups["biocyc_foreignid"][pruned_id] is not None
+        and not lookups["biocyc_foreignid"][pruned_id][0]["STATUS"] == 1))
+    lookups["biocyc_formula"] = dict(zip(formulas_biocyc, hf.map_requests(
+        hf.biocyc_get_from_formula, [(BIOCYC_ORG, formula) for formula in formulas_biocyc])))
+
+    # BioCyc compounds of all results
+    ids_biocyc = []
+    for biocyc_req in list(lookups["biocyc_foreignid"].values()) + list(lookups["biocyc_formula"].values()):
+        if biocyc_req is not None and biocyc_req[0]["STATUS"] == 1:
+            ids_biocyc += [res["ID"] for res in biocyc_req[0]["RESULTS"]]
+    ids_biocyc = list(dict.fromkeys(ids_biocyc))
+    lookups["biocyc_compound"] = dict(zip(ids_biocyc, hf.biocyc_get_many("meta", ids_biocyc, "low")))
+
+    return lookups
+
+
+def biocyc_compounds(spec_id: str, formula_model, lookups: dict):
+    """
+    :param spec_id: id of the species e.g. "M_atp_c"
+    :param formula_model: formula of the species, [] or "" if none
+    :param lookups: dictionary of lookup tables from resolve_lookups
+    :return: (ids, formulas, charges, found by formula), BioCyc compounds with the BiGG id of the species, otherwise
+    with its formula
+    """
+    formulas_biocyc = []
+    charges_biocyc = []
+    ids_biocyc = []
+    by_formula = False
+    biocyc_req = lookups["biocyc_foreignid"][spec_id[2:-2]]
+    if biocyc_req is None:
+        # the formula search and the compounds depend on this request, they were not requested either
+        hf.report_missing(hf.biocyc_request, BIOCYC_ORG, "BIGG", spec_id[2:-2])
+        return ids_biocyc, formulas_biocyc, charges_biocyc, by_formula
+    if not biocyc_req[0]["STATUS"] == 1:
+        biocyc_req = lookups["biocyc_formula"].get(formula_model) if formula_model else None
+        if formula_model and biocyc_req is None:
+            hf.report_missing(hf.biocyc_get_from_formula, BIOCYC_ORG, formula_model)
+        biocyc_req = biocyc_req or [{"STATUS": 0}]
+        by_formula = True
+    if biocyc_req[0]["STATUS"] == 1:
+        for res in biocyc_req[0]["RESULTS"]:
+            ids_biocyc.append(res["ID"])
+            try:
+                biocyc_tree = lookups["biocyc_compound"][res["ID"]]
+                if biocyc_tree is None:
+                    raise HTTPError(res["ID"])
+                charges_biocyc.append(int(biocyc_tree["ptools-xml"]["Compound"]["cml"]["molecule"]["@formalCharge"]))
+                formulas_biocyc_str = biocyc_tree["ptools-xml"]["Compound"]["cml"]["molecule"]["formula"]["@concise"]
+                formulas_biocyc.append(formulas_biocyc_str.replace(" ", ""))
+            except KeyError:
+                print(spec_id + ": no simple compound.")
+            except HTTPError or RequestException:
+                print(spec_id + " failed in biocyc request.")
+    return ids_biocyc, formulas_biocyc, charges_biocyc, by_formula
+
+
+def species_frame(model, start: int, num_spec: int, lookups: dict):
+    """
+    :param model: libsbml.model
+    :param start: index of first species
+    :param num_spec: number of species
+    :param lookups: dictionary of lookup tables from resolve_lookups
+    :return: pandas.DataFrame, one row per species with model_index, spec_id, pruned_id, name, formula ("" if none),
+    charge (None if none), inchikey ("" if BiGG has none) and the BiGG formulae and charges
+    """
+    rows = []
+    for i in range(start, num_spec):
+        species = model.getSpecies(i)
+        spec_id = str(species.getId())
+        fbc = species.getPlugin('fbc')
+        bigg_query = lookups["bigg"][spec_id[2:-2]]
+        if bigg_query is None:
+            hf.report_missing(hf.bigg_request, spec_id[2:-2], "metabolites")
+            bigg_query = MISSING_BIGG
+        try:
+            inchikey = bigg_query["database_links"]["InChi Key"]["id"]
+        except KeyError:
+            inchikey = ""
+        rows.append([i, spec_id, spec_id[2:-2], species.getName(),
+                     str(fbc.getChemicalFormula()) if fbc.isSetChemicalFormula() else "",
+                     fbc.getCharge() if fbc.isSetCharge() else None, inchikey,
+                     bigg_query["formulae"], bigg_query["charges"]])
+    return pd.DataFrame(rows, columns=["model_index", "spec_id", "pruned_id", "name", "formula", "charge", "inchikey",
+                                       "formulas_bigg", "charges_bigg"])
+
+
+def join_compounds(species, kb, db: str, neutral: bool = False):
+    """
+    Resolves all species at once against the compounds of <db> in the knowledge base, with the same precedence as the
+    single species queries: BiGG alias (SEED only), then InChIKey, name (similar names if none is equal) or formula
+    :param species: pandas.DataFrame from species_frame
+    :param kb: knowledge_base.KnowledgeBase
+    :param db: "mnx" or "seed"
+    :param neutral: True (-chBal) searches formulas of species with charge normalised to charge 0
+    :return: (pandas.DataFrame of model_index, id, formula, charge in the order of the species, set of model_index
+    resolved by formula)
+    """
+    compounds = pd.read_sql_query("SELECT id, name, formula, charge, inchikey, formula_key, neutral_key "
+                                  "FROM compounds WHERE db = ?", kb.con, params=(db,))
+    species = species.assign(formula_key=species["formula"].map(fm.formula_key),
+                             neutral_key=[fm.formula_key(formula, int(charge)) if formula and charge is not None and
+                                          not pd.isna(charge) else None
+                                          for formula, charge in zip(species["formula"], species["charge"])])
+    columns = ["model_index", "id", "formula", "charge"]
+    matches = []
+    resolved = pd.Series(False, index=species.index)
+
+    if db == "seed":
+        aliases = pd.read_sql_query("SELECT alias, id FROM aliases WHERE db = ? AND namespace = 'bigg'", kb.con,
+                                    params=(db,)).drop_duplicates()
+        by_alias = species[["model_index", "pruned_id"]].merge(aliases, left_on="pruned_id", right_on="alias") \
+            .merge(compounds, on="id")
+        matches.append(by_alias[columns])
+        resolved |= species["model_index"].isin(by_alias["model_index"])
+
+    rule = pd.Series("", index=species.index)
+    rule[~resolved & (species["inchikey"] != "")] = "inchikey"
+    rule[~resolved & (species["inchikey"] == "") & (species["name"] != "")] = "name"
+    rule[~resolved & (species["inchikey"] == "") & (species["name"] == "") & (species["formula"] != "")] = "formula"
+    if neutral:
+        rule[(rule == "formula") & species["neutral_key"].notna()] = "neutral"
+    for key in ["inchikey", "name", "formula_key", "neutral_key"]:
+        selected = species[rule == key.replace("_key", "")]
+        joined = selected[["model_index", key]].merge(compounds[compounds[key].notna() & (compounds[key] != "")],
+                                                      on=key)
+        matches.append(joined[columns])
+
+    # similar names for species without exact name
+    unmatched = species[(rule == "name") & ~species["model_index"].isin(matches[-3]["model_index"])]
+    similar = [[index, row["id"], row["formula"], row["charge"]] for index, name in
+               zip(unmatched["model_index"], unmatched["name"])
+               for row in kb.compounds_by_name(db, name, k=NAME_CANDIDATES)]
+    matches.append(pd.DataFrame(similar, columns=columns))
+
+    order = species["model_index"].reset_index(drop=True)
+    result = pd.concat(matches, ignore_index=True)
+    result["position"] = result["model_index"].map(pd.Series(order.index, index=order.values))
+    result = result.sort_values("position", kind="stable").drop(columns="position")
+    return result, set(species.loc[rule.isin(["formula", "neutral"]), "model_index"])
+
+
+def batch_check(model, start: int, num_spec: int, lookups: dict, kb, tolerate_ch_h_bal: bool):
+    """
+    Compares the formulas of all species with BiGG, BioCyc, MetaNetX and SEED at once
+    :param model: libsbml.model
+    :param start: index of first species
+    :param num_spec: number of species
+    :param lookups: dictionary of lookup tables from resolve_lookups
+    :param kb: knowledge_base.KnowledgeBase
+    :param tolerate_ch_h_bal: True if +1 charge should correspond to +1 H-atom
+    :return: (mismatches, formula_search) as pandas.DataFrame with the columns of the single species mode
+    """
+    species = species_frame(model, start, num_spec, lookups)
+    biocyc = [biocyc_compounds(spec_id, formula, lookups) for spec_id, formula in
+              zip(species["spec_id"], species["formula"])]
+    mnx_all, mnx_by_formula = join_compounds(species, kb, "mnx", tolerate_ch_h_bal)
+    # as in the single species mode all MetaNetX ids are listed, but only formulas with charge are compared
+    mnx = mnx_all[(mnx_all["formula"] != "") & (mnx_all["charge"] != "")]
+    seed, seed_by_formula = join_compounds(species, kb, "seed", tolerate_ch_h_bal)
+    seed = seed.assign(charge=seed["charge"].map(int))
+
+    def grouped(matches, column):
+        return matches.groupby("model_index", sort=False)[column].agg(list)
+
+    ids = {2: grouped(mnx_all, "id"), 3: grouped(seed, "id")}
+    formulas = {2: grouped(mnx, "formula"), 3: grouped(seed, "formula")}
+    charges = {2: grouped(mnx, "charge"), 3: grouped(seed, "charge")}
+    by_formula = {1: {index for index, entry in zip(species["model_index"], biocyc) if entry[3]},
+                  2: mnx_by_formula, 3: seed_by_formula}
+
+    # one row per (species, database, formula, charge) to compare
+    candidates = []
+    for position, row in enumerate(species.itertuples(index=False)):
+        # as in the single species mode, species without formula are always mismatches
+        if row.formula == "":
+            continue
+        formulas_all = [row.formulas_bigg, biocyc[position][1], formulas[2].get(row.model_index, []),
+                        formulas[3].get(row.model_index, [])]
+        charges_all = [row.charges_bigg, biocyc[position][2], charges[2].get(row.model_index, []),
+                       charges[3].get(row.model_index, [])]
+        for j in range(len(formulas_all)):
+            if row.model_index in by_formula.get(j, set()):
+                continue
+            if tolerate_ch_h_bal:
+                candidates += [(row.model_index, j, formula, charge) for formula, charge in
+                               product(formulas_all[j], charges_all[j])]
+            else:
+                candidates += [(row.model_index, j, formula, None) for formula in formulas_all[j]]
+    candidates = pd.DataFrame(candidates, columns=["model_index", "db", "formula", "charge"])
+    candidates = candidates.merge(species[["model_index", "formula", "charge"]], on="model_index",
+                                  suffixes=("", "_model"))
+
+    # element counts compared in one array operation, with -chBal charge-adjusted if both charges are known
+    neutral = candidates["charge"].notna() & candidates["charge_model"].fillna(0).astype(bool)
+    candidates["match"] = fm.compare_pairs(candidates["formula_model"].tolist(), candidates["formula"].tolist(),
+                                           candidates["charge_model"].where(neutral, 0).tolist(),
+                                           candidates["charge"].where(neutral, 0).tolist())
+    matching_dbs = candidates[candidates["match"]].groupby("model_index", sort=False)["db"].agg(list)
+
+    mismatches = []
+    formula_search = []
+    for position, row in enumerate(species.itertuples(index=False)):
+        ids_biocyc, formulas_biocyc, charges_biocyc = biocyc[position][:3]
+        ids_mnx, ids_seed = ids[2].get(row.model_index, []), ids[3].get(row.model_index, [])
+        formula_model = row.formula or []
+        charge_model = [] if row.charge is None or pd.isna(row.charge) else int(row.charge)
+        matches = matching_dbs.get(row.model_index, [])
+        if not matches:
+            mismatches.append([row.model_index, row.name, row.spec_id, ids_biocyc, ids_mnx, ids_seed,
+                               row.formulas_bigg, formulas_biocyc, formulas[2].get(row.model_index, []),
+                               formulas[3].get(row.model_index, []), formula_model,
+                               row.charges_bigg, charges_biocyc, charges[2].get(row.model_index, []),
+                               charges[3].get(row.model_index, []), charge_model, matches])
+        if row.formula:
+            ids_kegg = [kq.split("\t")[0] for kq in lookups["kegg_formula"][row.formula].split("\n")]
+            formula_search.append([row.model_index, row.name, row.spec_id, formula_model,
+                                   ids_biocyc, ids_mnx, ids_seed, ids_kegg])
+    return pd.DataFrame(mismatches, columns=MISMATCH_COLUMNS), pd.DataFrame(formula_search,
+                                                                            columns=FORMULA_SEARCH_COLUMNS)
+
 
 def main(args):
+    # local BiGG dumps instead of BiGG API
+    offline = "--offline" in args
+    batch = "--batch" in args
+    args = [arg for arg in args if arg not in ["--offline", "--batch"]]
+
     # console access
     if len(args) < 3:
         print(main.__doc__)
@@ -33,6 +310,9 @@ def main(args):
         print("[Error] %s : No such file." % infile)
         sys.exit(1)
 
+    if offline:
+        hf.set_bigg_resolver(bo.BiggResolver())
+
     # create Readers and Writers
     reader = libsbml.SBMLReader()
 
@@ -43,17 +323,11 @@ def main(args):
     # Knowledge base preparation
     # bigg_db = pd.read_csv("Databases/BiGG/bigg_models_metabolites.tsv", sep='\t')
 
-    mnx_db = pd.read_csv("Databases/MetaNetX/chem_prop.tsv", header=351, sep='\t')
-    mnx_db.rename(columns={'#ID': 'id'}, inplace=True)
-    mnx_db.fillna("", inplace=True)
-
-    seed_db = pd.read_csv("Databases/SEED/compounds.tsv", header=0, sep="\t")
-    seed_db.fillna("", inplace=True)
+    # MetaNetX and SEED compounds, compiled once by knowledge_base.py
+    with tm.telemetry.timer("kb_open"):
+        kb = knb.get_knowledge_base()
 
-    kegg = KEGG()
-    req = kegg.lookfor_organism('finegoldia magna')[0].split(' ')
-    entry = req[0]  # "T00661"
-    org_code = req[1]  # 'fma'
+    entry, org_code = hf.kegg_organism('finegoldia magna')  # "T00661", 'fma'
 
     # -------- formula check against knowledge bases ---------
     start = 0
@@ -66,200 +340,196 @@ def main(args):
         start = max(start, int(formula_searches_old.tail(1)["model_index"][1]) + 1)
         mismatches_old = None
 
-    mismatches = pd.DataFrame(columns=["model_index", "name", "spec_id", "ids_biocyc", "ids_metanetx", "ids_seed",
-                                       "formula_bigg", "formula_biocyc", "formula_metanetx", "formula_seed",
-                                       "formula_model",
-                                       "charge_bigg", "charge_biocyc", "charge_metanetx", "charge_seed",
-                                       "charge_model", "matching_db"])
-    formula_search = pd.DataFrame(columns=["model_index", "name", "spec_id", "formula_model",
-                                           "ids_biocyc", "ids_mnx", "ids_seed", "ids_kegg"])
-    form_comp = [False, False, False, False, False]
+    mismatches = pd.DataFrame(columns=MISMATCH_COLUMNS)
+    formula_search = pd.DataFrame(columns=FORMULA_SEARCH_COLUMNS)
     num_spec = model.getNumSpecies()
-    for i in tqdm(range(start, num_spec)):
-        # --------- Knowledge collection ---------
-        spec_id = str(model.getSpecies(i).getId())
 
-        try:
-            # Check for formula in model
-            formula_model = []
-            charge_model = []
-            name_model = ""
-            if model.getSpecies(i).getPlugin('fbc').isSetChemicalFormula():
-                formula_model = str(model.getSpecies(i).getPlugin('fbc').getChemicalFormula())
-            if model.getSpecies(i).getPlugin('fbc').isSetCharge():
-                charge_model = model.getSpecies(i).getPlugin('fbc').getCharge()
-            name_model = model.getSpecies(i).getName()
-
-            # BiGG              formulas  - commented out: extraction from tsv (contains no formula and charge)
-            # bigg_query = bigg_db.loc[bigg_db['bigg_id'] == pruned_id]
-            bigg_query = hf.bigg_request(spec_id[2:-2], "metabolites")
-            formulas_bigg = bigg_query["formulae"]
-            charges_bigg = bigg_query["charges"]
+    # Enumerate all keys for remote databases and request them in bulk
+    time_start = time.perf_counter()
+    species_keys = plan_lookups(model, start, num_spec)
+    time_planned = time.perf_counter()
+    lookups = resolve_lookups(species_keys)
+    time_resolved = time.perf_counter()
+
+    if batch:
+        mismatches, formula_search = batch_check(model, start, num_spec, lookups, kb, tolerate_ch_h_bal)
+    else:
+        for i in tm.progress(range(start, num_spec)):
+            # --------- Knowledge collection ---------
+            spec_id = str(model.getSpecies(i).getId())
+            # databases searched by formula instead of id, InChIKey or name
+            form_comp = [False, False, False, False, False]
+
             try:
-                inchikey = bigg_query["database_links"]["InChi Key"]["id"]
-            except KeyError:
-                inchikey = False
-
-            # Biocyc
-            formulas_biocyc = []
-            charges_biocyc = []
-            ids_biocyc = []
-            biocyc_req = hf.biocyc_request("GCF_000010185", "BIGG", spec_id[2:-2])
-            if not biocyc_req[0]["STATUS"] == 1:
-                biocyc_req = hf.biocyc_get_from_formula("GCF_000010185", formula_model)
-                form_comp[1] = True
-            if biocyc_req[0]["STATUS"] == 1:
-                for res in biocyc_req[0]["RESULTS"]:
-                    ids_biocyc.append(res["ID"])
-                    try:
-                        biocyc_tree = hf.biocyc_get(id_org="meta", id_biocyc=res["ID"], detail="low")
-                        charges_biocyc.append(
-                            int(biocyc_tree["ptools-xml"]["Compound"]["cml"]["molecule"]["@formalCharge"]))
-                        formulas_biocyc_str = biocyc_tree["ptools-xml"]["Compound"]["cml"]["molecule"]["formula"][
-                            "@concise"]
-                        formulas_biocyc.append(formulas_biocyc_str.replace(" ", ""))
-                    except KeyError:
-                        print(spec_id + ": no simple compound.")
-                    except HTTPError or RequestException:
-                        print(spec_id + " failed in biocyc request.")
-
-            # MetaNetX
-            charges_mnx = []
-            formulas_mnx = []
-            ids_mnx = []
-            if inchikey:
-                mnx_query = mnx_db.loc[mnx_db['InChiKey'] == inchikey]
-            elif name_model != "":
-                mnx_query = mnx_db.loc[mnx_db['name'] == name_model]
-            elif formula_model != "":
-                mnx_query = mnx_db.loc[mnx_db['formula'] == formula_model]
-                form_comp[2] = True
-            else:
-                mnx_query = pd.DataFrame({'formula': [], 'charge': []})
-            for idx, row in mnx_query.iterrows():
-                ids_mnx.append(row["id"])
-                if row["formula"] != "" and row["charge"] != "":
-                    formulas_mnx.append(row['formula'])
-                    charges_mnx.append(row['charge'])
-
-            # SEED
-            formulas_seed = []
-            charges_seed = []
-            ids_seed = []
-            search = seed_db['aliases'].str.contains("BiGG: " + spec_id[2:-2])
-            if search.any():
-                seed_query = seed_db.loc[search]
-            elif inchikey:
-                seed_query = seed_db.loc[seed_db['inchikey'] == inchikey]
-            elif name_model != "":
-                seed_query = seed_db.loc[seed_db['name'] == name_model]
-            elif formula_model != "":
-                seed_query = seed_db.loc[seed_db['formula'] == formula_model]
-                form_comp[3] = True
-            else:
-                seed_query = pd.DataFrame({'formula': [], 'charge': []})
-            for idx, row in seed_query.iterrows():
-                ids_seed.append(row['id'])
-                formulas_seed.append(row['formula'])
-                charges_seed.append(int(row['charge']))
-
-            # KEGG
-            ids_kegg = []
-            if formula_model != "":
-                kegg_query = kegg.find("compound", formula_model, "formula").split("\n")
-                form_comp[4] = True
-            else:
-                kegg_query = pd.DataFrame({'formula': [], 'charge': []})
-            for kq in kegg_query:
-                ids_kegg.append(kq.split("\t")[0])
-
-        except Exception as e:
-            print(spec_id)
-            raise e
-
-        # --------- Knowledge vs. current entry - comparison ---------
-        matching_dbs = []
-        formula_matching_ids = []
-        if not model.getSpecies(i).getPlugin('fbc').isSetChemicalFormula():
-            mismatches.loc[len(mismatches.index)] = [i, model.getSpecies(i).getName(),
-                                                     spec_id, ids_biocyc, ids_mnx, ids_seed,
-                                                     formulas_bigg, formulas_biocyc, formulas_mnx, formulas_seed,
-                                                     formula_model,
-                                                     charges_bigg, charges_biocyc, charges_mnx, charges_seed,
-                                                     charge_model,
-                                                     matching_dbs]
-            continue
+                # Check for formula in model
+                formula_model = []
+                charge_model = []
+                name_model = ""
+                if model.getSpecies(i).getPlugin('fbc').isSetChemicalFormula():
+                    formula_model = str(model.getSpecies(i).getPlugin('fbc').getChemicalFormula())
+                if model.getSpecies(i).getPlugin('fbc').isSetCharge():
+                    charge_model = model.getSpecies(i).getPlugin('fbc').getCharge()
+                name_model = model.getSpecies(i).getName()
 
-        formulas_all = [formulas_bigg, formulas_biocyc, formulas_mnx, formulas_seed]
-        charges_all = [charges_bigg, charges_biocyc, charges_mnx, charges_seed]
-        ids_all = [spec_id[2:-2], ids_biocyc, ids_mnx, ids_seed]
-        comparisons_bool = []
-        for j in range(len(formulas_all)):
-            if form_comp[j]:
-                formula_matching_ids.append(ids_all[j])
-            else:
-                if tolerate_ch_h_bal:
-                    for_cha_product = list(product(formulas_all[j], charges_all[j]))
+                # with -chBal formulas are searched normalised to charge 0, if the model has a charge
+                neutral_charge = int(charge_model) if tolerate_ch_h_bal and charge_model != [] else None
+
+                # BiGG              formulas  - commented out: extraction from tsv (contains no formula and charge)
+                # bigg_query = bigg_db.loc[bigg_db['bigg_id'] == pruned_id]
+                bigg_query = lookups["bigg"][spec_id[2:-2]]
+                if bigg_query is None:
+                    hf.report_missing(hf.bigg_request, spec_id[2:-2], "metabolites")
+                    bigg_query = MISSING_BIGG
+                formulas_bigg = bigg_query["formulae"]
+                charges_bigg = bigg_query["charges"]
+                try:
+                    inchikey = bigg_query["database_links"]["InChi Key"]["id"]
+                except KeyError:
+                    inchikey = False
+
+                # Biocyc
+                ids_biocyc, formulas_biocyc, charges_biocyc, form_comp[1] = biocyc_compounds(spec_id, formula_model,
+                                                                                             lookups)
+
+                # MetaNetX
+                charges_mnx = []
+                formulas_mnx = []
+                ids_mnx = []
+                if inchikey:
+                    mnx_query = kb.compounds("mnx", inchikey=inchikey)
+                elif name_model != "":
+                    mnx_query = kb.compounds("mnx", name=name_model) or \
+                        kb.compounds_by_name("mnx", name_model, k=NAME_CANDIDATES)
+                elif formula_model:
+                    mnx_query = kb.compounds_by_formula("mnx", formula_model, neutral_charge)
+                    form_comp[2] = True
+                else:
+                    mnx_query = []
+                for row in mnx_query:
+                    ids_mnx.append(row["id"])
+                    if row["formula"] != "" and row["charge"] != "":
+                        formulas_mnx.append(row['formula'])
+                        charges_mnx.append(row['charge'])
+
+                # SEED
+                formulas_seed = []
+                charges_seed = []
+                ids_seed = []
+                search = kb.compounds_by_alias("seed", "BiGG", spec_id[2:-2])
+                if search:
+                    seed_query = search
+                elif inchikey:
+                    seed_query = kb.compounds("seed", inchikey=inchikey)
+                elif name_model != "":
+                    seed_query = kb.compounds("seed", name=name_model) or \
+                        kb.compounds_by_name("seed", name_model, k=NAME_CANDIDATES)
+                elif formula_model:
+                    seed_query = kb.compounds_by_formula("seed", formula_model, neutral_charge)
+                    form_comp[3] = True
                 else:
-                    for_cha_product = formulas_all[j]
-
-                for fcp in for_cha_product:
-                    if tolerate_ch_h_bal and charges_all[j] and charge_model:
-                        comparison = hf.compare_formulas([fcp[0], formula_model], [int(fcp[1]), charge_model])
-                        comparisons_bool.append(comparison)
-                    else:
-                        comparison = hf.compare_formulas([fcp[0], formula_model])
-                        comparisons_bool.append(comparison)
-
-                    if comparison:
-                        matching_dbs.append(j)
-
-        # --------- Collection in table ---------
-        if True not in comparisons_bool:
-            mismatches.loc[len(mismatches.index)] = [i, model.getSpecies(i).getName(),
-                                                     spec_id, ids_biocyc, ids_mnx, ids_seed,
-                                                     formulas_all[0], formulas_all[1], formulas_all[2], formulas_all[3],
-                                                     formula_model,
-                                                     charges_all[0], charges_all[1], charges_all[2], charges_all[3],
-                                                     charge_model,
-                                                     matching_dbs]
-        formula_search.loc[len(formula_search.index)] = [i, model.getSpecies(i).getName(), spec_id, formula_model,
-                                                         ids_biocyc, ids_mnx, ids_seed, ids_kegg]
-
-        # in between saves
-        if i % 50 == 25:
-            if os.path.exists(outfile_mismatches):
-                mismatches_old = pd.read_csv(outfile_mismatches, sep="\t", index_col=0)
-                mismatches = pd.concat([mismatches_old, mismatches])
-                mismatches.reset_index(drop=True, inplace=True)
-                mismatches_old = None
-            mismatches.to_csv(outfile_mismatches, sep="\t")
-            mismatches = pd.DataFrame(
-                columns=["model_index", "name", "spec_id", "ids_biocyc", "ids_metanetx", "ids_seed",
-                         "formula_bigg", "formula_biocyc", "formula_metanetx", "formula_seed",
-                         "formula_model",
-                         "charge_bigg", "charge_biocyc", "charge_metanetx", "charge_seed",
-                         "charge_model", "matching_db"])
-
-            if os.path.exists(outfile_formula_search):
-                formula_search_old = pd.read_csv(outfile_formula_search, sep="\t", index_col=0)
-                formula_search = pd.concat([formula_search_old, formula_search])
-                formula_search.reset_index(drop=True, inplace=True)
-                formula_search_old = None
-            formula_search.to_csv(outfile_formula_search, sep="\t")
-            formula_search = pd.DataFrame(columns=["model_index", "name", "spec_id", "formula_model",
-                                                   "ids_biocyc", "ids_mnx", "ids_seed", "ids_kegg"])
+                    seed_query = []
+                for row in seed_query:
+                    ids_seed.append(row['id'])
+                    formulas_seed.append(row['formula'])
+                    charges_seed.append(int(row['charge']))
+
+                # KEGG
+                ids_kegg = []
+                if formula_model:
+                    kegg_query = lookups["kegg_formula"][formula_model].split("\n")
+                    form_comp[4] = True
+                else:
+                    kegg_query = pd.DataFrame({'formula': [], 'charge': []})
+                for kq in kegg_query:
+                    ids_kegg.append(kq.split("\t")[0])
+
+            except Exception as e:
+                print(spec_id)
+                raise e
+
+            # --------- Knowledge vs. current entry - comparison ---------
+            matching_dbs = []
+            formula_matching_ids = []
+            if not model.getSpecies(i).getPlugin('fbc').isSetChemicalFormula():
+                mismatches.loc[len(mismatches.index)] = [i, model.getSpecies(i).getName(),
+                                                         spec_id, ids_biocyc, ids_mnx, ids_seed,
+                                                         formulas_bigg, formulas_biocyc, formulas_mnx, formulas_seed,
+                                                         formula_model,
+                                                         charges_bigg, charges_biocyc, charges_mnx, charges_seed,
+                                                         charge_model,
+                                                         matching_dbs]
+                continue
+
+            formulas_all = [formulas_bigg, formulas_biocyc, formulas_mnx, formulas_seed]
+            charges_all = [charges_bigg, charges_biocyc, charges_mnx, charges_seed]
+            ids_all = [spec_id[2:-2], ids_biocyc, ids_mnx, ids_seed]
+            # all candidates (database, formula, charge) of the species, compared in one array operation
+            candidates = []
+            for j in range(len(formulas_all)):
+                if form_comp[j]:
+                    formula_matching_ids.append(ids_all[j])
+                elif tolerate_ch_h_bal:
+                    candidates += [(j, formula_db, charge_db) for formula_db, charge_db in
+                                   product(formulas_all[j], charges_all[j])]
+                else:
+                    candidates += [(j, formula_db, None) for formula_db in formulas_all[j]]
+
+            # with -chBal +1 charge corresponds to +1 H-atom, if the model has a charge
+            formulas_db = [formula_db for j, formula_db, charge_db in candidates]
+            if tolerate_ch_h_bal and charge_model:
+                comparisons_bool = fm.compare(formula_model, formulas_db, charge_model,
+                                              [charge_db for j, formula_db, charge_db in candidates]).tolist()
+            else:
+                comparisons_bool = fm.compare(formula_model, formulas_db).tolist()
+            matching_dbs += [j for (j, formula_db, charge_db), comparison in zip(candidates, comparisons_bool)
+                             if comparison]
+
+            # --------- Collection in table ---------
+            if True not in comparisons_bool:
+                mismatches.loc[len(mismatches.index)] = [i, model.getSpecies(i).getName(),
+                                                         spec_id, ids_biocyc, ids_mnx, ids_seed,
+                                                         formulas_all[0], formulas_all[1], formulas_all[2],
+                                                         formulas_all[3], formula_model,
+                                                         charges_all[0], charges_all[1], charges_all[2], charges_all[3],
+                                                         charge_model,
+                                                         matching_dbs]
+            formula_search.loc[len(formula_search.index)] = [i, model.getSpecies(i).getName(), spec_id, formula_model,
+                                                             ids_biocyc, ids_mnx, ids_seed, ids_kegg]
+
+            # in between saves
+            if i % 50 == 25:
+                if os.path.exists(outfile_mismatches):
+                    mismatches_old = pd.read_csv(outfile_mismatches, sep="\t", index_col=0)
+                    mismatches = pd.concat([mismatches_old, mismatches])
+                    mismatches.reset_index(drop=True, inplace=True)
+                    mismatches_old = None
+                mismatches.to_csv(outfile_mismatches, sep="\t")
+                mismatches = pd.DataFrame(columns=MISMATCH_COLUMNS)
+
+                if os.path.exists(outfile_formula_search):
+                    formula_search_old = pd.read_csv(outfile_formula_search, sep="\t", index_col=0)
+                    formula_search = pd.concat([formula_search_old, formula_search])
+                    formula_search.reset_index(drop=True, inplace=True)
+                    formula_search_old = None
+                formula_search.to_csv(outfile_formula_search, sep="\t")
+                formula_search = pd.DataFrame(columns=FORMULA_SEARCH_COLUMNS)
+
+    time_compared = time.perf_counter()
+    print(f"Planning: {time_planned - time_start:.2f} s, resolution: {time_resolved - time_planned:.2f} s, "
+          f"comparison: {time_compared - time_resolved:.2f} s")
 
     # Exporting mismatches and formula search results
-    mismatches_old = pd.read_csv(outfile_mismatches, sep="\t", index_col=0)
-    mismatches = pd.concat([mismatches_old, mismatches])
-    mismatches.reset_index(drop=True, inplace=True)
-    mismatches_old = None
+    if os.path.exists(outfile_mismatches):
+        mismatches_old = pd.read_csv(outfile_mismatches, sep="\t", index_col=0)
+        mismatches = pd.concat([mismatches_old, mismatches])
+        mismatches.reset_index(drop=True, inplace=True)
+        mismatches_old = None
     mismatches.to_csv(outfile_mismatches, sep="\t")
-    formula_search_old = pd.read_csv(outfile_formula_search, sep="\t", index_col=0)
-    formula_search = pd.concat([formula_search_old, formula_search])
-    formula_search.reset_index(drop=True, inplace=True)
-    formula_search_old = None
+    if os.path.exists(outfile_formula_search):
+        formula_search_old = pd.read_csv(outfile_formula_search, sep="\t", index_col=0)
+        formula_search = pd.concat([formula_search_old, formula_search])
+        formula_search.reset_index(drop=True, inplace=True)
+        formula_search_old = None
     formula_search.to_csv(outfile_formula_search, sep="\t")
 
 
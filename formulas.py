@@ -0,0 +1,200 @@
+"""
+Canonical chemical formulas: element counts in Hill order, used as keys to match formulas across databases, and as
+vectors over a fixed alphabet of elements, to compare many formulas at once
+"""
+import re
+from functools import lru_cache
+import numpy as np
+
+# chemical elements and "R" for residues of generic compounds, e.g. "C5H8NO4R"
+ELEMENTS = ("H", "He", "Li", "Be", "B", "C", "N", "O", "F", "Ne", "Na", "Mg", "Al", "Si", "P", "S", "Cl", "Ar", "K",
+            "Ca", "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn", "Ga", "Ge", "As", "Se", "Br", "Kr", "Rb",
+            "Sr", "Y", "Zr", "Nb", "Mo", "Tc", "Ru", "Rh", "Pd", "Ag", "Cd", "In", "Sn", "Sb", "Te", "I", "Xe", "Cs",
+            "Ba", "La", "Ce", "Pr", "Nd", "Pm", "Sm", "Eu", "Gd", "Tb", "Dy", "Ho", "Er", "Tm", "Yb", "Lu", "Hf", "Ta",
+            "W", "Re", "Os", "Ir", "Pt", "Au", "Hg", "Tl", "Pb", "Bi", "Po", "At", "Rn", "Fr", "Ra", "Ac", "Th", "Pa",
+            "U", "Np", "Pu", "Am", "Cm", "Bk", "Cf", "Es", "Fm", "Md", "No", "Lr", "Rf", "Db", "Sg", "Bh", "Hs", "Mt",
+            "Ds", "Rg", "Cn", "Nh", "Fl", "Mc", "Lv", "Ts", "Og", "R")
+ELEMENT_INDEX = {element: index for index, element in enumerate(ELEMENTS)}
+H = ELEMENT_INDEX["H"]
+TOKEN = re.compile(r"([A-Z][a-z]*|[(\[]|[)\]])(\d+(?:\.\d+)?)?")
+# water and counter ions, that are written as parts of formulas after a "." e.g. "CuSO4.5H2O", "C10H12N5O13P3.2Na"
+ADDUCTS = ("H2O", "HCl", "HBr", "NH3", "Na", "K", "Li", "Mg", "Ca", "Cl", "Br")
+# parts of hydrates and adducts e.g. "CuSO4·5H2O", "CaCl2*2H2O". A "." separates parts only in front of one of
+# ADDUCTS, that makes up the whole part e.g. "2Na", "H2O2", otherwise it is a decimal point e.g. "C2H4.5O". A count
+# with decimals in front of one of ADDUCTS is therefore read as adduct e.g. "C2H4.5Na" as "C2H4" and "5Na".
+PARTS = re.compile(r"[·•*]|\.(?=\d*(?:" + "|".join(ADDUCTS) + r")\d*(?:[·•*.]|$))")
+CACHE_SIZE = 1 << 16    # formulas kept parsed
+
+
+def _number(text: str):
+    """
+    :param text: str e.g. "2", "1.5", None
+    :return: int if the number is integral, otherwise float, 1 for None
+    """
+    if text is None:
+        return 1
+    number = float(text)
+    return int(number) if number.is_integer() else number
+
+
+def _counts(part: str):
+    """
+    :param part: formula without hydrate separators e.g. "Ca(NO3)2", may start with a multiplier e.g. "5H2O"
+    :return: dictionary element -> count, None if the formula contains unknown elements or unbalanced parentheses
+    """
+    multiplier = re.match(r"\d+(?:\.\d+)?", part)
+    factor = _number(multiplier.group(0)) if multiplier else 1
+    position = multiplier.end() if multiplier else 0
+    stack = [dict()]
+    while position < len(part):
+        match = TOKEN.match(part, position)
+        if match is None:
+            return None
+        symbol, count = match.groups()
+        position = match.end()
+        if symbol in "([":
+            if count is not None:
+                return None
+            stack.append(dict())
+        elif symbol in ")]":
+            if len(stack) == 1:
+                return None
+            group = stack.pop()
+            for element, group_count in group.items():
+                stack[-1][element] = stack[-1].get(element, 0) + group_count * _number(count)
+        elif symbol in ELEMENT_INDEX:
+            stack[-1][symbol] = stack[-1].get(symbol, 0) + _number(count)
+        else:
+            return None
+    if len(stack) != 1:
+        return None
+    return {element: count * factor for element, count in stack[0].items()}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_formula(formula: str):
+    """
+    :param formula: str e.g. "H12C6O6", "Ca(NO3)2", "CuSO4·5H2O", "C5H8NO4R"
+    :return: tuple of (element, count) in Hill order e.g. (("C", 6), ("H", 12), ("O", 6)), counts are int or float
+    for non-integer formulas. None if the formula contains anything else than elements, counts, parentheses and
+    hydrate separators.
+    """
+    if not formula:
+        return None
+    counts = dict()
+    for part in PARTS.split(formula.replace(" ", "")):
+        part_counts = _counts(part)
+        if not part_counts:
+            return None
+        for element, count in part_counts.items():
+            counts[element] = counts.get(element, 0) + count
+    return hill_order(counts)
+
+
+def hill_order(counts: dict):
+    """
+    :param counts: dictionary element -> count
+    :return: tuple of (element, count), C and H first if there is carbon, the other elements alphabetically.
+    Elements with count 0 are left out.
+    """
+    if "C" in counts:
+        order = ["C", "H"] + sorted(element for element in counts if element not in ["C", "H"])
+    else:
+        order = sorted(counts)
+    return tuple((element, counts[element]) for element in order if counts.get(element, 0) != 0)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def formula_key(formula: str, charge: int = None):
+    """
+    :param formula: str e.g. "H12C6O6"
+    :param charge: int, if given the number of H atoms is normalised to charge 0, so that formulas differing
+    by one H per charge get the same key (as -chBal in check+annotate_metabolites.py)
+    :return: str, canonical formula in Hill order e.g. "C6H12O6", the formula itself if it cannot be parsed
+    """
+    elements = parse_formula(formula)
+    if elements is None:
+        return formula
+    if charge is not None:
+        counts = dict(elements)
+        counts["H"] = counts.get("H", 0) - int(charge)
+        elements = hill_order(counts)
+    return "".join(element + (str(count) if count != 1 else "") for element, count in elements)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def element_vector(formula: str):
+    """
+    :param formula: str e.g. "C6H12O6"
+    :return: read-only numpy array of the counts of ELEMENTS, None if the formula cannot be parsed
+    """
+    elements = parse_formula(formula)
+    if elements is None:
+        return None
+    vector = np.zeros(len(ELEMENTS))
+    for element, count in elements:
+        vector[ELEMENT_INDEX[element]] = count
+    vector.flags.writeable = False
+    return vector
+
+
+def element_matrix(formulas: list):
+    """
+    :param formulas: list of str
+    :return: (numpy array formulas x ELEMENTS, boolean array of the formulas, that could be parsed), rows of
+    formulas, that could not be parsed, are 0
+    """
+    matrix = np.zeros((len(formulas), len(ELEMENTS)))
+    valid = np.zeros(len(formulas), dtype=bool)
+    for row, formula in enumerate(formulas):
+        vector = element_vector(formula) if isinstance(formula, str) else None
+        if vector is not None:
+            matrix[row] = vector
+            valid[row] = True
+    return matrix, valid
+
+
+def compare_pairs(formulas_a: list, formulas_b: list, charges_a: list = None, charges_b: list = None):
+    """
+    Compares formulas pairwise. With charges, the number of H atoms may differ by the difference of the charges
+    (+1 charge corresponds to +1 H atom). Formulas, that cannot be parsed, are only equal to the same string, empty
+    and missing formulas are equal to none.
+    :param formulas_a: list of str
+    :param formulas_b: list of str, same length
+    :param charges_a: list of charges of formulas_a, or None to compare the formulas as given
+    :param charges_b: list of charges of formulas_b, or None
+    :return: boolean numpy array, True where the formulas have the same element counts
+    """
+    matrix_a, valid_a = element_matrix(formulas_a)
+    matrix_b, valid_b = element_matrix(formulas_b)
+    difference = matrix_b - matrix_a
+    if charges_a is not None and charges_b is not None:
+        difference[:, H] -= np.asarray(charges_b, dtype=float) - np.asarray(charges_a, dtype=float)
+    equal = valid_a & valid_b & np.all(np.abs(difference) < 1e-9, axis=1)
+    same_string = np.array([isinstance(a, str) and a != "" and a == b for a, b in zip(formulas_a, formulas_b)],
+                           dtype=bool)
+    return equal | (~valid_a & ~valid_b & same_string)
+
+
+def compare(formula: str, candidates: list, charge: int = None, candidate_charges: list = None):
+    """
+    :param formula: str e.g. "C6H12O6"
+    :param candidates: list of str
+    :param charge: int, charge of <formula>, if given with <candidate_charges> the H atoms are compared charge-adjusted
+    :param candidate_charges: list of charges of <candidates>
+    :return: boolean numpy array, True for candidates with the same element counts as <formula>
+    """
+    charges = None if charge is None or candidate_charges is None else [charge] * len(candidates)
+    return compare_pairs([formula] * len(candidates), candidates, charges, candidate_charges)
+
+
+def same_formulas(formulas: list, charges: list = None):
+    """
+    :param formulas: list of str
+    :param charges: list of charges, if given the H atoms are compared charge-adjusted
+    :return: True if all formulas have the same element counts
+    """
+    if len(formulas) < 2:
+        return True
+    return bool(np.all(compare(formulas[0], formulas[1:], charges[0] if charges else None,
+                               charges[1:] if charges else None)))
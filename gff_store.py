@@ -0,0 +1,123 @@
+"""
+Gene store of a GFF3 file: one record per gene with its CDS, indexed by old_locus_tag, locus_tag, CDS Name and
+RefSeq protein id. Replaces the wide pandas frames of gffpandas and the scans over them.
+
+Records are dictionaries e.g.
+{"id": "gene-FMG_RS00005", "type": "gene", "locus_tag": "FMG_RS00005", "old_locus_tag": "FMG_0001",
+ "name": "dnaA", "cds": {"name": "WP_012290189.1", "protein_id": "WP_012290189.1", "note": None, "product": "..."}}
+"cds" is None for genes without CDS (e.g. RNA genes), missing attributes are None as in gffpandas.
+"""
+import os
+import json
+import reference_tables as rt
+
+CACHE_PATH = os.path.join("Databases", "cache", "gff")
+GENE_TYPES = {"gene", "pseudogene"}
+INDEXES = ["old_locus_tag", "locus_tag", "name", "protein_id"]
+
+
+def parse_attributes(attributes: str):
+    """
+    :param attributes: str, 9th column of a GFF3 file e.g. "ID=gene-1;Name=dnaA;locus_tag=FMG_RS00005"
+    :return: dictionary attribute -> value
+    """
+    parsed = dict()
+    for attribute in attributes.strip().split(";"):
+        key, sep, value = attribute.partition("=")
+        if sep:
+            parsed[key.strip()] = value
+    return parsed
+
+
+def read_gff(path: str):
+    """
+    Reads genes and their CDS in one pass. A CDS belongs to the gene named in its Parent attribute,
+    or without Parent to the gene before it.
+    :param path: str, GFF3 file
+    :return: list of gene records
+    """
+    genes = []
+    by_id = dict()
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            if line.startswith("##FASTA"):
+                break
+            if line.startswith("#") or line.strip() == "":
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 9:
+                continue
+            feature_type = fields[2]
+            if feature_type not in GENE_TYPES and feature_type != "CDS":
+                continue
+            attributes = parse_attributes(fields[8])
+
+            if feature_type in GENE_TYPES:
+                gene = {"id": attributes.get("ID"), "type": feature_type, "locus_tag": attributes.get("locus_tag"),
+                        "old_locus_tag": attributes.get("old_locus_tag"), "name": attributes.get("Name"),
+                        "cds": None}
+                genes.append(gene)
+                if gene["id"] is not None:
+                    by_id[gene["id"]] = gene
+                continue
+
+            parent = attributes.get("Parent", "").split(",")[0]
+            gene = by_id.get(parent) if parent else (genes[-1] if genes else None)
+            if gene is not None and gene["cds"] is None:
+                gene["cds"] = {"name": attributes.get("Name"), "protein_id": attributes.get("protein_id"),
+                               "note": attributes.get("Note"), "product": attributes.get("product")}
+    return genes
+
+
+class GffStore:
+    """
+    Genes of a GFF3 file with hash indexes
+    """
+
+    def __init__(self, genes: list):
+        """
+        :param genes: list of gene records from read_gff
+        """
+        self.genes = genes
+        self.indexes = {field: dict() for field in INDEXES}
+        for gene in genes:
+            values = {"old_locus_tag": gene["old_locus_tag"], "locus_tag": gene["locus_tag"],
+                      "name": gene["cds"]["name"] if gene["cds"] else None,
+                      "protein_id": gene["cds"]["protein_id"] if gene["cds"] else None}
+            for field, value in values.items():
+                # attributes may hold several comma separated values e.g. old_locus_tag=FMG_0001,FMG_0001a
+                for v in (value or "").split(","):
+                    if v != "":
+                        self.indexes[field].setdefault(v, []).append(gene)
+
+    def find(self, field: str, value: str):
+        """
+        :param field: "old_locus_tag", "locus_tag", "name" (Name of the CDS, the RefSeq id e.g. "WP_012290189.1")
+        or "protein_id"
+        :param value: str
+        :return: list of gene records, in the order of the file
+        """
+        return self.indexes[field].get(value, [])
+
+
+def load_gff(path: str, cache: bool = True):
+    """
+    :param path: str, GFF3 file
+    :param cache: False parses the file without using or writing the cache in CACHE_PATH
+    :return: GffStore
+    """
+    if not cache:
+        return GffStore(read_gff(path))
+
+    cache_file = os.path.join(CACHE_PATH, f"{os.path.basename(path)}-{rt.checksum(path)[:16]}.json")
+    if os.path.exists(cache_file):
+        with open(cache_file) as handle:
+            return GffStore(json.load(handle))
+
+    genes = read_gff(path)
+    os.makedirs(CACHE_PATH, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as handle:
+        json.dump(genes, handle)
+    os.replace(tmp_file, cache_file)
+    return GffStore(genes)
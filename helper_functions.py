@@ -2,11 +2,29 @@
 Useful functions for processing SMBL Data
 """
 import requests
-import sys
 import re
+import time
 import libsbml
 import xmltodict
 import json
+import formulas as fm
+import request_cache as rc
+import http_client as hc
+import replay
+from telemetry import telemetry
+
+KEGG_REST_URL = "http://rest.kegg.jp"
+KEGG_MAX_ENTRIES = 10       # maximal number of entries per KEGG get request
+KEGG_ORGANISMS_TTL = 90 * 24 * 3600     # refresh of the KEGG organism list
+KEGG_GENOME_TTL = 30 * 24 * 3600        # refresh of the gene lists of organisms
+DEFERRED_ROUNDS = 3     # rounds over requests, that failed with a transient error, at the end of map_requests
+
+_cache = None
+_cache_enabled = True
+_client = None
+_bigg_resolver = None
+_kegg_organisms = dict()
+failed_requests = []    # (function name, arguments) of requests, that were given up after the deferred rounds
 
 
 def delete_doubles(arr):
@@ -24,72 +42,208 @@ def delete_doubles(arr):
 def compare_formulas(formulas, charges=[]):
     """
     compares formulas
-    :param charges: charges of molecules as list of integers
-    :param charge_hydrogen_balance_accepted: boolean, that indecates, wether differences in the number of H atoms are
+    :param charges: charges of molecules as list of integers, if given differences in the number of H atoms are
     accepted, if the difference is accounted for in the charge
     :param formulas: list of formulas
-    :return: True, if all formulas have the same components with the same amount
-    <formula> must be string: Upper case character marks new Element  (Mg12Ag2  = [Mg12, Ag2] & MG12AG2 = [M,G12,A,G2])
-    """
-    # Separate Components of Formula
-    formulas_split = []
-    for formula in formulas:
-        formula_split = []
-
-        # separates the atoms
-        for char in formula:
-            if char.isupper():
-                formula_split.append(char)
-            else:
-                formula_split[len(formula_split) - 1] = formula_split[len(formula_split) - 1] + char
+    :return: True, if all formulas have the same components with the same amount, in any order, with parentheses
+    and hydrates resolved (see formulas.py)
+    """
+    return fm.same_formulas(formulas, charges or None)
+
+
+# ++ Persistent cache for all remote requests ++
+def configure_cache(path: str = rc.DEFAULT_PATH, enabled: bool = True, **kwargs):
+    """
+    Sets up the on-disk cache used by all remote requests
+    :param path: path to the sqlite file of the cache
+    :param enabled: False disables caching completely
+    :param kwargs: further arguments for request_cache.ResponseCache e.g. ttl, negative_ttl, max_entries
+    :return: request_cache.ResponseCache or None
+    """
+    global _cache, _cache_enabled
+    _cache_enabled = enabled
+    _cache = rc.ResponseCache(path, **kwargs) if enabled else None
+    return _cache
 
-        # adds "1" to formula, if no number is given at the end
-        for i in range(len(formula_split)):
-            if re.search("[0-9]", formula_split[i]) is None:
-                formula_split[i] = formula_split[i] + "1"
 
-        # adds separated formulas to a list
-        formulas_split.append(formula_split)
+def get_cache():
+    """
+    :return: request_cache.ResponseCache, created with default settings on first use, or None if disabled
+    """
+    if _cache is None and _cache_enabled:
+        # responses have to reach the recorder or come from the fixtures, see replay.py
+        configure_cache(enabled=replay.mode_from_environment() is None)
+    return _cache
 
-    # Iterates through all formulas
-    for j in range(len(formulas_split) - 1):
-        for component in formulas_split[j]:
-            # accounts for hydrogen - charge relationship
-            if charges and not re.search("^H(?![a-z])+([0-9])*", component) is None:
-                component = int(component.split("H")[1])
-                component = component + (charges[j + 1] - charges[j])
-                component = "H" + str(component)
 
-            # Check next element for current element
-            if component not in formulas_split[j + 1]:
-                return False
+# ++ Pooled and concurrent requests ++
+def configure_client(max_workers: int = hc.MAX_WORKERS, rate_limits: dict = None, **kwargs):
+    """
+    Sets up the HTTP client used by all remote requests
+    :param max_workers: maximal number of concurrent requests
+    :param rate_limits: dictionary host -> requests per second
+    :param kwargs: further arguments for http_client.HttpClient e.g. max_retries, breaker_cooldown
+    :return: http_client.HttpClient
+    """
+    global _client
+    if _client is not None:
+        _client.close()
+    _client = hc.HttpClient(max_workers, rate_limits, **kwargs)
+    return _client
 
-        # Check whether all components were in formula
-        if len(formulas_split[j]) != len(formulas_split[j + 1]):
-            return False
 
-    return True
+def get_client():
+    """
+    :return: http_client.HttpClient, created with default settings on first use
+    """
+    if _client is None:
+        configure_client()
+        replay.install_from_environment(_client)
+    return _client
+
+
+def map_requests(func, args_list, default=None):
+    """
+    Calls a request function for all arguments concurrently.
+    Requests failing with a transient error (see http_client.ServiceUnavailable) do not block the others, they are
+    deferred and retried at the end, once the circuits of their hosts are closed again.
+    :param func: request function e.g. bigg_request
+    :param args_list: list of argument tuples for func
+    :param default: result for requests that were not found (HTTPError) or failed in all deferred rounds
+    :return: list of results, in the order of args_list
+    """
+    deferred = []
+
+    def call(item):
+        index, args = item
+        try:
+            return func(*args)
+        except requests.HTTPError:
+            return default
+        except hc.ServiceUnavailable:
+            deferred.append(item)
+            return default
+
+    results = get_client().map(call, enumerate(args_list))
+    if deferred:
+        drain_deferred(func, sorted(deferred), results, default)
+    return results
+
+
+def drain_deferred(func, deferred: list, results: list, default=None):
+    """
+    Retries deferred requests serially, for at most DEFERRED_ROUNDS rounds.
+    Between the rounds it waits for open circuits. Requests failing in all rounds are added to failed_requests.
+    :param func: request function e.g. bigg_request
+    :param deferred: list of (index in results, argument tuple for func)
+    :param results: list of results, updated in place
+    :param default: result for requests that were not found or failed in all rounds
+    """
+    for rounds in range(DEFERRED_ROUNDS):
+        pending, deferred, wait = deferred, [], 0.0
+        for index, args in pending:
+            try:
+                results[index] = func(*args)
+            except requests.HTTPError:
+                results[index] = default
+            except hc.CircuitOpenError as e:
+                deferred.append((index, args))
+                wait = max(wait, e.retry_after)
+            except hc.ServiceUnavailable:
+                deferred.append((index, args))
+        if not deferred:
+            return
+        if rounds < DEFERRED_ROUNDS - 1:
+            time.sleep(max(wait, hc.backoff(rounds)))
+
+    print(f"[Warning] {len(deferred)} requests of {func.__name__} failed, e.g. {deferred[0][1]}")
+    for index, args in deferred:
+        results[index] = default
+        failed_requests.append((func.__name__, args))
+
+
+def report_missing(func, *args):
+    """
+    Prints a warning for a request, that map_requests returned no result for, instead of requesting it again
+    :param func: request function e.g. bigg_request
+    :param args: its arguments e.g. "atp", "metabolites"
+    """
+    reason = "failed" if (func.__name__, args) in failed_requests else "not found"
+    print(f"[Warning] {func.__name__}{args} {reason}, skipped.")
+
+
+def cached_get(endpoint: str, url: str, args: tuple, headers=None, check_status: bool = True, ttl: float = None):
+    """
+    Requests an url, if the response is not already in the cache
+    :param endpoint: str e.g. "bigg", used for keys and statistics
+    :param url: str, url to request
+    :param args: tuple of arguments that identify the request for the given endpoint
+    :param headers: dictionary of headers for the request
+    :param check_status: boolean, raise requests.HTTPError on 4xx responses
+    :param ttl: maximal age of a cached response in seconds, defaults to the ttl of the cache
+    :return: (status code, content as bytes)
+    :raises http_client.ServiceUnavailable: if the request failed on all retries
+    """
+    cache = get_cache()
+    key = rc.ResponseCache.make_key(endpoint, *args)
+    cached = cache.get(endpoint, key, ttl) if cache is not None else None
+
+    if cached is None:
+        req = get_client().get(url, endpoint=endpoint, headers=headers)
+        status, content = req.status_code, req.content
+        if cache is not None:
+            cache.put(endpoint, key, status, content)
+        if check_status:
+            req.raise_for_status()
+    else:
+        telemetry.record_cache_hit(endpoint)
+        status, content = cached
+        if check_status and status == 404:
+            raise requests.HTTPError(f"404 Client Error: Not Found for url: {url}")
+
+    return status, content
 
 
 # ++ Get Metabolite Data from BiGG Database ++
+def set_bigg_resolver(resolver):
+    """
+    Sets a local resolver, that is asked before the BiGG API (e.g. bigg_offline.BiggResolver)
+    :param resolver: object with a method get(_id, search_type), that returns None on a miss; None disables it
+    """
+    global _bigg_resolver
+    _bigg_resolver = resolver
+
+
 def bigg_request(_id: str, search_type: str = "metabolites"):
     """
-    Requests an entry from the BIGG Database
+    Requests an entry from the BIGG Database, from the local resolver if one is set and knows the entry
     :param _id: str e.g. "nh3"
     :param search_type: str e.g. "metabolites"
     :return: decoded .json into dictionary
     """
-    custom_request = "http://bigg.ucsd.edu/api/v2/universal/" + search_type + "/" + _id
-    req = requests.get(custom_request, headers={"Content-Type": "application/json"})
+    if _bigg_resolver is not None:
+        entry = _bigg_resolver.get(_id, search_type)
+        if entry is not None:
+            return entry
 
-    if not req.ok:
-        req.raise_for_status()
-        sys.exit()
+    custom_request = "http://bigg.ucsd.edu/api/v2/universal/" + search_type + "/" + _id
+    status, content = cached_get("bigg", custom_request, (search_type, _id),
+                                 headers={"Content-Type": "application/json"})
 
-    decoded_req = req.json()
+    decoded_req = json.loads(content)
     return decoded_req
 
 
+def bigg_request_many(ids: list, search_type: str = "metabolites"):
+    """
+    Requests multiple entries from the BIGG Database concurrently
+    :param ids: list of str e.g. ["nh3", "atp"]
+    :param search_type: str e.g. "metabolites"
+    :return: list of decoded .json into dictionary, None for ids that were not found
+    """
+    return map_requests(bigg_request, [(_id, search_type) for _id in ids])
+
+
 # ++ Get Metabolite Data from Biocyc Database ++
 def biocyc_request(id_org: str, db: str, id_db: str):
     """
@@ -100,25 +254,145 @@ def biocyc_request(id_org: str, db: str, id_db: str):
     :return: decoded .json into dictionary
     """
     custom_request = f"https://websvc.biocyc.org/{id_org}/foreignid?ids={db}:{id_db}&fmt=json"
-    req = requests.get(custom_request, headers={"Content-Type": "application/json"})
-
-    if not req.ok:
-        req.raise_for_status()
-        sys.exit()
+    status, content = cached_get("biocyc_foreignid", custom_request, (id_org, db, id_db),
+                                 headers={"Content-Type": "application/json"})
 
     try:
-        decoded_req = req.json()
+        decoded_req = json.loads(content)
     except json.decoder.JSONDecodeError:
         assert id_org != "meta"
         decoded_req = biocyc_request("meta", db, id_db)
     return decoded_req
 
 
+def biocyc_request_many(id_org: str, db: str, ids_db: list):
+    """
+    Requests multiple entries from the BioCyc DB concurrently
+    :param id_org: ID of organism e.g. GCF_000010185
+    :param db: Database e.g. BIGG, SEED,..
+    :param ids_db: list of IDs from Database e.g. ["atp", "nh3"]
+    :return: list of decoded .json into dictionary, None for ids that were not found
+    """
+    return map_requests(biocyc_request, [(id_org, db, id_db) for id_db in ids_db])
+
+
 # KEGG Request Function
-def kegg_get(org_id: str, kegg_id: str):
-    request_url = f"http://rest.kegg.jp/get/{org_id}:{kegg_id}"
-    req = requests.get(request_url).text.split("\n")
-    return req
+def kegg_rest(operation: str, *args, ttl: float = None):
+    """
+    Requests the KEGG REST API, replacement for KEGG().get, KEGG().find and KEGG().list of bioservices
+    :param operation: str e.g. get, find, list
+    :param args: arguments of the operation e.g. "fma:FMA_RS00005" or "compound", "C6H12O6", "formula"
+    :param ttl: maximal age of a cached response in seconds
+    :return: response as string, empty if the entry was not found
+    """
+    request_url = "/".join([KEGG_REST_URL, operation] + [str(a) for a in args])
+    status, content = cached_get("kegg_" + operation, request_url, args, check_status=False, ttl=ttl)
+    if status == 404:
+        return ""
+    return content.decode()
+
+
+def kegg_organism(name: str):
+    """
+    Resolves an organism name in KEGG, replacement for KEGG().lookfor_organism of bioservices.
+    The organism list is cached for KEGG_ORGANISMS_TTL, the resolution for the lifetime of the process.
+    :param name: str e.g. "finegoldia magna", case insensitive
+    :return: (T-number, organism code) e.g. ("T00661", "fma"), of the first organism containing the name
+    """
+    if name not in _kegg_organisms:
+        for line in kegg_rest("list", "organism", ttl=KEGG_ORGANISMS_TTL).split("\n"):
+            fields = line.split("\t")
+            if len(fields) > 2 and name.lower() in fields[2].lower():
+                _kegg_organisms[name] = (fields[0], fields[1])
+                break
+        else:
+            raise KeyError(f"Organism not found in KEGG: {name}")
+    return _kegg_organisms[name]
+
+
+def kegg_genome(org_code: str):
+    """
+    Lists all genes of an organism in KEGG, cached for KEGG_GENOME_TTL
+    :param org_code: str e.g. "fma"
+    :return: dictionary locus tag without organism prefix -> description e.g. {"FMA_RS00005": "dnaA; ..."}
+    """
+    genome = dict()
+    for line in kegg_rest("list", org_code, ttl=KEGG_GENOME_TTL).split("\n"):
+        fields = line.split("\t")
+        if len(fields) > 1:
+            genome[fields[0].split(":", 1)[-1]] = fields[-1]
+    return genome
+
+
+def split_kegg_records(text: str):
+    """
+    :param text: str, response of KEGG get with one or multiple entries
+    :return: list of str, one flatfile record per entry, each terminated by "///"
+    """
+    records = re.split(r"^///[ \t]*$\n?", text, flags=re.MULTILINE)
+    return [record + "///\n" for record in records if record.strip() != ""]
+
+
+def kegg_record_id(record: str):
+    """
+    :param record: str, KEGG flatfile record e.g. "ENTRY       EC 1.1.1.1   Enzyme\n..."
+    :return: str, lower case id of the ENTRY line e.g. "1.1.1.1"
+    """
+    tokens = record.split("\n", 1)[0].split()
+    if len(tokens) < 2:
+        return ""
+    if tokens[1] == "EC" and len(tokens) > 2:
+        return tokens[2].lower()
+    return tokens[1].lower()
+
+
+def _kegg_get_chunk(entries: list):
+    """
+    :param entries: list of at most KEGG_MAX_ENTRIES KEGG ids
+    :return: str, concatenated flatfile records, empty if none was found
+    """
+    request_url = f"{KEGG_REST_URL}/get/" + "+".join(entries)
+    req = get_client().get(request_url, endpoint="kegg_get")
+    if req.status_code == 404:
+        return ""
+    req.raise_for_status()
+    return req.text
+
+
+def kegg_get_many(entries: list):
+    """
+    Requests multiple entries from KEGG, KEGG_MAX_ENTRIES per request and the requests concurrently.
+    Uses the same cache entries as kegg_rest("get", entry).
+    :param entries: list of KEGG ids e.g. ["fma:FMA_RS00005", "ec:1.1.1.1", "R00001"]
+    :return: list of flatfile records as str, in the order of entries, empty str for entries that were not found
+    """
+    cache = get_cache()
+    results = dict()
+    missing = []
+    for entry in dict.fromkeys(entries):
+        cached = cache.get("kegg_get", rc.ResponseCache.make_key("kegg_get", entry)) if cache is not None else None
+        if cached is None:
+            missing.append(entry)
+        else:
+            telemetry.record_cache_hit("kegg_get")
+            status, content = cached
+            results[entry] = "" if status == 404 else content.decode()
+
+    chunks = [missing[k:k + KEGG_MAX_ENTRIES] for k in range(0, len(missing), KEGG_MAX_ENTRIES)]
+    for chunk, text in zip(chunks, map_requests(_kegg_get_chunk, [(chunk,) for chunk in chunks])):
+        if text is None:
+            # failed: not cached, so that it is requested again
+            results.update({entry: "" for entry in chunk})
+            continue
+        records = {kegg_record_id(record): record for record in split_kegg_records(text)}
+        for entry in chunk:
+            record = records.get(entry.split(":")[-1].lower(), "")
+            results[entry] = record
+            if cache is not None:
+                cache.put("kegg_get", rc.ResponseCache.make_key("kegg_get", entry), 200 if record else 404,
+                          record.encode())
+
+    return [results[entry] for entry in entries]
 
 
 # ++ Get Metabolite Data from BioCyc Database ++
@@ -131,16 +405,23 @@ def biocyc_get(id_org: str, id_biocyc: str, detail: str = "full"):
     :return: decoded .xml into dictionary
     """
     custom_request = f"https://websvc.biocyc.org/getxml?id={id_org}:{id_biocyc}&detail={detail}"
-    req = requests.get(custom_request)
-
-    if not req.ok:
-        req.raise_for_status()
-        sys.exit()
+    status, content = cached_get("biocyc_get", custom_request, (id_org, id_biocyc, detail))
 
-    decoded_req = xmltodict.parse(req.content)
+    decoded_req = xmltodict.parse(content)
     return decoded_req
 
 
+def biocyc_get_many(id_org: str, ids_biocyc: list, detail: str = "full"):
+    """
+    Requests multiple entries from the BioCyc DB concurrently
+    :param id_org: ID of organism e.g. GCF_000010185
+    :param ids_biocyc: list of IDs of objects e.g. ["ATP", "AMMONIA"]
+    :param detail: either none, low or full, defaults to full
+    :return: list of decoded .xml into dictionary, None for ids that were not found
+    """
+    return map_requests(biocyc_get, [(id_org, id_biocyc, detail) for id_biocyc in ids_biocyc])
+
+
 def biocyc_get_from_formula(id_org: str, formula: str):
     """
     Requests an entry from the BioCyc DB
@@ -151,20 +432,41 @@ def biocyc_get_from_formula(id_org: str, formula: str):
     :return: decoded .xml into dictionary
     """
     custom_request = f"https://websvc.biocyc.org/{id_org}/CF?cfs={formula}&fmt=json"
-    req = requests.get(custom_request)
-
-    if not req.ok:
-        req.raise_for_status()
-        sys.exit()
+    status, content = cached_get("biocyc_formula", custom_request, (id_org, formula))
 
     try:
-        decoded_req = req.json()
+        decoded_req = json.loads(content)
     except json.decoder.JSONDecodeError:
         assert id_org != "meta"
         decoded_req = biocyc_get_from_formula("meta", formula)
     return decoded_req
 
 
+def parse_bigg_reaction_string(reaction_string: str):
+    """
+    :param reaction_string: str from bigg_models_reactions.tsv e.g. "1.0 atp_c + 1.0 h2o_c -> 1.0 adp_c + 1.0 pi_c"
+    :return: dictionary metabolite id -> stoichiometric coefficient (negative for reactants)
+    """
+    compounds = re.split(" <-> | -> | <- ", reaction_string)
+    reactants = re.split(" [+] ", compounds[0])
+    products = re.split(" [+] ", compounds[1])
+
+    reac_metab = dict()
+    for reactant in reactants:
+        reactant = re.split(r"(\d+\.\d+) +", reactant)
+        if len(reactant) == 3:                                  # re.split keeps groups and ""
+            reac_metab[reactant[2]] = -float(reactant[1])
+        else:
+            reac_metab[reactant[0]] = -1.0
+    for product in products:
+        product = re.split(r"(\d+\.\d+) +", product)
+        if len(product) == 3:
+            reac_metab[product[2]] = float(product[1])
+        else:
+            reac_metab[product[0]] = 1.0
+    return reac_metab
+
+
 def make_cv_term(link: str, qual_type=libsbml.BQB_IS):
     """
     :param qual_type:
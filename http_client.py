@@ -0,0 +1,246 @@
+"""
+Pooled HTTP client with keep-alive sessions, bounded concurrency, per-host rate limits, retries with jittered
+exponential backoff and per-host circuit breakers
+"""
+import time
+import random
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import replay
+from telemetry import telemetry
+
+# maximal requests per second for each host
+HOST_RATE_LIMITS = {"bigg.ucsd.edu": 10.0,
+                    "websvc.biocyc.org": 2.0,
+                    "rest.kegg.jp": 3.0}
+DEFAULT_RATE_LIMIT = 5.0
+MAX_WORKERS = 8
+TIMEOUT = 60.0                  # seconds until a request without response is retried
+MAX_RETRIES = 4                 # retries of a failed request, before it is given up
+BACKOFF_BASE = 1.0              # seconds, doubled for every retry and jittered
+BACKOFF_MAX = 60.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+BREAKER_THRESHOLD = 5           # consecutive failures, that open the circuit of a host
+BREAKER_COOLDOWN = 30.0         # seconds until an open circuit lets a trial request through
+
+
+class ServiceUnavailable(requests.RequestException):
+    """
+    A request failed on all retries with a transient error (connection error, timeout, 429 or 5xx)
+    """
+
+
+class CircuitOpenError(ServiceUnavailable):
+    """
+    A request was not sent, because the circuit of the host is open
+    """
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"Circuit open for {host}, next trial in {retry_after:.1f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Spaces calls of wait() at least 1/<rate> seconds apart, over all threads.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a host after <threshold> consecutive failures. After <cooldown> seconds one trial request is let
+    through, which closes the circuit on success and opens it again on failure.
+    """
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened = None
+
+    def allow(self):
+        """
+        :return: 0.0, if a request may be sent, otherwise the seconds until the next trial
+        """
+        with self._lock:
+            if self._opened is None:
+                return 0.0
+            now = time.monotonic()
+            if now - self._opened >= self.cooldown:
+                self._opened = now      # half open: only this trial until the next cooldown
+                return 0.0
+            return self.cooldown - (now - self._opened)
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._opened = time.monotonic()
+
+
+def backoff(attempt: int, base: float = BACKOFF_BASE, maximum: float = BACKOFF_MAX):
+    """
+    :param attempt: number of the retry, starting at 0
+    :param base: delay of the first retry in seconds
+    :param maximum: upper bound of the delay in seconds
+    :return: delay in seconds, drawn uniformly up to base * 2^attempt ("full jitter")
+    """
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class HttpClient:
+    """
+    Shares one requests.Session (connection pool with keep-alive) between a bounded number of worker threads.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, rate_limits: dict = None, max_retries: int = MAX_RETRIES,
+                 backoff_base: float = BACKOFF_BASE, timeout: float = TIMEOUT,
+                 breaker_threshold: int = BREAKER_THRESHOLD, breaker_cooldown: float = BREAKER_COOLDOWN):
+        """
+        :param max_workers: maximal number of concurrent requests
+        :param rate_limits: dictionary host -> requests per second, overrides HOST_RATE_LIMITS
+        :param max_retries: retries of a request failing with a transient error
+        :param backoff_base: delay of the first retry in seconds, doubled for every further retry
+        :param timeout: seconds to wait for a response
+        :param breaker_threshold: consecutive failures, that open the circuit of a host
+        :param breaker_cooldown: seconds until an open circuit lets a trial request through
+        """
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.rate_limits = dict(HOST_RATE_LIMITS)
+        if rate_limits:
+            self.rate_limits.update(rate_limits)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.rate_limits) + 1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._limiters = dict()
+        self._breakers = dict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self.redirect = None        # url of a replay.StandInServer, that receives all requests
+
+    def limiter(self, host: str):
+        """
+        :param host: str e.g. "rest.kegg.jp"
+        :return: RateLimiter of the host
+        """
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = RateLimiter(self.rate_limits.get(host, DEFAULT_RATE_LIMIT))
+            return self._limiters[host]
+
+    def breaker(self, host: str):
+        """
+        :param host: str e.g. "rest.kegg.jp"
+        :return: CircuitBreaker of the host
+        """
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return self._breakers[host]
+
+    def get(self, url: str, endpoint: str = None, **kwargs):
+        """
+        GET request through the pooled session, respecting the rate limit of the host.
+        Connection errors, timeouts, 429 and 5xx responses are retried with jittered exponential backoff.
+        :param url: str
+        :param endpoint: str, name for the telemetry, defaults to the host
+        :param kwargs: further arguments for requests.Session.get
+        :return: requests.Response
+        :raises ServiceUnavailable: if all retries failed, CircuitOpenError if the circuit of the host is open
+        """
+        host = urlparse(url).hostname
+        endpoint = endpoint or host
+        breaker = self.breaker(host)
+        if self.redirect is not None:
+            url = replay.stand_in_url(url, self.redirect)
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = breaker.allow()
+            if retry_after:
+                raise CircuitOpenError(host, retry_after)
+            self.limiter(host).wait()
+
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                telemetry.record(endpoint, time.perf_counter() - start, error=True)
+                error, delay = e, 0.0
+            else:
+                telemetry.record(endpoint, time.perf_counter() - start, len(response.content),
+                                 error=response.status_code >= 500)
+                if response.status_code not in RETRY_STATUS:
+                    breaker.success()
+                    return response
+                error, delay = f"{response.status_code} {response.reason}", _retry_after(response)
+
+            breaker.failure()
+            if attempt < self.max_retries:
+                telemetry.record_retry(endpoint)
+                time.sleep(max(delay, backoff(attempt, self.backoff_base)))
+
+        raise ServiceUnavailable(f"{url} failed after {self.max_retries + 1} attempts: {error}")
+
+    def map(self, func, items):
+        """
+        Applies func to all items concurrently
+        :param func: function with one argument
+        :param items: list of arguments
+        :return: list of results, in the order of items
+        """
+        items = list(items)
+        if len(items) <= 1 or self.max_workers <= 1:
+            return [func(item) for item in items]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return list(self._executor.map(func, items))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.session.close()
+
+
+def _retry_after(response):
+    """
+    :param response: requests.Response
+    :return: seconds of the Retry-After header, 0.0 if not given as number
+    """
+    try:
+        return min(float(response.headers.get("Retry-After", 0.0)), BACKOFF_MAX)
+    except ValueError:
+        return 0.0
@@ -0,0 +1,143 @@
+"""
+Streaming parser for KEGG gene, enzyme and reaction flatfiles, replacement for KEGG().parse of bioservices.
+Only the sections used by the scripts are extracted: ENTRY, NAME, ORTHOLOGY, DBLINKS, ALL_REAC, GENES and PATHWAY.
+
+Usage: kegg_flatfile.py benchmark <path_kegg-records> [repeats]
+Compares the parser with KEGG().parse of bioservices on a file of (concatenated) KEGG flatfile records,
+e.g. saved responses of http://rest.kegg.jp/get/fma:FMG_0001+fma:FMG_0002
+"""
+import sys
+import os
+import re
+import time
+
+SECTIONS = {"ENTRY", "NAME", "ORTHOLOGY", "DBLINKS", "ALL_REAC", "GENES", "PATHWAY"}
+INDENT = 12     # width of the section column in KEGG flatfiles
+
+
+def _parse_section(key: str, lines: list):
+    """
+    :param key: section name e.g. "ORTHOLOGY"
+    :param lines: lines of the section, without the section column
+    :return: parsed section in the same form as KEGG().parse of bioservices
+    """
+    if key == "ENTRY":
+        # e.g. "FMG_0001  CDS  T00661" -> "FMG_0001", "EC 1.1.1.1  Enzyme" -> "1.1.1.1"
+        tokens = lines[0].split() if lines else []
+        if tokens[:1] == ["EC"] and len(tokens) > 1:
+            return tokens[1]
+        return tokens[0] if tokens else ""
+    if key == "NAME":
+        # e.g. ["alcohol dehydrogenase", "aldehyde reductase"], one entry per line
+        return [line.strip().rstrip(";") for line in lines if line.strip()]
+    if key == "ALL_REAC":
+        # e.g. "R00623 R00754 > R08310;", "(other) R07105"
+        return list(dict.fromkeys(re.findall(r"R\d{5}", " ".join(lines))))
+    if key == "DBLINKS":
+        # e.g. "NCBI-ProteinID: WP_002835577" -> {"NCBI-ProteinID": "WP_002835577"}
+        section = dict()
+        for line in lines:
+            db, sep, ids = line.partition(":")
+            if sep:
+                section[db.strip()] = ids.strip()
+        return section
+    if key == "GENES":
+        # e.g. "FMA: FMG_0001(adhE)" -> {"FMA": "FMG_0001(adhE)"}, continuation lines extend the previous organism
+        section = dict()
+        org = None
+        for line in lines:
+            head, sep, genes = line.partition(": ")
+            if sep and " " not in head.strip():
+                org = head.strip()
+                section[org] = genes.strip()
+            elif org is not None:
+                section[org] += " " + line.strip()
+        return section
+    # ORTHOLOGY, PATHWAY e.g. "K00001  alcohol dehydrogenase [EC:1.1.1.1]" -> {"K00001": "alcohol dehydrogenase ..."}
+    section = dict()
+    for line in lines:
+        fields = line.split(None, 1)
+        if fields:
+            section[fields[0]] = fields[1].strip() if len(fields) > 1 else ""
+    return section
+
+
+def iter_records(lines):
+    """
+    Parses KEGG flatfile records line by line
+    :param lines: iterable of lines of one or multiple records, e.g. an open file or str.splitlines()
+    :return: generator of dictionaries section -> parsed section, one per record
+    """
+    record = dict()
+    key = None
+    section = []
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("///"):
+            if key in SECTIONS:
+                record[key] = _parse_section(key, section)
+            if record:
+                yield record
+            record, key, section = dict(), None, []
+        elif line[:1] not in ["", " "]:
+            if key in SECTIONS:
+                record[key] = _parse_section(key, section)
+            key = line[:INDENT].split()[0]
+            section = [line[INDENT:]]
+        elif key in SECTIONS:
+            section.append(line[INDENT:])
+    if key in SECTIONS:
+        record[key] = _parse_section(key, section)
+    if record:
+        yield record
+
+
+def parse(text: str):
+    """
+    :param text: str, one KEGG flatfile record e.g. from helper_functions.kegg_get_many
+    :return: dictionary section -> parsed section, empty if text is empty
+    """
+    return next(iter_records(text.splitlines()), dict())
+
+
+def benchmark(text: str, repeats: int = 10):
+    """
+    :param text: str, KEGG flatfile records
+    :param repeats: number of passes over all records
+    :return: dictionary parser -> seconds per record
+    """
+    import helper_functions as hf
+    from bioservices.kegg import KEGG
+
+    records = hf.split_kegg_records(text)
+    kegg = KEGG()
+    timings = dict()
+    for name, func in [("bioservices", kegg.parse), ("kegg_flatfile", parse)]:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for record in records:
+                func(record)
+        timings[name] = (time.perf_counter() - start) / (repeats * len(records))
+    return timings
+
+
+def main(args):
+    # console access
+    if len(args) < 3 or args[1] != "benchmark":
+        print(__doc__)
+        sys.exit(1)
+    if not os.path.exists(args[2]):
+        print("[Error] %s : No such file." % args[2])
+        sys.exit(1)
+
+    with open(args[2]) as handle:
+        text = handle.read()
+    repeats = int(args[3]) if len(args) > 3 else 10
+    timings = benchmark(text, repeats)
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds * 1e6:.1f} us per record")
+    print(f"speedup: {timings['bioservices'] / timings['kegg_flatfile']:.1f}x")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
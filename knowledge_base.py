@@ -0,0 +1,701 @@
+"""
+Local knowledge base: the MetaNetX, SEED and BiGG tables of Databases/ (see README) compiled into one indexed SQLite
+file, so that scripts look up compounds by InChIKey, name, formula or alias and reactions by alias or EC number
+instead of scanning pandas tables
+
+Usage: knowledge_base.py build [path_databases] [path_knowledge-base]
+Compiles the tables, by default from Databases/ into Databases/knowledge_base.sqlite. Only tables whose source file
+changed since the last build (by checksum) are compiled again.
+       knowledge_base.py rebuild [path_databases] [path_knowledge-base]
+Compiles all tables again.
+       knowledge_base.py stats [path_knowledge-base]
+Lists the sources with checksum, version, rows and build time, and the size of the tables and indexes.
+       knowledge_base.py benchmark [workers] [path_databases] [path_knowledge-base]
+Starts <workers> processes (default 4) at once, that attach to the knowledge base or load the tables with pandas,
+and reports the time until each is ready and its peak RSS.
+"""
+import sys
+import os
+import re
+import csv
+import time
+import shutil
+import itertools
+import sqlite3
+import multiprocessing
+import pandas as pd
+import formulas as fm
+import names as nm
+import reference_tables as rt
+
+DEFAULT_PATH = os.environ.get("SAM_KNOWLEDGE_BASE", os.path.join("Databases", "knowledge_base.sqlite"))
+DATABASES_PATH = "Databases"
+VERSION = "9"       # version of the schema and formula keys, knowledge bases of other versions are compiled again
+MMAP_SIZE = 1 << 34     # bytes of the file mapped into memory, pages are only read when queried
+
+# alias namespaces of MetaNetX references, SEED aliases and BiGG database links -> common namespace
+NAMESPACES = {"bigg": "bigg", "biggm": "bigg", "bigg.metabolite": "bigg", "bigg1": "bigg", "bigg2": "bigg",
+              "kegg": "kegg", "keggc": "kegg", "kegg.compound": "kegg", "kegg compound": "kegg",
+              "seed": "seed", "seedm": "seed", "seed.compound": "seed", "seed compound": "seed",
+              "metanetx": "mnx", "mnx": "mnx", "metanetx.chemical": "mnx", "metanetx (mnx) chemical": "mnx",
+              "metacyc": "metacyc", "metacycm": "metacyc", "metacyc.compound": "metacyc", "biocyc": "metacyc",
+              "chebi": "chebi", "hmdb": "hmdb", "human metabolome database": "hmdb",
+              "inchi key": "inchikey", "inchikey": "inchikey", "name": "name",
+              "bigg.reaction": "bigg", "kegg.reaction": "kegg", "kegg reaction": "kegg",
+              "seed.reaction": "seed", "seed reaction": "seed", "metacyc.reaction": "metacyc",
+              "metacyc reaction": "metacyc", "metanetx.reaction": "mnx", "metanetx (mnx) equation": "mnx",
+              "ec-code": "ec", "ec number": "ec", "ec": "ec", "rhea": "rhea"}
+# namespaces of aliases, that classify or name entries instead of identifying them e.g. EC numbers
+CLASS_NAMESPACES = {"ec", "name", "sbo"}
+
+SCHEMA = """
+CREATE TABLE compounds (db TEXT, id TEXT, name TEXT, formula TEXT, charge TEXT, inchikey TEXT, formula_key TEXT,
+                        neutral_key TEXT);
+CREATE TABLE aliases (db TEXT, id TEXT, namespace TEXT, alias TEXT);
+CREATE TABLE reactions (db TEXT, id TEXT, name TEXT, equation TEXT, links TEXT);
+CREATE TABLE reaction_aliases (db TEXT, id TEXT, namespace TEXT, alias TEXT);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE names (name_id INTEGER PRIMARY KEY, db TEXT, id TEXT, name TEXT, norm TEXT);
+CREATE TABLE name_trigrams (trigram TEXT, db TEXT, name_id INTEGER, PRIMARY KEY (trigram, db, name_id)) WITHOUT ROWID;
+CREATE TABLE trigram_counts (trigram TEXT, db TEXT, n INTEGER, PRIMARY KEY (trigram, db)) WITHOUT ROWID;
+CREATE TABLE sources (source TEXT PRIMARY KEY, db TEXT, tbl TEXT, checksum TEXT, version TEXT, rows INTEGER,
+                      seconds REAL, built TEXT);
+"""
+INDEXES = """
+CREATE INDEX compounds_id ON compounds (db, id);
+CREATE INDEX compounds_inchikey ON compounds (db, inchikey);
+CREATE INDEX compounds_name ON compounds (db, name);
+CREATE INDEX compounds_formula ON compounds (db, formula);
+CREATE INDEX compounds_formula_key ON compounds (formula_key, db);
+CREATE INDEX compounds_neutral_key ON compounds (neutral_key, db);
+CREATE INDEX aliases_alias ON aliases (namespace, alias, db);
+CREATE INDEX aliases_id ON aliases (db, id);
+CREATE INDEX names_norm ON names (norm, db);
+CREATE INDEX names_id ON names (db, id);
+CREATE INDEX reactions_id ON reactions (db, id);
+CREATE INDEX reaction_aliases_alias ON reaction_aliases (namespace, alias, db);
+CREATE INDEX reaction_aliases_id ON reaction_aliases (db, id);
+"""
+
+
+def namespace(name: str):
+    """
+    :param name: namespace as used in one of the databases e.g. "KEGG Compound", "keggC", "BiGG"
+    :return: common namespace e.g. "kegg", unknown namespaces in lower case
+    """
+    name = name.strip().lower()
+    return NAMESPACES.get(name, name)
+
+
+def read_tsv(path: str, header_prefix: str = None):
+    """
+    Streams the rows of a tab separated table
+    :param path: str
+    :param header_prefix: str, the header is the last comment line starting with it e.g. "#ID" for MetaNetX
+    :return: generator of dictionaries column -> value
+    """
+    with open(path, newline="", encoding="utf-8") as handle:
+        lines = iter(handle)
+        if header_prefix is None:
+            header = next(lines, "")
+        else:
+            header = ""
+            for line in lines:
+                if not line.startswith("#"):
+                    lines = itertools.chain([line], lines)
+                    break
+                if line.startswith(header_prefix):
+                    header = line
+        columns = [column.lstrip("#") for column in header.rstrip("\r\n").split("\t")]
+        for row in csv.reader(lines, delimiter="\t", quoting=csv.QUOTE_NONE):
+            if row and not row[0].startswith("#"):
+                yield dict(zip(columns, row + [""] * (len(columns) - len(row))))
+
+
+def _mnx_compounds(path: str):
+    """
+    :param path: MetaNetX/chem_prop.tsv
+    :return: generator of (compound row, list of (namespace, alias))
+    """
+    for row in read_tsv(path, "#ID"):
+        inchikey = row.get("InChIKey", row.get("InChiKey", ""))
+        aliases = [("mnx", row["ID"])]
+        if ":" in row.get("reference", ""):
+            ns, alias = row["reference"].split(":", 1)
+            aliases.append((namespace(ns), alias))
+        yield ("mnx", row["ID"], row["name"], row["formula"], row["charge"], inchikey), aliases
+
+
+def seed_aliases(aliases: str):
+    """
+    :param aliases: str from the aliases column of SEED e.g. "BiGG: atp|KEGG: C00002|Name: ATP; Adenosine"
+    :return: list of (namespace, alias) e.g. [("bigg", "atp"), ("kegg", "C00002"), ("name", "ATP"), ...]
+    """
+    split = []
+    for entry in aliases.split("|"):
+        ns, sep, ids = entry.partition(": ")
+        if sep:
+            split += [(namespace(ns), alias.strip()) for alias in ids.split(";") if alias.strip() != ""]
+    return split
+
+
+def _seed_compounds(path: str):
+    """
+    :param path: SEED/compounds.tsv
+    :return: generator of (compound row, list of (namespace, alias))
+    """
+    for row in read_tsv(path):
+        aliases = [("seed", row["id"])] + seed_aliases(row["aliases"])
+        yield ("seed", row["id"], row["name"], row["formula"], row["charge"], row["inchikey"]), aliases
+
+
+def _seed_reactions(path: str):
+    """
+    :param path: SEED/reactions.tsv, ec_numbers e.g. "2.7.4.3|2.7.4.11"
+    :return: generator of (reaction row, list of (namespace, alias)), EC numbers in the namespace "ec"
+    """
+    for row in read_tsv(path):
+        aliases = [("seed", row["id"])] + seed_aliases(row["aliases"])
+        aliases += [("ec", ec.strip()) for ec in row["ec_numbers"].split("|") if ec.strip() != ""]
+        yield ("seed", row["id"], row["name"], row["equation"], ""), list(dict.fromkeys(aliases))
+
+
+def _bigg_reactions(path: str):
+    """
+    :param path: BiGG/bigg_models_reactions.tsv, database_links e.g. "EC Number: http://identifiers.org/ec-code/1.1.1.1"
+    :return: generator of (reaction row, list of (namespace, alias)), EC numbers in the namespace "ec"
+    """
+    for row in read_tsv(path):
+        aliases = [("bigg", row["bigg_id"])]
+        aliases += [("bigg", old_id) for old_id in row["old_bigg_ids"].split("; ") if old_id != ""]
+        for link in row["database_links"].split(";"):
+            ns, sep, url = link.strip().partition(": ")
+            if sep:
+                aliases.append((namespace(ns), re.split("[/:]", url)[-1]))
+        yield ("bigg", row["bigg_id"], row["name"], row["reaction_string"], row["database_links"]), \
+            list(dict.fromkeys(aliases))
+
+
+def _bigg_metabolites(path: str):
+    """
+    :param path: BiGG/bigg_models_metabolites.tsv, one row per compartment
+    :return: generator of (compound row, list of (namespace, alias)), one per universal BiGG id
+    """
+    seen = set()
+    for row in read_tsv(path):
+        universal_id = row["universal_bigg_id"]
+        if universal_id in seen:
+            continue
+        seen.add(universal_id)
+        aliases = [("bigg", universal_id)]
+        aliases += [("bigg", old_id[:-2] if re.search("_[a-z]$", old_id) else old_id)
+                    for old_id in row["old_bigg_ids"].split("; ") if old_id != ""]
+        inchikey = ""
+        for link in row["database_links"].split(";"):
+            ns, sep, url = link.strip().partition(": ")
+            if sep:
+                aliases.append((namespace(ns), re.split("[/:]", url)[-1]))
+                if namespace(ns) == "inchikey":
+                    inchikey = aliases[-1][1]
+        yield ("bigg", universal_id, row["name"], "", "", inchikey), list(dict.fromkeys(aliases))
+
+
+# (database, table, file in the databases directory, reader)
+SOURCES = [("mnx", "compounds", os.path.join("MetaNetX", "chem_prop.tsv"), _mnx_compounds),
+           ("seed", "compounds", os.path.join("SEED", "compounds.tsv"), _seed_compounds),
+           ("bigg", "compounds", os.path.join("BiGG", "bigg_models_metabolites.tsv"), _bigg_metabolites),
+           ("seed", "reactions", os.path.join("SEED", "reactions.tsv"), _seed_reactions),
+           ("bigg", "reactions", os.path.join("BiGG", "bigg_models_reactions.tsv"), _bigg_reactions)]
+ALIAS_TABLES = {"compounds": "aliases", "reactions": "reaction_aliases"}
+
+
+def source_version(path: str):
+    """
+    :param path: source file
+    :return: str, release named in the leading comment lines e.g. "4.4" of "#MNXref Version 4.4" in MetaNetX,
+    otherwise the date of the file e.g. "2023-05-12"
+    """
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            if not line.startswith("#"):
+                break
+            match = re.search(r"(?:[Vv]ersion|[Rr]elease)[\s:]+v?(\d[\w.\-]*)", line)
+            if match:
+                return match.group(1)
+    return time.strftime("%Y-%m-%d", time.localtime(os.path.getmtime(path)))
+
+
+def changed_sources(databases: str = DATABASES_PATH, built: dict = None):
+    """
+    :param databases: directory with the BiGG, MetaNetX and SEED folders
+    :param built: dictionary source file -> checksum of the compiled sources (see KnowledgeBase.sources)
+    :return: list of (database, table, source file, reader) of SOURCES, whose file exists and differs from the
+    compiled one
+    """
+    built = built or dict()
+    changed = []
+    for db, table, source, reader in SOURCES:
+        source_path = os.path.join(databases, source)
+        if os.path.exists(source_path) and built.get(source) != rt.checksum(source_path):
+            changed.append((db, table, source, reader))
+    return changed
+
+
+def build(databases: str = DATABASES_PATH, path: str = DEFAULT_PATH, full: bool = False):
+    """
+    Compiles the tables found in <databases> into the knowledge base. Tables, whose source file did not change since
+    the last build, are kept, unless <full>. The changes are made on a copy, that replaces the file when complete.
+    :param databases: directory with the BiGG, MetaNetX and SEED folders
+    :param path: path of the knowledge base
+    :param full: True compiles all tables into a new knowledge base
+    :return: dictionary source file -> number of compounds or reactions compiled
+    """
+    built = dict()
+    if not full and os.path.exists(path):
+        kb = KnowledgeBase(path)
+        if kb.version() == VERSION:
+            built = {source: row["checksum"] for source, row in kb.sources().items()}
+        kb.close()
+    incremental = len(built) > 0
+
+    changed = changed_sources(databases, built)
+    for db, table, source, reader in SOURCES:
+        if not os.path.exists(os.path.join(databases, source)):
+            print(f"[Warning] {os.path.join(databases, source)} : No such file, skipped.")
+        elif source in built and (db, table, source, reader) not in changed:
+            print(f"{source}: unchanged")
+    if incremental and not changed:
+        return dict()
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # a temporary file of the process, so that scripts compiling the knowledge base at the same time do not remove or
+    # write each other's copy. The last complete build replaces the file.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        counts = _build(databases, tmp_path, changed, incremental, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return counts
+
+
+def _build(databases: str, tmp_path: str, changed: list, incremental: bool, path: str):
+    """
+    Compiles the <changed> sources into <tmp_path>, a copy of the knowledge base <path> if <incremental>
+    :return: dictionary source file -> number of compounds or reactions compiled
+    """
+    if incremental:
+        shutil.copyfile(path, tmp_path)
+    con = sqlite3.connect(tmp_path)
+    con.execute("PRAGMA journal_mode=OFF")
+    con.execute("PRAGMA synchronous=OFF")
+    if incremental:
+        # bulk inserts and deletes are faster without indexes, they are created again below
+        for index in re.findall(r"CREATE INDEX (\w+)", INDEXES):
+            con.execute(f"DROP INDEX IF EXISTS {index}")
+    else:
+        con.executescript(SCHEMA)
+
+    counts = dict()
+    for db, table, source, reader in changed:
+        source_path = os.path.join(databases, source)
+        start = time.perf_counter()
+        con.execute(f"DELETE FROM {table} WHERE db = ?", (db,))
+        con.execute(f"DELETE FROM {ALIAS_TABLES[table]} WHERE db = ?", (db,))
+        entries = []
+        aliases = []
+        counts[source] = 0
+        for entry, entry_aliases in reader(source_path):
+            if table == "compounds":
+                entry += formula_keys(entry[3], entry[4])
+            entries.append(entry)
+            aliases += [(db, entry[1], ns, alias) for ns, alias in entry_aliases]
+            if len(entries) >= 50000:
+                _insert(con, table, entries, aliases)
+                counts[source] += len(entries)
+                entries, aliases = [], []
+        _insert(con, table, entries, aliases)
+        counts[source] += len(entries)
+        if table == "compounds":
+            _index_names(con, db)
+        seconds = time.perf_counter() - start
+        con.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (source, db, table, rt.checksum(source_path), source_version(source_path), counts[source],
+                     seconds, str(time.time())))
+        print(f"{source}: {counts[source]} {table} in {seconds:.1f} s")
+
+    start = time.perf_counter()
+    if any(table == "compounds" for db, table, source, reader in changed):
+        con.execute("DELETE FROM trigram_counts")
+        con.execute("INSERT INTO trigram_counts SELECT trigram, db, COUNT(*) FROM name_trigrams GROUP BY trigram, db")
+    con.executescript(INDEXES)
+    print(f"indexes in {time.perf_counter() - start:.1f} s")
+    con.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                    [("built", str(time.time())), ("version", VERSION),
+                     ("index_seconds", str(time.perf_counter() - start))])
+    con.commit()
+    con.close()
+    return counts
+
+
+def stats(path: str = DEFAULT_PATH):
+    """
+    :param path: path of the knowledge base
+    :return: dictionary with the keys "sources" (see KnowledgeBase.sources), "sizes" (table or index -> bytes, None if
+    SQLite was compiled without the dbstat table), "rows" (table -> rows), "built" (time of the last build) and
+    "index_seconds" (time to create the indexes)
+    """
+    kb = KnowledgeBase(path)
+    meta = dict(kb.con.execute("SELECT key, value FROM meta").fetchall())
+    names = [row[0] for row in kb.con.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index') "
+                                              "AND name NOT LIKE 'sqlite_%' ORDER BY type DESC, name")]
+    try:
+        pages = dict(kb.con.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+    except sqlite3.OperationalError:
+        pages = dict()
+    tables = [row[0] for row in kb.con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    result = {"sources": kb.sources(),
+              "sizes": {name: pages.get(name) for name in names},
+              "rows": {table: kb.con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables},
+              "built": float(meta.get("built", 0)),
+              "index_seconds": float(meta.get("index_seconds", 0))}
+    kb.close()
+    return result
+
+
+def formula_keys(formula: str, charge: str):
+    """
+    :param formula: str e.g. "C10H12N5O13P3"
+    :param charge: str e.g. "-4", may be empty
+    :return: (canonical formula, canonical formula normalised to charge 0), None (NULL) if unknown. The neutral key
+    of a proton ("H", charge 1) is empty.
+    """
+    if formula == "":
+        return None, None
+    try:
+        neutral_key = fm.formula_key(formula, int(charge))
+    except ValueError:
+        neutral_key = None
+    return fm.formula_key(formula), neutral_key
+
+
+def _index_names(con, db: str):
+    """
+    Fills the tables names and name_trigrams with the names and synonyms (aliases in the namespace "name") of the
+    compounds of <db>
+    """
+    con.execute("DELETE FROM name_trigrams WHERE db = ?", (db,))
+    con.execute("DELETE FROM names WHERE db = ?", (db,))
+    synonyms = con.execute("SELECT id, name FROM compounds WHERE db = ? AND name != '' UNION "
+                           "SELECT id, alias FROM aliases WHERE db = ? AND namespace = 'name'", (db, db)).fetchall()
+    name_id = con.execute("SELECT COALESCE(MAX(name_id), 0) FROM names").fetchone()[0]
+    seen = set()
+    for chunk in range(0, len(synonyms), 50000):
+        rows = []
+        trigram_rows = []
+        for _id, name in synonyms[chunk:chunk + 50000]:
+            norm = nm.normalise(name)
+            if (_id, norm) in seen:
+                continue
+            seen.add((_id, norm))
+            name_id += 1
+            rows.append((name_id, db, _id, name, norm))
+            trigram_rows += [(trigram, db, name_id) for trigram in nm.trigrams(norm)]
+        con.executemany("INSERT INTO names VALUES (?, ?, ?, ?, ?)", rows)
+        con.executemany("INSERT INTO name_trigrams VALUES (?, ?, ?)", sorted(trigram_rows))
+
+
+def _insert(con, table: str, entries: list, aliases: list):
+    if entries:
+        con.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(entries[0]))})", entries)
+    con.executemany(f"INSERT INTO {ALIAS_TABLES[table]} VALUES (?, ?, ?, ?)", aliases)
+
+
+class KnowledgeBase:
+    """
+    Read-only queries on a knowledge base compiled by build(). The file is memory-mapped, so that processes, that
+    open the same knowledge base, share its pages in the page cache instead of holding own copies of the tables.
+    Compounds are returned as dictionaries with the keys db, id, name, formula, charge, inchikey, formula_key and
+    neutral_key (see formula_keys), reactions with the keys db, id, name, equation and links (BiGG database_links,
+    empty for SEED).
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, mmap_size: int = MMAP_SIZE):
+        """
+        :param path: path of the knowledge base
+        :param mmap_size: bytes of the file to memory-map, 0 reads it with system calls
+        """
+        self.path = path
+        # immutable: no locks and change checks. build() never writes to a knowledge base in place, it replaces the
+        # file, and open connections keep reading the old one.
+        self.con = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        self.con.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        self.con.row_factory = sqlite3.Row
+
+    def _query(self, sql: str, params: tuple):
+        return [dict(row) for row in self.con.execute(sql, params)]
+
+    def compounds(self, db: str, inchikey: str = None, name: str = None, formula: str = None, _id: str = None):
+        """
+        :param db: "mnx", "seed" or "bigg"
+        :param inchikey: str, exact InChIKey
+        :param name: str, exact name
+        :param formula: str, exact formula
+        :param _id: str, id in the database e.g. "MNXM3", "cpd00002", "atp"
+        :return: list of compounds, that match all given criteria
+        """
+        criteria = [(column, value) for column, value in
+                    [("inchikey", inchikey), ("name", name), ("formula", formula), ("id", _id)] if value is not None]
+        sql = "SELECT * FROM compounds WHERE db = ?" + "".join(f" AND {column} = ?" for column, value in criteria)
+        return self._query(sql, (db,) + tuple(value for column, value in criteria))
+
+    def compounds_by_formula(self, db: str, formula: str, charge: int = None):
+        """
+        :param db: "mnx", "seed" or "bigg"
+        :param formula: str, in any order of elements e.g. "H12C6O6"
+        :param charge: int, if given formulas are matched after normalising the H atoms to charge 0, so that
+        formulas, that differ by one H per charge, match
+        :return: list of compounds with the same element counts, empty for an empty formula or key
+        """
+        key = fm.formula_key(formula, charge) if formula else ""
+        if key == "":
+            return []
+        column = "formula_key" if charge is None else "neutral_key"
+        return self._query(f"SELECT * FROM compounds WHERE {column} = ? AND db = ?", (key, db))
+
+    def compounds_by_name(self, db: str, name: str, k: int = 5, min_score: float = 0.7):
+        """
+        Approximate search over the normalised names and synonyms (see names.normalise), scored by the Dice
+        coefficient of their trigrams. Only names sharing one of the rarest trigrams of <name> are scored, which
+        finds all names with at least <min_score>.
+        :param db: "mnx", "seed" or "bigg"
+        :param name: str e.g. "L-Glutamic acid"
+        :param k: maximum number of compounds
+        :param min_score: minimum score between 0 and 1, 1 only finds names with the same normalised form
+        :return: list of compounds, best first, with the additional keys "synonym" (matching name) and "score"
+        """
+        query = nm.trigrams(nm.normalise(name))
+        if not query:
+            return []
+        counts = dict(self.con.execute(f"SELECT trigram, n FROM trigram_counts WHERE db = ? AND trigram IN "
+                                       f"({', '.join('?' * len(query))})", (db, *query)).fetchall())
+        # a name with score >= min_score shares at least <required> trigrams, so one of the others
+        required = max(1, -int(-min_score * len(query) // (2 - min_score)))
+        rarest = sorted(query, key=lambda trigram: counts.get(trigram, 0))[:len(query) - required + 1]
+        rarest = [trigram for trigram in rarest if trigram in counts]
+        if not rarest:
+            return []
+        candidates = self.con.execute(
+            f"SELECT id, name, norm FROM names WHERE name_id IN (SELECT name_id FROM name_trigrams WHERE db = ? "
+            f"AND trigram IN ({', '.join('?' * len(rarest))}))", (db, *rarest)).fetchall()
+
+        best = dict()
+        for _id, synonym, norm in candidates:
+            score = nm.similarity(query, nm.trigrams(norm))
+            if score >= min_score and score > best.get(_id, (0, ""))[0]:
+                best[_id] = (score, synonym)
+        ranked = sorted(best.items(), key=lambda item: (-item[1][0], item[0]))[:k]
+        compounds = []
+        for _id, (score, synonym) in ranked:
+            for compound in self.compounds(db, _id=_id):
+                compounds.append(dict(compound, synonym=synonym, score=score))
+        return compounds
+
+    def compounds_by_alias(self, db: str, ns: str, alias: str):
+        """
+        :param db: database of the compounds e.g. "seed"
+        :param ns: namespace of the alias e.g. "bigg", "kegg", "BiGG" (see NAMESPACES)
+        :param alias: str e.g. "atp"
+        :return: list of compounds of <db> with the alias
+        """
+        return self._query("SELECT DISTINCT compounds.* FROM aliases JOIN compounds "
+                           "ON compounds.db = aliases.db AND compounds.id = aliases.id "
+                           "WHERE aliases.namespace = ? AND aliases.alias = ? AND aliases.db = ?",
+                           (namespace(ns), alias, db))
+
+    def aliases(self, db: str, _id: str, ns: str = None):
+        """
+        :param db: "mnx", "seed" or "bigg"
+        :param _id: id in the database
+        :param ns: namespace, to return only its aliases
+        :return: dictionary namespace -> list of aliases
+        """
+        return self._aliases("aliases", db, _id, ns)
+
+    def _aliases(self, table: str, db: str, _id: str, ns: str = None):
+        aliases = dict()
+        for row in self.con.execute(f"SELECT namespace, alias FROM {table} WHERE db = ? AND id = ?", (db, _id)):
+            if ns is None or row[0] == namespace(ns):
+                aliases.setdefault(row[0], []).append(row[1])
+        return aliases
+
+    def reactions(self, db: str, _id: str):
+        """
+        :param db: "seed" or "bigg"
+        :param _id: id in the database e.g. "rxn00001", "PGI"
+        :return: list of reactions with the id
+        """
+        return self._query("SELECT * FROM reactions WHERE db = ? AND id = ?", (db, _id))
+
+    def reactions_by_alias(self, db: str, ns: str, alias: str):
+        """
+        :param db: database of the reactions, "seed" or "bigg"
+        :param ns: namespace of the alias e.g. "kegg.reaction", "ec-code", "mnx", "seed" (see NAMESPACES)
+        :param alias: str e.g. "R00001", "1.1.1.1"
+        :return: list of reactions of <db> with the alias
+        """
+        return self._query("SELECT DISTINCT reactions.* FROM reaction_aliases JOIN reactions "
+                           "ON reactions.db = reaction_aliases.db AND reactions.id = reaction_aliases.id "
+                           "WHERE reaction_aliases.namespace = ? AND reaction_aliases.alias = ? "
+                           "AND reaction_aliases.db = ?", (namespace(ns), alias, db))
+
+    def reaction_aliases(self, db: str, _id: str, ns: str = None):
+        """
+        :param db: "seed" or "bigg"
+        :param _id: id in the database
+        :param ns: namespace, to return only its aliases e.g. "ec"
+        :return: dictionary namespace -> list of aliases
+        """
+        return self._aliases("reaction_aliases", db, _id, ns)
+
+    def version(self):
+        """
+        :return: str, schema version of the knowledge base, "" if unknown
+        """
+        row = self.con.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else ""
+
+    def sources(self):
+        """
+        :return: dictionary source file -> dictionary with the keys source, db, tbl, checksum (SHA-256), version
+        (see source_version), rows, seconds (time to compile) and built (time of compilation)
+        """
+        return {row["source"]: row for row in self._query("SELECT * FROM sources ORDER BY source", ())}
+
+    def close(self):
+        self.con.close()
+
+
+def get_knowledge_base(path: str = DEFAULT_PATH, databases: str = DATABASES_PATH):
+    """
+    :param path: path of the knowledge base
+    :param databases: directory with the BiGG, MetaNetX and SEED folders, compiled if the knowledge base is missing,
+    of an older version or if a source file changed
+    :return: KnowledgeBase
+    """
+    if os.path.exists(path):
+        kb = KnowledgeBase(path)
+        if kb.version() == VERSION and not changed_sources(databases, {source: row["checksum"] for source, row
+                                                                       in kb.sources().items()}):
+            return kb
+        kb.close()
+    print(f"Compiling knowledge base {path} from {databases}")
+    build(databases, path)
+    return KnowledgeBase(path)
+
+
+_attached = dict()
+
+
+def attach(path: str = DEFAULT_PATH):
+    """
+    Knowledge base of the current process, opened on first use, e.g. as initializer of a worker pool:
+    multiprocessing.Pool(initializer=knowledge_base.attach), then knowledge_base.attach() in the tasks.
+    Connections are not shared with forked processes, each process opens its own one.
+    :param path: path of a compiled knowledge base (see get_knowledge_base)
+    :return: KnowledgeBase
+    """
+    key = (os.getpid(), path)
+    if key not in _attached:
+        _attached[key] = KnowledgeBase(path)
+    return _attached[key]
+
+
+def _benchmark_run(mode: str, databases: str, path: str, queue):
+    start = time.perf_counter()
+    if mode == "attach":
+        kb = attach(path)
+        found = len(kb.compounds("mnx", _id="MNXM3")) + len(kb.compounds_by_alias("seed", "bigg", "atp"))
+    else:
+        tables = dict()
+        for name, (source, header_prefix) in rt.TABLES.items():
+            source_path = os.path.join(databases, source)
+            if os.path.exists(source_path):
+                tables[name] = pd.read_csv(source_path, sep="\t", skiprows=rt.header_row(source_path, header_prefix),
+                                           dtype=str).fillna("")
+        found = int((tables["mnx_compounds"]["#ID"] == "MNXM3").sum()) if "mnx_compounds" in tables else 0
+    queue.put((mode, time.perf_counter() - start, rt.peak_rss(), found))
+
+
+def benchmark(workers: int = 4, databases: str = DATABASES_PATH, path: str = DEFAULT_PATH):
+    """
+    :param workers: number of processes started at once per mode
+    :param databases: directory with the BiGG, MetaNetX and SEED folders
+    :param path: path of the knowledge base
+    :return: list of (mode, seconds until ready, peak RSS in MB, matches of a sample query) per worker, for the
+    modes attach (knowledge base) and pandas (all tables as frames)
+    """
+    get_knowledge_base(path, databases).close()
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for mode in ["attach", "pandas"]:
+        queue = context.Queue()
+        processes = [context.Process(target=_benchmark_run, args=(mode, databases, path, queue))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        results += [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+    return results
+
+
+def main(args):
+    # console access
+    if len(args) < 2 or args[1] not in ["build", "rebuild", "stats", "benchmark"]:
+        print(__doc__)
+        sys.exit(1)
+
+    if args[1] == "stats":
+        path = args[2] if len(args) > 2 else DEFAULT_PATH
+        if not os.path.exists(path):
+            print("[Error] %s : No such file." % path)
+            sys.exit(1)
+        kb_stats = stats(path)
+        print(f"Knowledge base {path}, version {VERSION}, built "
+              f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(kb_stats['built']))}")
+        for source, row in kb_stats["sources"].items():
+            print(f"{source:<40} {row['version']:<12} {row['checksum'][:12]} {row['rows']:>9} {row['tbl']:<10} "
+                  f"{row['seconds']:7.1f} s")
+        print(f"{'indexes':<40} {'':<12} {'':<12} {'':>9} {'':<10} {kb_stats['index_seconds']:7.1f} s")
+        for name, size in kb_stats["sizes"].items():
+            rows = kb_stats["rows"].get(name)
+            print(f"{name:<40} {'' if rows is None else rows:>9} "
+                  f"{'' if size is None else f'{size / 1024 ** 2:.1f} MB':>12}")
+        return
+
+    if args[1] == "benchmark":
+        workers = int(args[2]) if len(args) > 2 else 4
+        databases = args[3] if len(args) > 3 else DATABASES_PATH
+        path = args[4] if len(args) > 4 else DEFAULT_PATH
+    else:
+        databases = args[2] if len(args) > 2 else DATABASES_PATH
+        path = args[3] if len(args) > 3 else DEFAULT_PATH
+    if not os.path.isdir(databases):
+        print("[Error] %s : No such directory." % databases)
+        sys.exit(1)
+
+    if args[1] == "benchmark":
+        for mode, seconds, rss, found in benchmark(workers, databases, path):
+            print(f"{mode:>7}: ready in {seconds:6.2f} s, peak RSS {rss:8.1f} MB, {found} match(es) of MNXM3")
+    else:
+        build(databases, path, full=args[1] == "rebuild")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,45 @@
+"""
+Normalised compound names and their trigrams, used to match names across databases regardless of case, stereo
+prefixes, salt forms and acid/anion spelling
+"""
+import re
+from functools import lru_cache
+
+STEREO = re.compile(r"(?<![a-z0-9])(?:\((?:[rsez+\-]|\d+[rsez])(?:,\s*(?:[rsez+\-]|\d+[rsez]))*\)|[dl]|dl|cis|trans|"
+                    r"alpha|beta|meso)-")
+SALTS = re.compile(r"\b(?:sodium|potassium|calcium|magnesium|lithium|ammonium|disodium|dipotassium|salt|"
+                   r"hydrochloride|hydrobromide|(?:mono|di|tri|penta|hepta)?hydrate)\b")
+
+
+@lru_cache(maxsize=100000)
+def normalise(name: str):
+    """
+    :param name: str e.g. "L-Glutamic acid sodium salt"
+    :return: str, lower case without stereo prefixes, counter ions, hydrates and punctuation, acids named as anions
+    e.g. "glutamate"
+    """
+    name = STEREO.sub("", name.lower())
+    name = SALTS.sub(" ", name)
+    name = re.sub(r"ic acid\b", "ate", name)
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", name).split())
+
+
+def trigrams(norm: str):
+    """
+    :param norm: normalised name (see normalise)
+    :return: set of trigrams of the name, padded with two spaces at the start and one at the end
+    e.g. {"  a", " at", "atp", "tp "} for "atp"
+    """
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)} if norm else set()
+
+
+def similarity(trigrams_a: set, trigrams_b: set):
+    """
+    :param trigrams_a: set of trigrams
+    :param trigrams_b: set of trigrams
+    :return: Dice coefficient, 1 for the same trigrams, 0 for none in common
+    """
+    if not trigrams_a or not trigrams_b:
+        return 0.0
+    return 2 * len(trigrams_a & trigrams_b) / (len(trigrams_a) + len(trigrams_b))
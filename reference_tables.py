@@ -0,0 +1,216 @@
+"""
+Loader for the reference tables of BiGG, MetaNetX and SEED in Databases/ (see README), that reads only the requested
+columns with compact dtypes and caches the result next to the tables, keyed by the checksum of the source file
+
+Usage: reference_tables.py benchmark <table> [column ...]
+Loads a table as full pandas frame, pruned from the source and pruned from the cache, each in a fresh process,
+and reports time, size of the frame and peak RSS. Tables: mnx_compounds, seed_compounds, seed_reactions,
+bigg_metabolites, bigg_reactions
+"""
+import sys
+import os
+import csv
+import json
+import time
+import hashlib
+import resource
+import multiprocessing
+import pandas as pd
+from telemetry import telemetry
+
+DATABASES_PATH = "Databases"
+CACHE_PATH = os.path.join("Databases", "cache", "tables")
+
+# name -> (file in the databases directory, prefix of the header line, if it is preceded by comment lines)
+TABLES = {"mnx_compounds": (os.path.join("MetaNetX", "chem_prop.tsv"), "#ID"),
+          "seed_compounds": (os.path.join("SEED", "compounds.tsv"), None),
+          "seed_reactions": (os.path.join("SEED", "reactions.tsv"), None),
+          "bigg_metabolites": (os.path.join("BiGG", "bigg_models_metabolites.tsv"), None),
+          "bigg_reactions": (os.path.join("BiGG", "bigg_models_reactions.tsv"), None)}
+CATEGORY_RATIO = 0.5    # columns with fewer distinct values per row are stored as category
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = "string[pyarrow]"
+    CACHE_FORMAT = "parquet"
+except ImportError:
+    STRING_DTYPE = "string"
+    CACHE_FORMAT = "pickle"
+
+
+def peak_rss():
+    """
+    :return: peak resident set size of this process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def checksum(path: str):
+    """
+    SHA-256 of a file. Checksums are remembered in the cache directory by size and modification time, so that
+    unchanged files are not read again.
+    :param path: str
+    :return: str, hex digest
+    """
+    index_path = os.path.join(CACHE_PATH, "checksums.json")
+    index = dict()
+    if os.path.exists(index_path):
+        with open(index_path) as handle:
+            index = json.load(handle)
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    if key in index and index[key]["size"] == stat.st_size and index[key]["mtime"] == stat.st_mtime:
+        return index[key]["sha256"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    index[key] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest.hexdigest()}
+    os.makedirs(CACHE_PATH, exist_ok=True)
+    # replaced at once, so that scripts running at the same time never read a half written index
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as handle:
+        json.dump(index, handle, indent=1)
+    os.replace(tmp_path, index_path)
+    return digest.hexdigest()
+
+
+def header_row(path: str, header_prefix: str = None):
+    """
+    :param path: str
+    :param header_prefix: str, the header is the last comment line starting with it e.g. "#ID" for MetaNetX
+    :return: number of lines before the header
+    """
+    if header_prefix is None:
+        return 0
+    row = 0
+    with open(path, encoding="utf-8") as handle:
+        for number, line in enumerate(handle):
+            if not line.startswith("#"):
+                break
+            if line.startswith(header_prefix):
+                row = number
+    return row
+
+
+def read_table(path: str, columns: list = None, header_prefix: str = None):
+    """
+    Reads a tab separated table with compact dtypes: strings as STRING_DTYPE, repetitive columns as category,
+    missing values as ""
+    :param path: str
+    :param columns: list of columns to read, all if None. Leading "#" of column names are removed.
+    :param header_prefix: see header_row
+    :return: pandas.DataFrame
+    """
+    skip = header_row(path, header_prefix)
+    names = pd.read_csv(path, sep="\t", skiprows=skip, nrows=0).columns
+    renamed = {name.lstrip("#"): name for name in names}
+    usecols = [renamed[column] for column in columns] if columns is not None else None
+    table = pd.read_csv(path, sep="\t", skiprows=skip, usecols=usecols, dtype=str, keep_default_na=False,
+                        quoting=csv.QUOTE_NONE)
+    table.columns = [name.lstrip("#") for name in table.columns]
+    for column in table.columns:
+        if table[column].nunique() < CATEGORY_RATIO * len(table):
+            table[column] = table[column].astype("category")
+        else:
+            table[column] = table[column].astype(STRING_DTYPE)
+    if columns is not None:
+        table = table[list(columns)]
+    return table
+
+
+def load_table(name: str, columns: list = None, databases: str = DATABASES_PATH, cache: bool = True,
+               path: str = None):
+    """
+    Loads a reference table, from the cache if the source file did not change
+    :param name: key of TABLES e.g. "seed_compounds"
+    :param columns: list of columns to read e.g. ["id", "name", "formula"], all if None
+    :param databases: directory with the BiGG, MetaNetX and SEED folders
+    :param cache: False reads the source file without using or writing the cache
+    :param path: path of the table, defaults to its location in <databases>
+    :return: pandas.DataFrame
+    """
+    source, header_prefix = TABLES[name]
+    path = path or os.path.join(databases, source)
+    start = time.perf_counter()
+    with telemetry.timer(f"load_{name}"):
+        if not cache:
+            table, origin = read_table(path, columns, header_prefix), "source"
+        else:
+            key = hashlib.sha256(json.dumps([checksum(path), columns, STRING_DTYPE]).encode()).hexdigest()[:16]
+            cache_file = os.path.join(CACHE_PATH, f"{name}-{key}.{CACHE_FORMAT}")
+            if os.path.exists(cache_file):
+                table, origin = _read_cache(cache_file), "cache"
+            else:
+                table, origin = read_table(path, columns, header_prefix), "source"
+                os.makedirs(CACHE_PATH, exist_ok=True)
+                _write_cache(table, cache_file)
+    print(f"Loaded {name} ({len(table)} rows, {len(table.columns)} columns) from {origin} in "
+          f"{time.perf_counter() - start:.2f} s, peak RSS {peak_rss():.0f} MB")
+    return table
+
+
+def _read_cache(cache_file: str):
+    if CACHE_FORMAT == "parquet":
+        return pd.read_parquet(cache_file)
+    return pd.read_pickle(cache_file)
+
+
+def _write_cache(table, cache_file: str):
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    if CACHE_FORMAT == "parquet":
+        table.to_parquet(tmp_file, index=False)
+    else:
+        table.to_pickle(tmp_file)
+    os.replace(tmp_file, cache_file)
+
+
+def _benchmark_run(mode: str, name: str, columns: list, queue):
+    start = time.perf_counter()
+    if mode == "full":
+        source, header_prefix = TABLES[name]
+        path = os.path.join(DATABASES_PATH, source)
+        table = pd.read_csv(path, sep="\t", skiprows=header_row(path, header_prefix)).fillna("")
+    else:
+        table = load_table(name, columns, cache=mode == "cached")
+    queue.put((mode, time.perf_counter() - start, table.memory_usage(deep=True).sum() / 1024 ** 2, peak_rss()))
+
+
+def benchmark(name: str, columns: list = None):
+    """
+    :param name: key of TABLES
+    :param columns: list of columns for the pruned loads
+    :return: list of (mode, seconds, frame size in MB, peak RSS in MB) for the modes full, pruned and cached
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    load_table(name, columns)     # fills the cache
+    for mode in ["full", "pruned", "cached"]:
+        queue = context.Queue()
+        process = context.Process(target=_benchmark_run, args=(mode, name, columns, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return results
+
+
+def main(args):
+    # console access
+    if len(args) < 3 or args[1] != "benchmark" or args[2] not in TABLES:
+        print(__doc__)
+        sys.exit(1)
+
+    source = os.path.join(DATABASES_PATH, TABLES[args[2]][0])
+    if not os.path.exists(source):
+        print("[Error] %s : No such file." % source)
+        sys.exit(1)
+
+    columns = args[3:] or None
+    for mode, seconds, size, rss in benchmark(args[2], columns):
+        print(f"{mode:>7}: {seconds:6.2f} s, frame {size:8.1f} MB, peak RSS {rss:8.1f} MB")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
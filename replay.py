@@ -0,0 +1,274 @@
+"""
+Record/replay of remote requests (BiGG, BioCyc, KEGG) for offline benchmarks and regression runs
+
+Usage: replay.py serve <path_fixture-archive> [latency_s] [error_rate] [port]
+Serves a fixture archive from a local stand-in HTTP server.
+
+Every script using helper_functions can be run in one of these modes by environment variables:
+SAM_RECORD=<archive>        requests go to the network, responses are written to the archive at exit
+SAM_REPLAY=<archive>        responses are served from the archive, nothing goes to the network
+SAM_STAND_IN=<url>          requests are sent to a stand-in server e.g. http://127.0.0.1:8765
+SAM_REPLAY_LATENCY=<s>      injected latency per request in seconds (replay only), jittered by +-50%
+SAM_REPLAY_ERROR_RATE=<p>   fraction of requests answered with 503 (replay only)
+The request cache is disabled in all of these modes. Responses are matched by their exact url, so fixtures should be
+recorded with the same script and inputs, that are replayed later.
+"""
+import sys
+import os
+import io
+import time
+import gzip
+import json
+import base64
+import random
+import atexit
+import threading
+from urllib.parse import urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+class FixtureArchive:
+    """
+    Recorded responses, keyed by url. Stored as gzip-compressed json lines.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.responses = dict()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as handle:
+                for line in handle:
+                    entry = json.loads(line)
+                    if entry["encoding"] == "base64":
+                        body = base64.b64decode(entry["body"])
+                    else:
+                        body = entry["body"].encode("utf-8")
+                    self.responses[entry["url"]] = (entry["status"], entry["content_type"], body)
+
+    def add(self, url: str, status: int, content_type: str, body: bytes):
+        with self._lock:
+            self.responses[url] = (status, content_type, body)
+
+    def get(self, url: str):
+        """
+        :param url: str
+        :return: (status, content type, body) or None
+        """
+        return self.responses.get(url)
+
+    def save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock, gzip.open(self.path, "wt", encoding="utf-8") as handle:
+            for url, (status, content_type, body) in self.responses.items():
+                try:
+                    body_str, encoding = body.decode("utf-8"), "utf-8"
+                except UnicodeDecodeError:
+                    body_str, encoding = base64.b64encode(body).decode("ascii"), "base64"
+                handle.write(json.dumps({"url": url, "status": status, "content_type": content_type,
+                                         "encoding": encoding, "body": body_str}) + "\n")
+
+
+class FaultInjector:
+    """
+    Injects latency and 503 errors into replayed responses
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed=None):
+        """
+        :param latency: mean latency per request in seconds, jittered by +-50%
+        :param error_rate: fraction of requests, that fail with 503
+        :param seed: seed for the random generator, for reproducible runs
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self):
+        """
+        Sleeps for the injected latency
+        :return: True, if the request should fail
+        """
+        with self._lock:
+            delay = self.latency * self._random.uniform(0.5, 1.5)
+            fail = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Transport adapter, that sends requests to the network and records the responses
+    """
+
+    def __init__(self, archive: FixtureArchive, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if response.status_code < 500:
+            self.archive.add(request.url, response.status_code, response.headers.get("Content-Type", ""),
+                             response.content)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Transport adapter, that answers requests from a fixture archive. Unknown urls are answered with 404.
+    """
+
+    def __init__(self, archive: FixtureArchive, faults: FaultInjector = None):
+        super().__init__()
+        self.archive = archive
+        self.faults = faults or FaultInjector()
+        self.missing = []
+
+    def send(self, request, **kwargs):
+        if self.faults.apply():
+            status, content_type, body = 503, "text/plain", b"Service Unavailable (injected)"
+        else:
+            recorded = self.archive.get(request.url)
+            if recorded is None:
+                self.missing.append(request.url)
+                status, content_type, body = 404, "text/plain", b""
+            else:
+                status, content_type, body = recorded
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict({"Content-Type": content_type})
+        response.raw = io.BytesIO(body)
+        response._content = body
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.reason = "Replayed"
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+
+class StandInServer:
+    """
+    Local HTTP server, that serves a fixture archive. Urls are mapped as http://<server>/<host>/<path>?<query>.
+    """
+
+    def __init__(self, archive: FixtureArchive, faults: FaultInjector = None, host: str = "127.0.0.1",
+                 port: int = 0):
+        self.archive = archive
+        self.faults = faults or FaultInjector()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                host, _, path = self.path.lstrip("/").partition("/")
+                recorded = None
+                if not server.faults.apply():
+                    recorded = server.archive.get(f"https://{host}/{path}") or \
+                               server.archive.get(f"http://{host}/{path}") or (404, "text/plain", b"")
+                status, content_type, body = recorded or (503, "text/plain", b"Service Unavailable (injected)")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def stand_in_url(url: str, server_url: str):
+    """
+    :param url: original url e.g. https://websvc.biocyc.org/getxml?id=meta:ATP
+    :param server_url: url of a StandInServer
+    :return: url on the stand-in server
+    """
+    parsed = urlparse(url)
+    return f"{server_url}/{parsed.netloc}{parsed.path}" + (f"?{parsed.query}" if parsed.query else "")
+
+
+def mode_from_environment():
+    """
+    :return: "record", "replay", "stand-in" or None
+    """
+    if os.environ.get("SAM_RECORD"):
+        return "record"
+    if os.environ.get("SAM_REPLAY"):
+        return "replay"
+    if os.environ.get("SAM_STAND_IN"):
+        return "stand-in"
+    return None
+
+
+def install_from_environment(client):
+    """
+    Sets up recording, replay or the stand-in server on a client, according to the environment variables
+    :param client: http_client.HttpClient
+    :return: mode as in mode_from_environment
+    """
+    mode = mode_from_environment()
+    if mode == "record":
+        archive = FixtureArchive(os.environ["SAM_RECORD"])
+        adapter = RecordingAdapter(archive, pool_maxsize=client.max_workers)
+        client.session.mount("http://", adapter)
+        client.session.mount("https://", adapter)
+        atexit.register(archive.save)
+    elif mode == "replay":
+        faults = FaultInjector(float(os.environ.get("SAM_REPLAY_LATENCY", 0.0)),
+                               float(os.environ.get("SAM_REPLAY_ERROR_RATE", 0.0)))
+        adapter = ReplayAdapter(FixtureArchive(os.environ["SAM_REPLAY"]), faults)
+        client.session.mount("http://", adapter)
+        client.session.mount("https://", adapter)
+    elif mode == "stand-in":
+        client.redirect = os.environ["SAM_STAND_IN"].rstrip("/")
+    return mode
+
+
+def main(args):
+    # console access
+    if len(args) < 3 or args[1] != "serve":
+        print(__doc__)
+        sys.exit(1)
+
+    archive_path = args[2]
+    latency = float(args[3]) if len(args) > 3 else 0.0
+    error_rate = float(args[4]) if len(args) > 4 else 0.0
+    port = int(args[5]) if len(args) > 5 else 8765
+
+    if not os.path.exists(archive_path):
+        print("[Error] %s : No such file." % archive_path)
+        sys.exit(1)
+
+    archive = FixtureArchive(archive_path)
+    server = StandInServer(archive, FaultInjector(latency, error_rate), port=port)
+    print(f"Serving {len(archive.responses)} responses on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
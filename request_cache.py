@@ -0,0 +1,200 @@
+"""
+Persistent on-disk cache for responses of remote databases (BiGG, BioCyc, KEGG)
+
+Usage: request_cache.py <stats|clear|purge> [path_cache-file]
+stats: prints number of entries, size and hit rates per endpoint (of all scripts since the last clear)
+clear: removes all entries
+purge: removes expired entries only
+"""
+import sys
+import os
+import time
+import json
+import sqlite3
+import threading
+
+DEFAULT_PATH = os.environ.get("SAM_REQUEST_CACHE", os.path.join("Databases", "cache", "remote_requests.sqlite"))
+DEFAULT_TTL = 30 * 24 * 3600            # 30 days for successful responses
+DEFAULT_NEGATIVE_TTL = 24 * 3600        # 1 day for 404 responses
+DEFAULT_MAX_ENTRIES = 500000
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of raw responses, keyed by endpoint and arguments.
+    Safe to share between threads (one connection per thread) and processes (WAL journal, busy timeout).
+    Successful responses expire after <ttl> seconds, 404 responses after <negative_ttl> seconds.
+    If more than <max_entries> are stored, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, ttl: float = DEFAULT_TTL, negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        con = self._connection()
+        con.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, status INTEGER, "
+                    "body BLOB, created REAL, accessed REAL)")
+        con.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        con.execute("CREATE TABLE IF NOT EXISTS counters (endpoint TEXT PRIMARY KEY, hits INTEGER, misses INTEGER)")
+        con.commit()
+
+    def _connection(self):
+        """
+        :return: sqlite3.Connection of the current thread
+        """
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=60)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    @staticmethod
+    def make_key(endpoint: str, *args):
+        """
+        :param endpoint: str e.g. "bigg"
+        :param args: arguments of the request
+        :return: str, unique key for endpoint and arguments
+        """
+        return endpoint + ":" + json.dumps([str(a) for a in args])
+
+    def get(self, endpoint: str, key: str, ttl: float = None):
+        """
+        :param endpoint: str, used for statistics
+        :param key: str from make_key
+        :param ttl: maximal age in seconds for this lookup, overrides the ttl of the cache (not the negative_ttl)
+        :return: (status, body) or None, if the key is missing or expired
+        """
+        con = self._connection()
+        row = con.execute("SELECT status, body, created FROM responses WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is not None:
+            status, body, created = row
+            if status == 404:
+                ttl = self.negative_ttl
+            elif ttl is None:
+                ttl = self.ttl
+            if now - created <= ttl:
+                with con:
+                    con.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                    self._count(con, endpoint, hit=True)
+                return status, body
+        with con:
+            self._count(con, endpoint, hit=False)
+        return None
+
+    def put(self, endpoint: str, key: str, status: int, body: bytes):
+        """
+        Stores a response. Only successful and 404 responses are stored, other errors are transient.
+        :param endpoint: str e.g. "bigg"
+        :param key: str from make_key
+        :param status: HTTP status code
+        :param body: raw response content
+        """
+        if status != 404 and not 200 <= status < 300:
+            return
+        now = time.time()
+        con = self._connection()
+        with con:
+            con.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, endpoint, status, sqlite3.Binary(body), now, now))
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % 1000 == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries exceeding max_entries.
+        """
+        con = self._connection()
+        with con:
+            con.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed DESC "
+                        "LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def purge(self):
+        """
+        Removes all expired entries.
+        """
+        now = time.time()
+        con = self._connection()
+        with con:
+            con.execute("DELETE FROM responses WHERE (status = 404 AND created < ?) OR (status != 404 AND created < ?)",
+                        (now - self.negative_ttl, now - self.ttl))
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        con = self._connection()
+        with con:
+            con.execute("DELETE FROM responses")
+            con.execute("DELETE FROM counters")
+
+    def stats(self):
+        """
+        :return: dictionary with number and size of entries per endpoint, as well as hits and misses of all processes
+        since the last clear
+        """
+        con = self._connection()
+        endpoints = dict()
+        for endpoint, entries, negative, size in con.execute(
+                "SELECT endpoint, COUNT(*), SUM(status = 404), SUM(LENGTH(body)) FROM responses GROUP BY endpoint"):
+            endpoints[endpoint] = {"entries": entries, "negative_entries": negative, "bytes": size}
+        counters = {endpoint: (hits, misses) for endpoint, hits, misses in
+                    con.execute("SELECT endpoint, hits, misses FROM counters")}
+        for endpoint in counters:
+            endpoints.setdefault(endpoint, {"entries": 0, "negative_entries": 0, "bytes": 0})
+        for endpoint, stat in endpoints.items():
+            hits, misses = counters.get(endpoint, (0, 0))
+            stat.update({"hits": hits, "misses": misses,
+                         "hit_rate": hits / (hits + misses) if hits + misses else 0.0})
+        return {"path": self.path,
+                "entries": sum(s["entries"] for s in endpoints.values()),
+                "bytes": sum(s["bytes"] or 0 for s in endpoints.values()),
+                "endpoints": endpoints}
+
+    @staticmethod
+    def _count(con, endpoint: str, hit: bool):
+        """
+        Counts a lookup in the cache file, so that the statistics cover all scripts using it
+        :param con: sqlite3.Connection within a transaction
+        :param endpoint: str e.g. "bigg"
+        :param hit: True for a hit, False for a miss
+        """
+        con.execute("INSERT INTO counters VALUES (?, ?, ?) ON CONFLICT (endpoint) DO UPDATE SET "
+                    "hits = hits + excluded.hits, misses = misses + excluded.misses",
+                    (endpoint, int(hit), int(not hit)))
+
+
+def main(args):
+    # console access
+    if len(args) < 2 or args[1] not in ["stats", "clear", "purge"]:
+        print(__doc__)
+        sys.exit(1)
+
+    path = args[2] if len(args) > 2 else DEFAULT_PATH
+    if not os.path.exists(path):
+        print("[Error] %s : No such file." % path)
+        sys.exit(1)
+
+    cache = ResponseCache(path)
+    if args[1] == "clear":
+        cache.clear()
+    elif args[1] == "purge":
+        cache.purge()
+    print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
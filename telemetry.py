@@ -0,0 +1,176 @@
+"""
+Telemetry of remote requests and other expensive steps: call counts, bytes, latency percentiles and histograms,
+retries, errors and cache hits per endpoint
+
+SAM_TELEMETRY=<path>        writes a JSON summary to <path> at script exit
+SAM_TELEMETRY_LIVE=1        shows request statistics next to the progress bars
+"""
+import os
+import sys
+import math
+import time
+import json
+import atexit
+import threading
+from contextlib import contextmanager
+from tqdm import tqdm
+
+# upper bounds of the latency histogram buckets in seconds
+HISTOGRAM_BUCKETS = [0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0, float("inf")]
+LIVE = os.environ.get("SAM_TELEMETRY_LIVE", "") not in ["", "0"]
+
+
+class Telemetry:
+    """
+    Thread-safe collection of per-endpoint statistics
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = dict()
+
+    def _endpoint(self, endpoint: str):
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = {"count": 0, "bytes": 0, "latencies": [], "retries": 0, "errors": 0,
+                                        "cache_hits": 0}
+        return self.endpoints[endpoint]
+
+    def record(self, endpoint: str, latency: float, nbytes: int = 0, error: bool = False):
+        """
+        Records one call
+        :param endpoint: str e.g. "bigg" or "kegg.parse"
+        :param latency: duration in seconds
+        :param nbytes: size of the response
+        :param error: True, if the call failed
+        """
+        with self._lock:
+            stat = self._endpoint(endpoint)
+            stat["count"] += 1
+            stat["bytes"] += nbytes
+            stat["latencies"].append(latency)
+            stat["errors"] += int(error)
+
+    def record_cache_hit(self, endpoint: str):
+        with self._lock:
+            self._endpoint(endpoint)["cache_hits"] += 1
+
+    def record_retry(self, endpoint: str):
+        with self._lock:
+            self._endpoint(endpoint)["retries"] += 1
+
+    @contextmanager
+    def timer(self, endpoint: str):
+        """
+        Records the duration of a block e.g. with telemetry.timer("sbml_write"): ...
+        :param endpoint: str
+        """
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(endpoint, time.perf_counter() - start, error=error)
+
+    def summary(self):
+        """
+        :return: dictionary with statistics per endpoint
+        """
+        with self._lock:
+            endpoints = {k: dict(v, latencies=sorted(v["latencies"])) for k, v in self.endpoints.items()}
+
+        summary = {"script": os.path.basename(sys.argv[0]), "wall_time_s": time.time() - self.started,
+                   "endpoints": dict()}
+        for endpoint, stat in sorted(endpoints.items()):
+            latencies = stat.pop("latencies")
+            calls = stat["count"] + stat["cache_hits"]
+            stat.update({"cache_hit_rate": stat["cache_hits"] / calls if calls else 0.0,
+                         "total_s": sum(latencies),
+                         "mean_s": sum(latencies) / len(latencies) if latencies else 0.0,
+                         "p50_s": percentile(latencies, 50),
+                         "p90_s": percentile(latencies, 90),
+                         "p99_s": percentile(latencies, 99),
+                         "max_s": latencies[-1] if latencies else 0.0,
+                         "histogram": histogram(latencies)})
+            summary["endpoints"][endpoint] = stat
+        return summary
+
+    def line(self):
+        """
+        :return: str, short summary of remote requests for a progress bar
+        """
+        with self._lock:
+            count = sum(s["count"] for s in self.endpoints.values())
+            hits = sum(s["cache_hits"] for s in self.endpoints.values())
+            errors = sum(s["errors"] for s in self.endpoints.values())
+            latency = sum(sum(s["latencies"]) for s in self.endpoints.values())
+        mean = latency / count if count else 0.0
+        hit_rate = hits / (count + hits) if count + hits else 0.0
+        return f"calls={count} cache={hit_rate:.0%} mean={mean * 1000:.0f}ms errors={errors}"
+
+    def dump(self, path: str):
+        """
+        Writes the summary as JSON
+        :param path: str
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as handle:
+            json.dump(self.summary(), handle, indent=2)
+
+
+def percentile(sorted_values: list, q: float):
+    """
+    :param sorted_values: sorted list of numbers
+    :param q: percentile between 0 and 100
+    :return: nearest-rank percentile, 0.0 for an empty list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def histogram(values: list):
+    """
+    :param values: list of latencies in seconds
+    :return: dictionary upper bucket bound -> count
+    """
+    counts = {f"<={bound}s": 0 for bound in HISTOGRAM_BUCKETS}
+    for value in values:
+        for bound in HISTOGRAM_BUCKETS:
+            if value <= bound:
+                counts[f"<={bound}s"] += 1
+                break
+    return counts
+
+
+def progress(iterable, **kwargs):
+    """
+    Replacement for tqdm, that shows the request statistics next to the bar if SAM_TELEMETRY_LIVE is set
+    :param iterable: iterable to loop over
+    :param kwargs: further arguments for tqdm
+    :return: iterator
+    """
+    bar = tqdm(iterable, **kwargs)
+    if not LIVE:
+        return bar
+    return _live(bar)
+
+
+def _live(bar):
+    last = 0.0
+    for item in bar:
+        yield item
+        now = time.monotonic()
+        if now - last > 0.5:
+            bar.set_postfix_str(telemetry.line())
+            last = now
+
+
+telemetry = Telemetry()
+if os.environ.get("SAM_TELEMETRY"):
+    atexit.register(telemetry.dump, os.environ["SAM_TELEMETRY"])
@@ -0,0 +1,122 @@
+"""
+Parity of the single species mode and the batch mode (--batch) of check+annotate_metabolites.py on the same model,
+with a knowledge base compiled from small tables and the remote lookups replaced by fixed tables
+"""
+import os
+import sys
+import importlib.util
+import libsbml
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MNX = ["#ID\tname\treference\tformula\tcharge\tmass\tInChI\tInChIKey\tSMILES",
+       "MNXM3\tATP\tkegg.compound:C00002\tC10H12N5O13P3\t-4\t503.1\t\tZKHQWZAMYRWXGA-KQYNXXCUSA-J\t",
+       "MNXM23\tpyruvate\tkegg.compound:C00022\tC3H3O3\t-1\t87.1\t\t\t",
+       "MNXM89557\tL-glutamate\tkegg.compound:C00025\tC5H8NO4\t-1\t146.1\t\t\t",
+       "MNXM285\tlactic acid\tkegg.compound:C00186\tC3H6O3\t0\t90.1\t\t\t",
+       "BIOMASS\tBIOMASS\tmnx:BIOMASS\t\t\t\t\t\t"]
+SEED = ["id\tabbreviation\tname\tformula\tmass\tsource\tinchikey\tcharge\tis_core\taliases",
+        "cpd00002\tatp\tATP\tC10H13N5O13P3\t504\tPrimary\tZKHQWZAMYRWXGA-KQYNXXCUSA-K\t-3\t1\tBiGG: atp",
+        "cpd00020\tpyr\tPyruvate\tC3H3O3\t87\tPrimary\t\t-1\t1\tBiGG: pyr",
+        "cpd99999\tnof\tno formula\t\t0\tPrimary\t\t0\t1\tBiGG: nof"]
+SEED_REACTIONS = ["id\tabbreviation\tname\tcode\tstoichiometry\tis_transport\tequation\tdefinition\treversibility\t"
+                  "direction\tabstract_reaction\tpathways\taliases\tec_numbers"]
+BIGG_METABOLITES = ["bigg_id\tuniversal_bigg_id\tname\tmodel_list\tdatabase_links\told_bigg_ids"]
+BIGG_REACTIONS = ["bigg_id\tname\treaction_string\tmodel_list\tdatabase_links\told_bigg_ids"]
+
+# id, name, formula, charge
+SPECIES = [("M_atp_c", "ATP", "C10H12N5O13P3", -4), ("M_glu__L_c", "L-glutamate", "C5H8NO4", -1),
+           ("M_xyz_c", "mystery", None, None), ("M_pyr_c", "", "C3H3O3", -1), ("M_nof_c", "", None, None),
+           ("M_bio_c", "BIOMASS", None, 0), ("M_h2o_c", "water", "H2O", None), ("M_lac_c", "", "C3H5O3", -1)]
+BIGG = {"atp": {"formulae": ["C10H12N5O13P3"], "charges": [-4],
+                "database_links": {"InChi Key": {"id": "ZKHQWZAMYRWXGA-KQYNXXCUSA-J"}}},
+        "glu__L": {"formulae": ["C5H8NO4"], "charges": [-1], "database_links": {}},
+        "xyz": None,
+        "pyr": {"formulae": ["C3H3O3"], "charges": [-1], "database_links": {}},
+        "nof": {"formulae": [], "charges": [], "database_links": {}},
+        "bio": {"formulae": [], "charges": [], "database_links": {}},
+        "h2o": {"formulae": ["H2O"], "charges": [0], "database_links": {}},
+        "lac": {"formulae": ["C3H5O3"], "charges": [-1], "database_links": {}}}
+
+
+def write_table(path, lines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as handle:
+        handle.write("\n".join(lines) + "\n")
+
+
+def write_model(path):
+    doc = libsbml.SBMLDocument(3, 1)
+    doc.enablePackage(libsbml.FbcExtension.getXmlnsL3V1V2(), "fbc", True)
+    model = doc.createModel()
+    compartment = model.createCompartment()
+    compartment.setId("c")
+    compartment.setConstant(True)
+    for spec_id, name, formula, charge in SPECIES:
+        species = model.createSpecies()
+        species.setId(spec_id)
+        species.setName(name)
+        species.setCompartment("c")
+        species.setHasOnlySubstanceUnits(False)
+        species.setBoundaryCondition(False)
+        species.setConstant(False)
+        if formula:
+            species.getPlugin("fbc").setChemicalFormula(formula)
+        if charge is not None:
+            species.getPlugin("fbc").setCharge(charge)
+    libsbml.writeSBMLToFile(doc, path)
+
+
+@pytest.fixture
+def cam(tmp_path, monkeypatch):
+    write_table(str(tmp_path / "Databases" / "MetaNetX" / "chem_prop.tsv"), MNX)
+    write_table(str(tmp_path / "Databases" / "SEED" / "compounds.tsv"), SEED)
+    write_table(str(tmp_path / "Databases" / "SEED" / "reactions.tsv"), SEED_REACTIONS)
+    write_table(str(tmp_path / "Databases" / "BiGG" / "bigg_models_metabolites.tsv"), BIGG_METABOLITES)
+    write_table(str(tmp_path / "Databases" / "BiGG" / "bigg_models_reactions.tsv"), BIGG_REACTIONS)
+    write_model(str(tmp_path / "model.xml"))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("SAM_KNOWLEDGE_BASE", raising=False)
+
+    spec = importlib.util.spec_from_file_location("check_annotate_metabolites",
+                                                  os.path.join(ROOT, "check+annotate_metabolites.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    formulas = [formula for _, _, formula, _ in SPECIES if formula]
+    lookups = {"bigg": BIGG, "biocyc_foreignid": {key: [{"STATUS": 0}] for key in BIGG},
+               "biocyc_formula": {formula: [{"STATUS": 0}] for formula in formulas},
+               "biocyc_compound": {}, "kegg_formula": {formula: "cpd:C1\tx\ncpd:C2\ty" for formula in formulas}}
+    monkeypatch.setattr(module, "resolve_lookups", lambda species_keys: lookups)
+    module.lookups = lookups
+    monkeypatch.setattr(module.hf, "kegg_organism", lambda name: ("T00661", "fma"))
+    return module
+
+
+@pytest.mark.parametrize("switches", [[], ["-chBal"]])
+def test_batch_mode_equals_single_species_mode(cam, tmp_path, switches):
+    outputs = dict()
+    for mode in ["single", "batch"]:
+        mismatches, formula_search = str(tmp_path / f"{mode}_mismatches.tsv"), str(tmp_path / f"{mode}_search.tsv")
+        cam.main(["check+annotate_metabolites.py", "model.xml", mismatches, formula_search] + switches +
+                 (["--batch"] if mode == "batch" else []))
+        with open(mismatches) as handle_mismatches, open(formula_search) as handle_search:
+            outputs[mode] = handle_mismatches.read(), handle_search.read()
+
+    assert outputs["single"] == outputs["batch"]
+    # species without formula are always mismatches, also if a compound without formula is found for them
+    assert "M_nof_c" in outputs["batch"][0]
+    assert "M_xyz_c" in outputs["batch"][0]
+    # with -chBal formulas are searched normalised to charge 0, lactate finds lactic acid
+    assert ("MNXM285" in outputs["batch"][1]) == ("-chBal" in switches)
+
+
+@pytest.mark.parametrize("switches", [[], ["--batch"]])
+def test_failed_biocyc_formula_search_is_reported(cam, tmp_path, monkeypatch, capsys, switches):
+    cam.lookups["biocyc_formula"]["C3H3O3"] = None
+    monkeypatch.setattr(cam.hf, "failed_requests", [("biocyc_get_from_formula", (cam.BIOCYC_ORG, "C3H3O3"))])
+    cam.main(["check+annotate_metabolites.py", "model.xml", str(tmp_path / "mismatches.tsv"),
+              str(tmp_path / "search.tsv")] + switches)
+
+    assert f"[Warning] biocyc_get_from_formula{(cam.BIOCYC_ORG, 'C3H3O3')} failed, skipped." in capsys.readouterr().out